@@ -1,35 +1,64 @@
+import asyncio
 import dspy
 import os
-from typing import List, Optional
+import logging
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
 from dotenv import load_dotenv
 
+from prediction_cache import PredictionCache, signature_fingerprint
+
+logger = logging.getLogger(__name__)
+
 # Remove tool import
 # from tools import MapSummaryTool
 
 # Load environment variables (optional, for API keys/URLs)
 load_dotenv()
 
+# Server side tool calls astream makes at most per turn before the model has to answer
+AGENT_MAX_TOOL_ROUNDS = int(os.getenv('AGENT_MAX_TOOL_ROUNDS', 3))
+
 # --- Agent Definition ---
 
 class MapInteractionSignature(dspy.Signature):
-    """Determine the next step: use a tool (zoom, get_map_summary) or provide a final textual answer."""
+    """Determine the next step: use a tool (zoom, get_map_summary, query_data) or provide a final textual answer."""
     chat_history = dspy.InputField(desc="The recent conversation history.")
     user_input = dspy.InputField(desc="The latest message from the user.")
     image_description = dspy.InputField(desc="(Optional) A textual description of the current map view, ONLY provided after a zoom or map summary action.")
-    available_tools = dspy.InputField(desc="List of available tools: [zoom, get_map_summary]")
-    tool_result = dspy.InputField(desc="(Optional) The result from the last tool execution (e.g., map summary data). If the last action was NOT a tool call, this will be empty.")
+    available_tools = dspy.InputField(desc="List of available tools, e.g. [zoom, get_map_summary, query_data]")
+    tool_result = dspy.InputField(desc="(Optional) The result from the last tool execution (e.g., map summary data or query results), or the results of every tool run so far this turn, by tool name. If the last action was NOT a tool call, this will be empty.")
 
-    action = dspy.OutputField(desc="One of: [zoom, get_map_summary, final_answer]")
+    action = dspy.OutputField(desc="One of: [zoom, get_map_summary, query_data, final_answer]")
     action_input = dspy.OutputField(
         desc=("If action is 'zoom', provide JSON arguments (e.g., {\"location_name\": \"Paris\", \"zoom_level\": 12}). "
               "If action is 'get_map_summary', provide an empty JSON object ({}). "
+              "If action is 'query_data', provide the question for the AIS database in plain language (it also holds "
+              "detected AIS gaps, loitering and ship-to-ship rendezvous events), with concrete "
+              "values for times, areas and vessels (e.g. \"How many tankers were moving faster than 15 knots on 2024-01-01?\"). "
               "If action is 'final_answer', provide the final text response."),
         json_schema={'type': 'string'} # Keep as string, parsing happens later
     )
 
 class MapChatAgent(dspy.Module):
-    def __init__(self):
+    def __init__(self, map_summary_tool: Optional[Callable[[dict], Awaitable[dict]]] = None,
+                 query_tool: Optional[Callable[[str], Awaitable[dict]]] = None,
+                 prediction_cache: Optional[PredictionCache] = None):
+        """
+        Args:
+            map_summary_tool: (Optional) Async callable taking a viewport bbox dict
+                              (min_lat, max_lat, min_lon, max_lon) and returning a
+                              map summary. When set, astream runs get_map_summary on
+                              the server instead of asking the frontend for it.
+            query_tool: (Optional) Async callable answering a plain language data
+                        question, e.g. DataSteward.answer. Enables the query_data action.
+            prediction_cache: (Optional) Cache of predictions by model, signature and
+                              inputs. Hits skip the LM call entirely.
+        """
         super().__init__()
+        self.map_summary_tool = map_summary_tool
+        self.query_tool = query_tool
+        self.prediction_cache = prediction_cache
         # Remove tool initialization
         # self.tools = {
         #     "zoom": None, # Zoom is handled via frontend signal, not a DSPy tool instance
@@ -39,7 +68,7 @@ class MapChatAgent(dspy.Module):
 
         # Ensure dspy.settings.lm is configured (usually done in main.py)
         if not dspy.settings.lm:
-            print("Warning: dspy.settings.lm not configured. Predictor may fail.")
+            logger.warning("dspy.settings.lm not configured. Predictor may fail.")
             # Optional: Add fallback configuration if needed, similar to before
             # ... (fallback config logic) ...
         
@@ -47,24 +76,164 @@ class MapChatAgent(dspy.Module):
         # We might need a more complex module if we want the LLM to reason *about* the tool result
         # For now, Predict generates the next action based on history/input/tool_result
         self.predictor = dspy.Predict(MapInteractionSignature)
+        self._signature = signature_fingerprint(self.predictor.signature)
 
-    def forward(self, user_input: str, chat_history: List[str] = [], image_description: Optional[str] = None, tool_result: Optional[dict] = None):
-        """Processes input, potentially predicts tool use, or generates final answer."""
+    @staticmethod
+    def _clean_tool_result(tool_result: Optional[dict]) -> Optional[dict]:
+        if not tool_result:
+            return tool_result
+        # Summaries from the frontend carry a screenshot data URL, megabytes of base64 the LM can't use
+        return {key: value for key, value in tool_result.items() if key != 'screenshotDataURL'}
+
+    def _inputs(self, user_input: str, chat_history: List[str], image_description: Optional[str], tool_result: Optional[dict]) -> dict:
         history_str = "\n".join(chat_history)
+        tool_result = self._clean_tool_result(tool_result)
         tool_result_str = str(tool_result) if tool_result else ""
-
-        # Call the Predict module
         # The available_tools input might be less critical now, but keep for context
-        prediction = self.predictor(
+        return dict(
             chat_history=history_str,
             user_input=user_input,
             image_description=image_description or "",
-            available_tools=str(["zoom", "get_map_summary"]), # Still inform LLM about possible actions
+            available_tools=str(["zoom", "get_map_summary"] + (["query_data"] if self.query_tool else [])), # Still inform LLM about possible actions
             tool_result=tool_result_str
         )
 
+    def _cache_key(self, user_input: str, chat_history: List[str], image_description: Optional[str], tool_result: Optional[dict]) -> Optional[str]:
+        if self.prediction_cache is None:
+            return None
+        # tool_result is hashed as a dict, so its coordinates can be bucketed
+        inputs = dict(
+            chat_history=list(chat_history),
+            user_input=user_input,
+            image_description=image_description or "",
+            available_tools=self._inputs("", [], None, None)["available_tools"],
+            tool_result=self._clean_tool_result(tool_result) or None,
+        )
+        return self.prediction_cache.key(getattr(dspy.settings.lm, "model", None), self._signature, inputs)
+
+    def _cached_prediction(self, key: Optional[str]) -> Optional[dspy.Prediction]:
+        fields = self.prediction_cache.get(key) if key else None
+        return dspy.Prediction(**fields) if fields else None
+
+    def _cache_prediction(self, key: Optional[str], prediction):
+        action = getattr(prediction, "action", None)
+        if key and action:
+            # Unparseable outputs have no action, those are asked again
+            self.prediction_cache.put(key, {"action": action, "action_input": getattr(prediction, "action_input", "")})
+
+    def forward(self, user_input: str, chat_history: List[str] = [], image_description: Optional[str] = None, tool_result: Optional[dict] = None):
+        """Processes input, potentially predicts tool use, or generates final answer."""
+        key = self._cache_key(user_input, chat_history, image_description, tool_result)
+        prediction = self._cached_prediction(key)
+        if prediction is not None:
+            return prediction
+
+        # Call the Predict module
+        prediction = self.predictor(**self._inputs(user_input, chat_history, image_description, tool_result))
+        self._cache_prediction(key, prediction)
+
         return prediction
 
+    async def _stream_predict(self, inputs: dict, cache_key: Optional[str] = None) -> AsyncIterator[dict]:
+        # The cache may read and write its SQLite file, off the event loop
+        cached = await asyncio.to_thread(self._cached_prediction, cache_key) if cache_key else None
+        if cached is not None:
+            # Same events as a streamed prediction, the answer in one chunk
+            yield {"type": "action", "action": cached.action}
+            if cached.action == "final_answer" and cached.action_input:
+                yield {"type": "text", "content": cached.action_input}
+            yield {"type": "prediction", "prediction": cached}
+            return
+
+        # Listeners keep per-stream state, so each call gets its own
+        program = dspy.streamify(
+            self.predictor,
+            stream_listeners=[
+                dspy.streaming.StreamListener(signature_field_name="action"),
+                dspy.streaming.StreamListener(signature_field_name="action_input"),
+            ],
+        )
+        action_chunks = []
+        action = None
+        async with aclosing(program(**inputs)) as stream:
+            async for value in stream:
+                if isinstance(value, dspy.streaming.StreamResponse):
+                    if value.signature_field_name == "action":
+                        action_chunks.append(value.chunk)
+                        if value.is_last_chunk:
+                            action = "".join(action_chunks).strip()
+                            yield {"type": "action", "action": action}
+                    elif value.signature_field_name == "action_input" and action == "final_answer" and value.chunk:
+                        yield {"type": "text", "content": value.chunk}
+                elif isinstance(value, dspy.Prediction):
+                    if cache_key:
+                        await asyncio.to_thread(self._cache_prediction, cache_key, value)
+                    yield {"type": "prediction", "prediction": value}
+
+    def _server_tools(self, viewport: Optional[dict], tool_result: Optional[dict]) -> Dict[str, Callable[[str], Awaitable[dict]]]:
+        """The tools astream can run itself this turn, by action name, taking the action_input."""
+        if tool_result:
+            # The turn already carries a tool result, answer with it
+            return {}
+        tools = {}
+        if self.map_summary_tool is not None and viewport is not None:
+            tools["get_map_summary"] = lambda action_input: self.map_summary_tool(viewport)
+        if self.query_tool is not None:
+            tools["query_data"] = self.query_tool
+        return tools
+
+    async def astream(self, user_input: str, chat_history: List[str] = [], image_description: Optional[str] = None,
+                      tool_result: Optional[dict] = None, viewport: Optional[dict] = None) -> AsyncIterator[dict]:
+        """
+        Streaming version of forward. The LM call runs in a worker thread and its
+        tokens are yielded as they arrive, as events:
+
+            {"type": "action", "action": "...", "server_side": bool}   once the action field is complete
+            {"type": "text", "content": "..."}     chunks of action_input, only for final_answer
+            {"type": "tool_result", "tool_name": "...", "result": {...}}   a tool the agent ran itself
+            {"type": "prediction", "prediction": Prediction}   last, the parsed result
+
+        The action field comes before action_input in the output, so a tool call
+        is known before its arguments are generated.
+
+        Server side tools (server_side is True) are run here: get_map_summary
+        when a map_summary_tool and the viewport of the map are available, and
+        query_data with the query_tool. The question is then predicted again
+        with the results of every tool run so far, by tool name, all in this one
+        stream, for up to AGENT_MAX_TOOL_ROUNDS tool calls (e.g. a map summary,
+        then a query).
+        """
+        tools = self._server_tools(viewport, tool_result)
+        # A second call of the same tool gets a numbered name (query_data_2), so no result is lost
+        tool_results = {}
+        for round_number in range(AGENT_MAX_TOOL_ROUNDS + 1):
+            # Out of rounds, the last prediction gets no server side tools
+            round_tools = tools if round_number < AGENT_MAX_TOOL_ROUNDS else {}
+            inputs = self._inputs(user_input, chat_history, image_description, tool_result)
+            cache_key = self._cache_key(user_input, chat_history, image_description, tool_result)
+            prediction = None
+            async with aclosing(self._stream_predict(inputs, cache_key)) as events:
+                async for event in events:
+                    if event["type"] == "action":
+                        event["server_side"] = event["action"] in round_tools
+                    elif event["type"] == "prediction":
+                        prediction = event["prediction"]
+                        if getattr(prediction, "action", None) in round_tools:
+                            continue
+                    yield event
+            tool_name = getattr(prediction, "action", None)
+            if tool_name not in round_tools:
+                return
+
+            result = await round_tools[tool_name](getattr(prediction, "action_input", "") or "")
+            yield {"type": "tool_result", "tool_name": tool_name, "result": result}
+            name, calls = tool_name, 1
+            while name in tool_results:
+                calls += 1
+                name = f"{tool_name}_{calls}"
+            tool_results[name] = result
+            tool_result = dict(tool_results)
+
 # Example usage (primarily for basic testing, main interaction via API)
 if __name__ == '__main__':
     # Configure LM (replace with your actual setup)
@@ -0,0 +1,493 @@
+"""
+Maritime behavior analytics over ais_data: AIS transmission gaps, loitering
+and ship-to-ship rendezvous, written to an events table the data steward
+(and so the chat agent) can query.
+
+Runs are incremental. A watermark per source table records the newest
+BaseDateTime already analyzed, and each run only looks at pings after it,
+plus ANALYTICS_LOOKBACK_HOURS of context so episodes that started before
+the watermark are detected whole. Events are keyed by type, vessel(s) and
+start time in a ReplacingMergeTree, so an episode that is still going on is
+rewritten with a later end time by the next run instead of duplicated.
+
+    gap         No report from a vessel for ANALYTICS_GAP_MINUTES or more. Found
+                with ClickHouse window functions over the new pings plus each
+                vessel's last report before the watermark.
+    loitering   A vessel slower than ANALYTICS_LOITER_MAX_SOG, not moored, staying
+                within ANALYTICS_LOITER_RADIUS_M of one point for
+                ANALYTICS_LOITER_MINUTES or more. One vectorized NumPy pass over
+                all vessels.
+    rendezvous  Two slow, non-moored vessels within ANALYTICS_RENDEZVOUS_DISTANCE_M
+                of each other for ANALYTICS_RENDEZVOUS_MINUTES or more. Positions
+                are averaged per vessel and time bucket and hashed to grid cells
+                the size of the distance, so only vessels in the same or a
+                neighbouring cell and bucket are compared.
+
+Episodes longer than the lookback are split into several events.
+
+Usage (from the ai/ directory, e.g. hourly from cron):
+    python analytics.py --status
+    python analytics.py                                  # analyze everything new
+    python analytics.py --since 2024-01-01 --until 2024-01-02   # (re)analyze a range
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from data import get_clickhouse_client
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Table the events are written to
+ANALYTICS_EVENTS_TABLE = os.getenv('ANALYTICS_EVENTS_TABLE', 'ais_events')
+# Silence from a vessel reported as a gap
+ANALYTICS_GAP_MINUTES = float(os.getenv('ANALYTICS_GAP_MINUTES', 60))
+# How far before the watermark a vessel's previous report is looked for
+ANALYTICS_GAP_LOOKBACK_HOURS = float(os.getenv('ANALYTICS_GAP_LOOKBACK_HOURS', 48))
+# Context before the watermark for loitering and rendezvous episodes
+ANALYTICS_LOOKBACK_HOURS = float(os.getenv('ANALYTICS_LOOKBACK_HOURS', 6))
+ANALYTICS_LOITER_MAX_SOG = float(os.getenv('ANALYTICS_LOITER_MAX_SOG', 2))
+ANALYTICS_LOITER_RADIUS_M = float(os.getenv('ANALYTICS_LOITER_RADIUS_M', 1000))
+ANALYTICS_LOITER_MINUTES = float(os.getenv('ANALYTICS_LOITER_MINUTES', 60))
+ANALYTICS_RENDEZVOUS_MAX_SOG = float(os.getenv('ANALYTICS_RENDEZVOUS_MAX_SOG', 3))
+ANALYTICS_RENDEZVOUS_DISTANCE_M = float(os.getenv('ANALYTICS_RENDEZVOUS_DISTANCE_M', 500))
+ANALYTICS_RENDEZVOUS_MINUTES = float(os.getenv('ANALYTICS_RENDEZVOUS_MINUTES', 30))
+# Positions are averaged over buckets of this length before vessels are paired
+ANALYTICS_RENDEZVOUS_BUCKET_MINUTES = float(os.getenv('ANALYTICS_RENDEZVOUS_BUCKET_MINUTES', 10))
+# Most new data analyzed per pass, a long backlog is worked through in passes
+ANALYTICS_BATCH_HOURS = float(os.getenv('ANALYTICS_BATCH_HOURS', 6))
+# The newest minutes are left for the next run so late batches of live data aren't skipped
+ANALYTICS_SETTLE_MINUTES = float(os.getenv('ANALYTICS_SETTLE_MINUTES', 5))
+
+WATERMARKS_TABLE = 'analytics_watermarks'
+EVENT_TYPES = ('gap', 'loitering', 'rendezvous')
+# AIS navigational status 'moored': alongside in port, neither loitering nor meeting anyone
+STATUS_MOORED = 5
+EARTH_RADIUS_M = 6_371_008.8
+METERS_PER_DEGREE = np.pi * EARTH_RADIUS_M / 180
+
+EVENTS_TABLE_DDL = '''
+CREATE TABLE IF NOT EXISTS {table} (
+    EventType LowCardinality(String),
+    MMSI UInt32,
+    OtherMMSI UInt32,
+    StartTime DateTime64(3, 'UTC'),
+    EndTime DateTime64(3, 'UTC'),
+    LAT Float64,
+    LON Float64,
+    DurationSeconds UInt32,
+    DistanceMeters Float32,
+    Pings UInt32,
+    DetectedAt DateTime64(3, 'UTC')
+) ENGINE = ReplacingMergeTree(DetectedAt)
+PARTITION BY toYYYYMM(StartTime)
+ORDER BY (EventType, MMSI, OtherMMSI, StartTime)
+'''
+
+WATERMARKS_TABLE_DDL = f'''
+CREATE TABLE IF NOT EXISTS {WATERMARKS_TABLE} (
+    SourceTable String,
+    EventsTable String,
+    Watermark DateTime64(3, 'UTC'),
+    UpdatedAt DateTime64(3, 'UTC')
+) ENGINE = ReplacingMergeTree(UpdatedAt)
+ORDER BY (SourceTable, EventsTable)
+'''
+
+EVENTS_SCHEMA = pa.schema([
+    ('EventType', pa.string()),
+    ('MMSI', pa.uint32()),
+    ('OtherMMSI', pa.uint32()),
+    ('StartTime', pa.timestamp('ms', tz='UTC')),
+    ('EndTime', pa.timestamp('ms', tz='UTC')),
+    ('LAT', pa.float64()),
+    ('LON', pa.float64()),
+    ('DurationSeconds', pa.uint32()),
+    ('DistanceMeters', pa.float32()),
+    ('Pings', pa.uint32()),
+    ('DetectedAt', pa.timestamp('ms', tz='UTC')),
+])
+
+def _utc(value: datetime) -> datetime:
+    """Aware UTC datetime, whole seconds. Query parameters are bound with second precision."""
+    value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+    return value.replace(microsecond=0)
+
+def _ms(value: datetime) -> int:
+    return int(_utc(value).timestamp() * 1000)
+
+def _epoch_ms(column: pa.ChunkedArray) -> np.ndarray:
+    """A timestamp column as epoch milliseconds."""
+    return column.cast(pa.timestamp('ms', tz='UTC')).cast(pa.int64()).to_numpy()
+
+def haversine_m(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Great circle distance in metres."""
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def _events(event_type: str, mmsi, other, start_ms, end_ms, lat, lon, distance, pings) -> pa.Table:
+    """An EVENTS_SCHEMA table from per event arrays, times in epoch milliseconds."""
+    start_ms, end_ms = np.asarray(start_ms, dtype=np.int64), np.asarray(end_ms, dtype=np.int64)
+    n = len(start_ms)
+    return pa.table({
+        'EventType': pa.array([event_type] * n, pa.string()),
+        'MMSI': pa.array(np.asarray(mmsi, dtype=np.uint32)),
+        'OtherMMSI': pa.array(np.asarray(other, dtype=np.uint32) if other is not None else np.zeros(n, np.uint32)),
+        'StartTime': pa.array(start_ms, pa.timestamp('ms', tz='UTC')),
+        'EndTime': pa.array(end_ms, pa.timestamp('ms', tz='UTC')),
+        'LAT': pa.array(np.asarray(lat, dtype=np.float64)),
+        'LON': pa.array(np.asarray(lon, dtype=np.float64)),
+        'DurationSeconds': pa.array(((end_ms - start_ms) // 1000).astype(np.uint32)),
+        'DistanceMeters': pa.array(np.asarray(distance, dtype=np.float32)),
+        'Pings': pa.array(np.asarray(pings, dtype=np.uint32)),
+        'DetectedAt': pa.array(np.full(n, int(time.time() * 1000), dtype=np.int64), pa.timestamp('ms', tz='UTC')),
+    }, schema=EVENTS_SCHEMA)
+
+def build_gap_query(since: datetime, until: datetime, table: str = 'ais_data',
+                    gap_minutes: float = ANALYTICS_GAP_MINUTES,
+                    lookback_hours: float = ANALYTICS_GAP_LOOKBACK_HOURS) -> Tuple[str, dict]:
+    """
+    Builds the query for gaps ending in (since, until]. Every vessel seen in
+    the window gets its last report of the lookback before since prepended,
+    then lagInFrame pairs each report with the previous one of its vessel.
+    Only the new pings and one row per vessel are sorted.
+
+    Returns:
+        Tuple[str, dict]: The query string and its parameters.
+    """
+    query = f"""
+    WITH new_pings AS (
+        SELECT MMSI, BaseDateTime, LAT, LON
+        FROM {table}
+        WHERE BaseDateTime > %(since)s AND BaseDateTime <= %(until)s
+    )
+    SELECT MMSI, PrevTime, BaseDateTime, PrevLAT, PrevLON, LAT, LON,
+           greatCircleDistance(PrevLON, PrevLAT, LON, LAT) AS DistanceMeters
+    FROM (
+        SELECT MMSI, BaseDateTime, LAT, LON,
+               lagInFrame(BaseDateTime) OVER w AS PrevTime,
+               lagInFrame(LAT) OVER w AS PrevLAT,
+               lagInFrame(LON) OVER w AS PrevLON,
+               row_number() OVER w AS n
+        FROM (
+            SELECT MMSI, BaseDateTime, LAT, LON FROM new_pings
+            UNION ALL
+            SELECT MMSI, max(BaseDateTime), argMax(LAT, BaseDateTime), argMax(LON, BaseDateTime)
+            FROM {table}
+            WHERE BaseDateTime > %(lookback)s AND BaseDateTime <= %(since)s
+              AND MMSI IN (SELECT MMSI FROM new_pings)
+            GROUP BY MMSI
+        )
+        WINDOW w AS (PARTITION BY MMSI ORDER BY BaseDateTime ROWS BETWEEN 1 PRECEDING AND CURRENT ROW)
+    )
+    WHERE n > 1 AND dateDiff('millisecond', PrevTime, BaseDateTime) >= %(gap_ms)s
+    """
+    params = {
+        'since': _utc(since),
+        'until': _utc(until),
+        'lookback': _utc(since) - timedelta(hours=lookback_hours),
+        'gap_ms': int(gap_minutes * 60_000),
+    }
+    return query, params
+
+def detect_gaps(since: datetime, until: datetime, table: str = 'ais_data', client = None,
+                gap_minutes: float = ANALYTICS_GAP_MINUTES, lookback_hours: float = ANALYTICS_GAP_LOOKBACK_HOURS,
+                settings: Optional[dict] = None) -> pa.Table:
+    """
+    Transmission gaps ending in (since, until]. The event is placed where the
+    vessel reappeared; DistanceMeters is how far it moved while silent.
+    """
+    query, params = build_gap_query(since, until, table=table, gap_minutes=gap_minutes, lookback_hours=lookback_hours)
+    if client is None:
+        client = get_clickhouse_client()
+    result = client.query_arrow(query, parameters=params, settings=settings)
+    if result.num_rows == 0:
+        return EVENTS_SCHEMA.empty_table()
+    return _events('gap', result.column('MMSI').to_numpy(), None, _epoch_ms(result.column('PrevTime')),
+                   _epoch_ms(result.column('BaseDateTime')),
+                   result.column('LAT').to_numpy(), result.column('LON').to_numpy(),
+                   result.column('DistanceMeters').to_numpy(), np.full(result.num_rows, 2))
+
+def load_slow_tracks(start: datetime, until: datetime, table: str = 'ais_data', client = None,
+                     max_sog: float = max(ANALYTICS_LOITER_MAX_SOG, ANALYTICS_RENDEZVOUS_MAX_SOG),
+                     settings: Optional[dict] = None) -> pa.Table:
+    """
+    Loads every ping in (start, until] of the vessels that were slow at some
+    point in it, sorted by MMSI and time. Faster pings are kept because they
+    end slow episodes.
+    """
+    query = f"""
+    SELECT MMSI, BaseDateTime, LAT, LON, SOG, Status
+    FROM {table}
+    WHERE BaseDateTime > %(start)s AND BaseDateTime <= %(until)s
+      AND MMSI IN (
+          SELECT DISTINCT MMSI FROM {table}
+          WHERE BaseDateTime > %(start)s AND BaseDateTime <= %(until)s AND SOG <= %(max_sog)s AND Status != %(moored)s
+      )
+    ORDER BY MMSI, BaseDateTime
+    """
+    params = {'start': _utc(start), 'until': _utc(until), 'max_sog': float(max_sog), 'moored': STATUS_MOORED}
+    if client is None:
+        client = get_clickhouse_client()
+    return client.query_arrow(query, parameters=params, settings=settings)
+
+def _track_arrays(tracks: pa.Table) -> Tuple[np.ndarray, ...]:
+    """MMSI, epoch milliseconds, LAT, LON, SOG and Status of a load_slow_tracks table as NumPy arrays."""
+    return (
+        tracks.column('MMSI').to_numpy().astype(np.int64),
+        _epoch_ms(tracks.column('BaseDateTime')),
+        tracks.column('LAT').to_numpy(),
+        tracks.column('LON').to_numpy(),
+        tracks.column('SOG').to_numpy(),
+        tracks.column('Status').to_numpy(),
+    )
+
+def detect_loitering(tracks: pa.Table, since: datetime, max_sog: float = ANALYTICS_LOITER_MAX_SOG,
+                     radius_m: float = ANALYTICS_LOITER_RADIUS_M, min_minutes: float = ANALYTICS_LOITER_MINUTES,
+                     gap_minutes: float = ANALYTICS_GAP_MINUTES) -> pa.Table:
+    """
+    Loitering episodes ending after since, from a load_slow_tracks table.
+
+    Consecutive slow, non-moored pings of a vessel form a run; a faster ping,
+    a moored one or a transmission gap ends it. Runs long enough whose pings
+    all stay within radius_m of their mean position are loitering. All runs
+    of all vessels are measured at once with reduceat.
+    """
+    if tracks.num_rows == 0:
+        return EVENTS_SCHEMA.empty_table()
+    mmsi, t, lat, lon, sog, status = _track_arrays(tracks)
+    slow = (sog <= max_sog) & (status != STATUS_MOORED)
+    breaks = np.ones(len(t), dtype=bool)
+    breaks[1:] = (mmsi[1:] != mmsi[:-1]) | (slow[1:] != slow[:-1]) | (np.diff(t) >= gap_minutes * 60_000)
+    starts = np.flatnonzero(breaks)
+    ends = np.append(starts[1:], len(t)) - 1
+    long_enough = slow[starts] & (t[ends] - t[starts] >= min_minutes * 60_000) & (t[ends] > _ms(since))
+    starts, ends = starts[long_enough], ends[long_enough]
+    if not len(starts):
+        return EVENTS_SCHEMA.empty_table()
+
+    # Concatenate the runs so reduceat sees one segment per run
+    counts = ends - starts + 1
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    index = np.arange(counts.sum()) - np.repeat(offsets - starts, counts)
+    center_lat = np.add.reduceat(lat[index], offsets) / counts
+    center_lon = np.add.reduceat(lon[index], offsets) / counts
+    spread = np.maximum.reduceat(haversine_m(lat[index], lon[index], np.repeat(center_lat, counts), np.repeat(center_lon, counts)), offsets)
+    stayed = spread <= radius_m
+    return _events('loitering', mmsi[starts][stayed], None, t[starts][stayed], t[ends][stayed],
+                   center_lat[stayed], center_lon[stayed], spread[stayed], counts[stayed])
+
+def detect_rendezvous(tracks: pa.Table, since: datetime, max_sog: float = ANALYTICS_RENDEZVOUS_MAX_SOG,
+                      distance_m: float = ANALYTICS_RENDEZVOUS_DISTANCE_M, min_minutes: float = ANALYTICS_RENDEZVOUS_MINUTES,
+                      bucket_minutes: float = ANALYTICS_RENDEZVOUS_BUCKET_MINUTES) -> pa.Table:
+    """
+    Rendezvous of two vessels ending after since, from a load_slow_tracks table.
+
+    Slow, non-moored pings are averaged per vessel and time bucket. Each
+    bucketed position is hashed to a grid cell distance_m on a side, and
+    joined with the positions in the same bucket in its own and the eight
+    neighbouring cells, so the join only compares vessels that can be within
+    distance_m. Pairs close in consecutive buckets (one bucket may be missing)
+    for min_minutes or more are one rendezvous, reported for the lower MMSI
+    with the other vessel in OtherMMSI.
+    """
+    if tracks.num_rows == 0:
+        return EVENTS_SCHEMA.empty_table()
+    mmsi, t, lat, lon, sog, status = _track_arrays(tracks)
+    candidate = (sog <= max_sog) & (status != STATUS_MOORED)
+    mmsi, t, lat, lon = mmsi[candidate], t[candidate], lat[candidate], lon[candidate]
+    if not len(t):
+        return EVENTS_SCHEMA.empty_table()
+
+    # Mean position per vessel and bucket; rows are sorted by MMSI and time already
+    bucket_ms = int(bucket_minutes * 60_000)
+    bucket = t // bucket_ms
+    first = np.ones(len(t), dtype=bool)
+    first[1:] = (mmsi[1:] != mmsi[:-1]) | (bucket[1:] != bucket[:-1])
+    offsets = np.flatnonzero(first)
+    counts = np.diff(np.append(offsets, len(t)))
+    positions = pd.DataFrame({
+        'MMSI': mmsi[offsets],
+        'bucket': bucket[offsets],
+        'LAT': np.add.reduceat(lat, offsets) / counts,
+        'LON': np.add.reduceat(lon, offsets) / counts,
+        'pings': counts,
+    })
+    # Cells are distance_m on a side. Their east-west size follows the latitude
+    # of the cell row, so a position's column is computed per row it is looked up in.
+    cell_deg = distance_m / METERS_PER_DEGREE
+    lon = positions['LON'].to_numpy()
+    cell_x = lambda cy: np.floor(lon * np.cos(np.radians((cy + 0.5) * cell_deg)) / cell_deg).astype(np.int64)
+    cy = np.floor(positions['LAT'].to_numpy() / cell_deg).astype(np.int64)
+    positions['cy'], positions['cx'] = cy, cell_x(cy)
+
+    neighbours = pd.concat(
+        [positions.assign(cy=cy + dy, cx=cell_x(cy + dy) + dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)],
+        ignore_index=True
+    )
+    pairs = positions.merge(neighbours, on=['bucket', 'cy', 'cx'], suffixes=('', '_other'))
+    pairs = pairs[pairs['MMSI'] < pairs['MMSI_other']]
+    separation = haversine_m(pairs['LAT'].to_numpy(), pairs['LON'].to_numpy(),
+                             pairs['LAT_other'].to_numpy(), pairs['LON_other'].to_numpy())
+    pairs = pairs.assign(separation=separation)[separation <= distance_m]
+    if pairs.empty:
+        return EVENTS_SCHEMA.empty_table()
+    pairs = pairs.sort_values(['MMSI', 'MMSI_other', 'bucket'])
+
+    a, b, buckets = (pairs[c].to_numpy() for c in ('MMSI', 'MMSI_other', 'bucket'))
+    new_episode = np.ones(len(pairs), dtype=bool)
+    new_episode[1:] = (a[1:] != a[:-1]) | (b[1:] != b[:-1]) | (np.diff(buckets) > 2)
+    episode_offsets = np.flatnonzero(new_episode)
+    episode_ends = np.append(episode_offsets[1:], len(pairs)) - 1
+    n = np.diff(np.append(episode_offsets, len(pairs)))
+    start_ms = buckets[episode_offsets] * bucket_ms
+    end_ms = (buckets[episode_ends] + 1) * bucket_ms
+    keep = (end_ms - start_ms >= min_minutes * 60_000) & (end_ms > _ms(since))
+    if not keep.any():
+        return EVENTS_SCHEMA.empty_table()
+    mean = lambda column: np.add.reduceat(pairs[column].to_numpy(), episode_offsets) / n
+    mid_lat = (mean('LAT') + mean('LAT_other')) / 2
+    mid_lon = (mean('LON') + mean('LON_other')) / 2
+    pings = np.add.reduceat(pairs['pings'].to_numpy() + pairs['pings_other'].to_numpy(), episode_offsets)
+    return _events('rendezvous', a[episode_offsets][keep], b[episode_offsets][keep], start_ms[keep], end_ms[keep],
+                   mid_lat[keep], mid_lon[keep], mean('separation')[keep], pings[keep])
+
+def detect_events(since: datetime, until: datetime, table: str = 'ais_data', client = None,
+                  lookback_hours: float = ANALYTICS_LOOKBACK_HOURS, settings: Optional[dict] = None) -> Tuple[pa.Table, dict]:
+    """
+    Runs every detector for the pings in (since, until].
+
+    Returns:
+        Tuple[pa.Table, dict]: The events, and per detector counts and seconds.
+    """
+    if client is None:
+        client = get_clickhouse_client()
+    stats = {}
+    start = time.perf_counter()
+    with span('analytics', 'gaps'):
+        gaps = detect_gaps(since, until, table=table, client=client, settings=settings)
+    stats['gap'] = {'events': gaps.num_rows, 'seconds': round(time.perf_counter() - start, 3)}
+
+    start = time.perf_counter()
+    with span('analytics', 'load_tracks'):
+        tracks = load_slow_tracks(_utc(since) - timedelta(hours=lookback_hours), until, table=table,
+                                  client=client, settings=settings)
+    stats['tracks'] = {'rows': tracks.num_rows, 'seconds': round(time.perf_counter() - start, 3)}
+
+    start = time.perf_counter()
+    with span('analytics', 'loitering'):
+        loitering = detect_loitering(tracks, since)
+    stats['loitering'] = {'events': loitering.num_rows, 'seconds': round(time.perf_counter() - start, 3)}
+
+    start = time.perf_counter()
+    with span('analytics', 'rendezvous'):
+        rendezvous = detect_rendezvous(tracks, since)
+    stats['rendezvous'] = {'events': rendezvous.num_rows, 'seconds': round(time.perf_counter() - start, 3)}
+    return pa.concat_tables([gaps, loitering, rendezvous]), stats
+
+def ensure_tables(client, events_table: str = ANALYTICS_EVENTS_TABLE):
+    """Creates the events and watermarks tables if they don't exist."""
+    client.command(EVENTS_TABLE_DDL.format(table=events_table))
+    client.command(WATERMARKS_TABLE_DDL)
+
+def get_watermark(client, table: str = 'ais_data', events_table: str = ANALYTICS_EVENTS_TABLE) -> Optional[datetime]:
+    """The newest BaseDateTime of table already analyzed into events_table, or None."""
+    result = client.query(
+        f"SELECT max(Watermark), count() FROM {WATERMARKS_TABLE} FINAL "
+        "WHERE SourceTable = %(table)s AND EventsTable = %(events_table)s",
+        parameters={'table': table, 'events_table': events_table}
+    )
+    watermark, count = result.result_rows[0]
+    return _utc(watermark) if count else None
+
+def set_watermark(client, watermark: datetime, table: str = 'ais_data', events_table: str = ANALYTICS_EVENTS_TABLE):
+    client.command(
+        f"INSERT INTO {WATERMARKS_TABLE} SELECT %(table)s, %(events_table)s, %(watermark)s, now64(3, 'UTC')",
+        parameters={'table': table, 'events_table': events_table, 'watermark': _utc(watermark)}
+    )
+
+def run_analytics(table: str = 'ais_data', client = None, events_table: str = ANALYTICS_EVENTS_TABLE,
+                  since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  batch_hours: float = ANALYTICS_BATCH_HOURS, settle_minutes: float = ANALYTICS_SETTLE_MINUTES,
+                  settings: Optional[dict] = None) -> dict:
+    """
+    Analyzes the pings of table after the watermark (or since) up to until
+    (default: the newest ping less settle_minutes), batch_hours at a time,
+    writing the events and moving the watermark after every batch. With
+    since the watermark is only moved past where it stands, and only if
+    since is not after it.
+
+    Returns:
+        dict: The analyzed range, events per type and time spent per detector.
+    """
+    if client is None:
+        client = get_clickhouse_client()
+    ensure_tables(client, events_table)
+    # Answered from part metadata, BaseDateTime is in the partition key
+    first, latest, rows = client.query(f"SELECT min(BaseDateTime), max(BaseDateTime), count() FROM {table}",
+                                       settings=settings).result_rows[0]
+    if not rows:
+        return {'table': table, 'batches': 0, 'events': {}}
+    latest = _utc(latest) - timedelta(minutes=settle_minutes)
+    until = min(_utc(until), latest) if until is not None else latest
+
+    watermark = get_watermark(client, table, events_table)
+    if watermark is None:
+        # The first ping is after the window start
+        watermark = _utc(first) - timedelta(seconds=1)
+    start = _utc(since) if since is not None else watermark
+    # The watermark only moves forward, and only for runs that pick up where it
+    # stands: re-analyzing an older range leaves it alone, and a range after it
+    # must not skip what lies in between
+    contiguous = start <= watermark
+
+    summary = {'table': table, 'since': start.isoformat(), 'until': until.isoformat(), 'batches': 0,
+               'events': {t: 0 for t in EVENT_TYPES}, 'seconds': {}, 'track_rows': 0}
+    run_start = time.perf_counter()
+    while start < until:
+        end = min(start + timedelta(hours=batch_hours), until)
+        events, stats = detect_events(start, end, table=table, client=client, settings=settings)
+        if events.num_rows:
+            client.insert_arrow(events_table, events, settings=settings)
+        if contiguous and end > watermark:
+            set_watermark(client, end, table, events_table)
+        logger.info(f"Analyzed {table} ({start}, {end}]: " +
+                    ", ".join(f"{k} {v.get('events', v.get('rows'))}" for k, v in stats.items()))
+        summary['batches'] += 1
+        summary['track_rows'] += stats['tracks']['rows']
+        for name, stat in stats.items():
+            summary['seconds'][name] = round(summary['seconds'].get(name, 0) + stat['seconds'], 3)
+            if name in summary['events']:
+                summary['events'][name] += stat['events']
+        start = end
+    summary['total_seconds'] = round(time.perf_counter() - run_start, 3)
+    return summary
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default='ais_data')
+    parser.add_argument('--events-table', default=ANALYTICS_EVENTS_TABLE)
+    parser.add_argument('--since', type=datetime.fromisoformat, help="Analyze from here instead of the watermark")
+    parser.add_argument('--until', type=datetime.fromisoformat, help="Stop here instead of at the newest data")
+    parser.add_argument('--status', action='store_true', help="Print the watermark and event counts and exit")
+    args = parser.parse_args()
+
+    client = get_clickhouse_client()
+    if args.status:
+        ensure_tables(client, args.events_table)
+        print(f"{args.table} analyzed up to {get_watermark(client, args.table, args.events_table) or 'never'}")
+        for event_type, count in client.query(f"SELECT EventType, count() FROM {args.events_table} FINAL GROUP BY EventType").result_rows:
+            print(f"  {event_type}: {count}")
+    else:
+        summary = run_analytics(args.table, client=client, events_table=args.events_table, since=args.since, until=args.until)
+        print(summary)
@@ -0,0 +1,139 @@
+"""
+Prompt size and latency per chat turn as a session grows, with and without
+chat history compaction.
+
+A fake OpenAI-compatible server stands in for Ollama. Its time to first
+token grows with the prompt (--prefill-tokens-per-second, roughly what a 27B
+model does on one GPU), then it streams a short final_answer. Summarization
+requests from the history manager get a canned summary.
+
+Each session sends --turns user messages through /api/chat/stream with the
+whole history, like the frontend does. Every third turn also carries a map
+summary tool result in the history, the bulky kind of message compaction
+drops. "full" sends the history as is (the previous behaviour), "compacted"
+uses the HistoryManager settings from the environment.
+
+Usage (from the ai/ directory):
+    python bench/bench_chat_history.py --turns 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chat_stream import free_port, serve_in_thread
+
+def fake_lm_app(prefill_tokens_per_second: float, tokens_per_second: float, prompt_tokens: list) -> FastAPI:
+    app = FastAPI()
+    answer = " ".join(f"word{i}" for i in range(40))
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "\n".join(m['content'] for m in body['messages'] if isinstance(m.get('content'), str))
+        # Roughly 4 characters per token
+        tokens_in = len(prompt) // 4
+        if '[[ ## new_turns ## ]]' in prompt:
+            completion = "[[ ## summary ## ]]\nThe user looked at vessels near several ports and asked about their speeds.\n\n[[ ## completed ## ]]"
+        else:
+            prompt_tokens.append(tokens_in)
+            completion = f"[[ ## action ## ]]\nfinal_answer\n\n[[ ## action_input ## ]]\n{answer}\n\n[[ ## completed ## ]]"
+        tokens = [completion[i:i + 4] for i in range(0, len(completion), 4)]
+        if not body.get('stream'):
+            await asyncio.sleep(tokens_in / prefill_tokens_per_second + len(tokens) / tokens_per_second)
+            return JSONResponse({
+                'id': 'fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': completion}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': tokens_in, 'completion_tokens': len(tokens), 'total_tokens': tokens_in + len(tokens)},
+            })
+
+        async def chunks():
+            await asyncio.sleep(tokens_in / prefill_tokens_per_second)
+            for token in tokens:
+                chunk = {
+                    'id': 'fake', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': body['model'],
+                    'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1 / tokens_per_second)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type='text/event-stream')
+
+    return app
+
+def map_summary_message(turn: int) -> dict:
+    vessels = [{'MMSI': 366000000 + turn * 100 + i, 'VesselName': f"VESSEL {turn}-{i}", 'SOG': 10.5, 'LAT': 37.8, 'LON': -122.4}
+               for i in range(12)]
+    return {'role': 'user', 'content': "Map summary result: " + json.dumps({'count': 412, 'biggestShips': vessels})}
+
+def run_session(api_url: str, turns: int, label: str) -> list:
+    history = []
+    results = []
+    for turn in range(turns):
+        message = f"{label} turn {turn}: which of the tankers near the port of Oakland moved faster than {turn} knots today?"
+        if turn % 3 == 2:
+            history.append(map_summary_message(turn))
+        history.append({'role': 'user', 'content': message})
+        start = time.perf_counter()
+        answer = ""
+        with httpx.stream('POST', f"{api_url}/api/chat/stream", json={'message': message, 'history': history}, timeout=300) as response:
+            for line in response.iter_lines():
+                if line:
+                    event = json.loads(line)
+                    if event.get('type') == 'text':
+                        answer += event['content']
+        results.append(time.perf_counter() - start)
+        history.append({'role': 'assistant', 'content': answer})
+        # Background summaries are done well before a person types the next message
+        time.sleep(0.2)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=40)
+    parser.add_argument('--prefill-tokens-per-second', type=float, default=1500)
+    parser.add_argument('--tokens-per-second', type=float, default=200)
+    args = parser.parse_args()
+
+    prompt_tokens = {'full': [], 'compacted': []}
+    current = []
+    lm_port, api_port = free_port(), free_port()
+    serve_in_thread(fake_lm_app(args.prefill_tokens_per_second, args.tokens_per_second, current), lm_port)
+    os.environ['OLLAMA_BASE_URL'] = f"http://127.0.0.1:{lm_port}"
+    os.environ['OLLAMA_MODEL'] = 'fake'
+    # Every turn is new, keep the prediction cache out of the file system
+    os.environ['PREDICTION_CACHE_PATH'] = ''
+
+    import main as api
+    from history import HistoryManager
+    serve_in_thread(api.app, api_port)
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    latencies = {}
+    compacted = api.history_manager
+    for name, manager in (('full', HistoryManager(max_tokens=10 ** 9, keep_turns=10 ** 9)), ('compacted', compacted)):
+        api.history_manager = manager
+        current.clear()
+        # A new session every run so DSPy's LM cache never answers
+        latencies[name] = run_session(api_url, args.turns, f"{name} {time.time()}")
+        prompt_tokens[name] = list(current)
+
+    print(f"{args.turns} turns, prefill {args.prefill_tokens_per_second:g} tokens/s, "
+          f"history budget {compacted.max_tokens} tokens, {compacted.keep_turns} verbatim turns")
+    print(f"{'turn':>5}{'full tokens':>13}{'full s':>9}{'compacted tokens':>18}{'compacted s':>13}")
+    for turn in range(args.turns):
+        if turn % 5 == 4 or turn == args.turns - 1:
+            print(f"{turn + 1:>5}{prompt_tokens['full'][turn]:>13}{latencies['full'][turn]:>9.2f}"
+                  f"{prompt_tokens['compacted'][turn]:>18}{latencies['compacted'][turn]:>13.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Time to first token and total latency of /api/chat/stream, before and after
+streaming tokens from the LM.
+
+A fake OpenAI-compatible server stands in for Ollama. It answers every chat
+completion with a final_answer of --words words, after a --prefill delay, at
+--tokens-per-second. The API is started with OLLAMA_BASE_URL pointing at it,
+and each question is sent over HTTP, timing the first text event and the end
+of the response.
+
+"before" replays the previous behaviour of the endpoint on the same agent: a
+blocking agent.forward call, then the answer split into words with a 50ms
+sleep per word.
+
+Usage (from the ai/ directory):
+    python bench/bench_chat_stream.py --words 200 --runs 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def fake_lm_app(words: int, prefill: float, tokens_per_second: float) -> FastAPI:
+    app = FastAPI()
+    answer = " ".join(f"word{i}" for i in range(words))
+    completion = f"[[ ## action ## ]]\nfinal_answer\n\n[[ ## action_input ## ]]\n{answer}\n\n[[ ## completed ## ]]"
+    # Roughly 4 characters per token
+    tokens = [completion[i:i + 4] for i in range(0, len(completion), 4)]
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if not body.get('stream'):
+            await asyncio.sleep(prefill + len(tokens) / tokens_per_second)
+            return JSONResponse({
+                'id': 'fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': completion}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 100, 'completion_tokens': len(tokens), 'total_tokens': 100 + len(tokens)},
+            })
+
+        async def chunks():
+            await asyncio.sleep(prefill)
+            for token in tokens + [None]:
+                delta = {'content': token} if token is not None else {}
+                chunk = {
+                    'id': 'fake', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': body['model'],
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if token is not None else 'stop'}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if token is not None:
+                    await asyncio.sleep(1 / tokens_per_second)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type='text/event-stream')
+
+    return app
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def measure_after(api_url: str, message: str) -> dict:
+    start = time.perf_counter()
+    first = None
+    with httpx.stream('POST', f"{api_url}/api/chat/stream", json={'message': message}, timeout=120) as response:
+        for line in response.iter_lines():
+            if line and json.loads(line).get('type') == 'text' and first is None:
+                first = time.perf_counter() - start
+    return {'ttft': first, 'total': time.perf_counter() - start}
+
+async def measure_before(agent, message: str) -> dict:
+    """The endpoint as it was: blocking forward, then one word per 50ms."""
+    start = time.perf_counter()
+    first = None
+    prediction = agent.forward(user_input=message, chat_history=[])
+    for word in prediction.action_input.split():
+        if first is None:
+            first = time.perf_counter() - start
+        await asyncio.sleep(0.05)
+    return {'ttft': first, 'total': time.perf_counter() - start}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, default=200, help="Words in the answer")
+    parser.add_argument('--prefill', type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=60)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    lm_port, api_port = free_port(), free_port()
+    serve_in_thread(fake_lm_app(args.words, args.prefill, args.tokens_per_second), lm_port)
+    os.environ['OLLAMA_BASE_URL'] = f"http://127.0.0.1:{lm_port}"
+    os.environ['OLLAMA_MODEL'] = 'fake'
+
+    import main as api
+    serve_in_thread(api.app, api_port)
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    results = {'before': [], 'after': []}
+    for run in range(args.runs):
+        # A new question every run so DSPy's LM cache never answers
+        results['before'].append(asyncio.run(measure_before(api.agent, f"before {run} {time.time()}")))
+        results['after'].append(measure_after(api_url, f"after {run} {time.time()}"))
+
+    print(f"{args.words} word answer, {args.prefill:g}s prefill, {args.tokens_per_second:g} tokens/s")
+    print(f"{'':<8}{'TTFT p50 s':>12}{'total p50 s':>13}")
+    for name, runs in results.items():
+        ttft = statistics.median(r['ttft'] for r in runs)
+        total = statistics.median(r['total'] for r in runs)
+        print(f"{name:<8}{ttft:>12.2f}{total:>13.2f}")
+
+if __name__ == '__main__':
+    main()
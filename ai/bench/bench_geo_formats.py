@@ -0,0 +1,87 @@
+"""
+Compares bytes on the wire and server CPU per 100k rows for the
+/api/data/geo output formats against the original records JSON.
+
+Uses a synthetic ais_data shaped Arrow table (about 1% NaN values), so no
+ClickHouse is needed. The records case includes FastAPI's jsonable_encoder
+since that is what the endpoint pays when returning a list of dicts.
+
+Usage (from the ai/ directory):
+    python bench/bench_geo_formats.py --rows 100000 --runs 3
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from formats import ENCODERS, clean_records
+
+def synthetic_table(rows: int, seed: int = 0) -> pa.Table:
+    rng = np.random.default_rng(seed)
+    def with_nans(values):
+        values = values.astype(np.float64)
+        values[rng.random(rows) < 0.01] = np.nan
+        return values
+    start = np.datetime64('2024-01-01T00:00:00', 'ms')
+    return pa.table({
+        'MMSI': pa.array(rng.integers(200_000_000, 800_000_000, rows), pa.uint32()),
+        'BaseDateTime': pa.array(start + rng.integers(0, 86_400_000, rows).astype('timedelta64[ms]'), pa.timestamp('ms', 'UTC')),
+        'LAT': rng.uniform(34.9, 41.1, rows),
+        'LON': rng.uniform(-126.6, -118.2, rows),
+        'SOG': pa.array(with_nans(rng.uniform(0, 25, rows)), pa.float32()),
+        'COG': pa.array(with_nans(rng.uniform(0, 360, rows)), pa.float32()),
+        'Heading': pa.array(rng.integers(0, 511, rows), pa.uint16()),
+        'VesselName': [f"VESSEL {i % 5000}" for i in range(rows)],
+        'IMO': [f"IMO{9000000 + i % 5000}" for i in range(rows)],
+        'CallSign': [f"WD{i % 5000:04d}" for i in range(rows)],
+        'VesselType': pa.array(rng.integers(0, 100, rows), pa.uint16()),
+        'Status': pa.array(rng.integers(0, 16, rows), pa.uint8()),
+        'Length': pa.array(with_nans(rng.uniform(10, 300, rows)), pa.float32()),
+        'Width': pa.array(with_nans(rng.uniform(3, 50, rows)), pa.float32()),
+        'Draft': pa.array(with_nans(rng.uniform(1, 15, rows)), pa.float32()),
+        'Cargo': pa.array(with_nans(rng.uniform(0, 99, rows)), pa.float32()),
+        'TransceiverClass': ['A' if i % 3 else 'B' for i in range(rows)],
+    })
+
+def encode_records(table: pa.Table) -> bytes:
+    data = clean_records(table.to_pandas())
+    return json.dumps(jsonable_encoder(data)).encode()
+
+def measure(encoder, table: pa.Table, runs: int):
+    cpu = []
+    for _ in range(runs):
+        start = time.process_time()
+        body = encoder(table)
+        cpu.append(time.process_time() - start)
+    return body, min(cpu)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    table = synthetic_table(args.rows)
+    per_100k = 100_000 / args.rows
+    cases = [('records (current)', encode_records)] + list(ENCODERS.items())
+
+    header = f"{'format':<20}{'MB':>10}{'MB gzip':>10}{'CPU ms/100k':>14}{'vs records':>12}"
+    print(header)
+    print('-' * len(header))
+    baseline = None
+    for name, encoder in cases:
+        body, cpu = measure(encoder, table, args.runs)
+        cpu_ms = cpu * 1000 * per_100k
+        baseline = baseline or cpu_ms
+        print(f"{name:<20}{len(body) / 1e6:>10.2f}{len(gzip.compress(body, 1)) / 1e6:>10.2f}{cpu_ms:>14.1f}{baseline / cpu_ms:>11.1f}x")
+
+if __name__ == '__main__':
+    main()
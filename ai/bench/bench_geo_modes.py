@@ -0,0 +1,77 @@
+"""
+Compares the original bbox query (every ping, LIMIT 10000) against the
+'latest' per-MMSI mode of /api/data/geo.
+
+Runs against the ClickHouse configured in .env and reports, per mode, the
+rows read by ClickHouse, rows returned, bytes of the JSON response body and
+wall clock latency.
+
+Usage (from the ai/ directory):
+    python bench/bench_geo_modes.py --runs 5 --hours 1
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import get_clickhouse_client, build_geo_query
+
+# Same bbox the Next.js /api/vessels route requests
+DEFAULT_BBOX = (34.9337, 41.1082, -126.6365, -118.2023)
+MAP_COLUMNS = ['MMSI', 'BaseDateTime', 'LAT', 'LON', 'SOG', 'COG', 'Heading', 'VesselName', 'VesselType', 'Length', 'Width']
+
+def run_case(client, name: str, query: str, params: dict, runs: int) -> dict:
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = client.query(query, parameters=params)
+        rows = [dict(zip(result.column_names, row)) for row in result.result_rows]
+        body = json.dumps(rows, default=str)
+        latencies.append(time.perf_counter() - start)
+    summary = result.summary or {}
+    return {
+        'case': name,
+        'rows_read': int(summary.get('read_rows', 0)),
+        'rows_returned': len(rows),
+        'response_bytes': len(body),
+        'latency_ms_median': round(statistics.median(latencies) * 1000, 1),
+        'latency_ms_max': round(max(latencies) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default='ais_data')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--hours', type=float, default=1.0, help="Time window for the windowed cases, ending at max(BaseDateTime)")
+    args = parser.parse_args()
+
+    client = get_clickhouse_client()
+    window_end = client.query(f"SELECT max(BaseDateTime) FROM {args.table}").result_rows[0][0]
+    window_start = window_end - timedelta(hours=args.hours)
+
+    cases = [
+        ('all (current)', dict(mode='all')),
+        ('all, windowed', dict(mode='all', start_time=window_start, end_time=window_end)),
+        ('latest', dict(mode='latest', limit=0)),
+        ('latest, windowed', dict(mode='latest', limit=0, start_time=window_start, end_time=window_end)),
+        ('latest, windowed, map columns', dict(mode='latest', limit=0, start_time=window_start, end_time=window_end, columns=MAP_COLUMNS)),
+    ]
+
+    results = []
+    for name, kwargs in cases:
+        query, params = build_geo_query(*DEFAULT_BBOX, table=args.table, **kwargs)
+        results.append(run_case(client, name, query, params, args.runs))
+
+    header = f"{'case':<32}{'rows read':>12}{'rows out':>10}{'bytes':>12}{'p50 ms':>10}{'max ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['case']:<32}{r['rows_read']:>12}{r['rows_returned']:>10}{r['response_bytes']:>12}{r['latency_ms_median']:>10}{r['latency_ms_max']:>10}")
+
+if __name__ == '__main__':
+    main()
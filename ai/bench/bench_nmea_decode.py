@@ -0,0 +1,144 @@
+"""
+Measures NMEA decode throughput of ingest/nmea.py on a replayed log.
+
+Without --file, a synthetic log is generated with the same mix an SDR
+scanner sees near a port: mostly Class A/B position reports, plus
+two-sentence type 5 static reports and type 24 A/B pairs, with a fraction
+of corrupted checksums and orphaned fragments. The log is decoded in
+batches of --batch-size lines and the sentences/s and rows/s reported.
+
+Usage (from the ai/ directory):
+    python bench/bench_nmea_decode.py --sentences 500000
+    python bench/bench_nmea_decode.py --file capture.nmea --write-log /tmp/synthetic.nmea
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ingest'))
+
+from nmea import NMEADecoder
+
+_ARMOR = '0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVW`abcdefghijklmnopqrstuvw'
+
+def _bits(value: int, length: int) -> str:
+    return format(value & ((1 << length) - 1), f'0{length}b')
+
+def _text(value: str, nchars: int) -> str:
+    value = value.upper()[:nchars].ljust(nchars, '@')
+    return ''.join(_bits(ord(c) - 64 if ord(c) >= 64 else ord(c), 6) for c in value)
+
+def _armor(bits: str) -> (str, int):
+    fill = -len(bits) % 6
+    bits += '0' * fill
+    return ''.join(_ARMOR[int(bits[i:i + 6], 2)] for i in range(0, len(bits), 6)), fill
+
+def _sentences(bits: str, seq_id: int, channel: str, max_chars: int = 60) -> List[str]:
+    payload, fill = _armor(bits)
+    parts = [payload[i:i + max_chars] for i in range(0, len(payload), max_chars)]
+    out = []
+    for number, part in enumerate(parts, 1):
+        body = (f"AIVDM,{len(parts)},{number},{seq_id if len(parts) > 1 else ''},{channel},"
+                f"{part},{fill if number == len(parts) else 0}")
+        checksum = 0
+        for c in body:
+            checksum ^= ord(c)
+        out.append(f"!{body}*{checksum:02X}")
+    return out
+
+def position_a(mmsi, lat, lon, sog, cog, heading, status) -> str:
+    return (_bits(1, 6) + _bits(0, 2) + _bits(mmsi, 30) + _bits(status, 4) + _bits(-128, 8)
+            + _bits(int(sog * 10), 10) + _bits(1, 1) + _bits(round(lon * 600000), 28)
+            + _bits(round(lat * 600000), 27) + _bits(int(cog * 10), 12) + _bits(heading, 9)
+            + _bits(30, 6) + _bits(0, 2) + _bits(0, 3) + _bits(0, 1) + _bits(0, 19))
+
+def position_b(mmsi, lat, lon, sog, cog, heading) -> str:
+    return (_bits(18, 6) + _bits(0, 2) + _bits(mmsi, 30) + _bits(0, 8)
+            + _bits(int(sog * 10), 10) + _bits(0, 1) + _bits(round(lon * 600000), 28)
+            + _bits(round(lat * 600000), 27) + _bits(int(cog * 10), 12) + _bits(heading, 9)
+            + _bits(30, 6) + '0' * 29)
+
+def static_a(mmsi, imo, callsign, name, ship_type, dims, draught, destination) -> str:
+    return (_bits(5, 6) + _bits(0, 2) + _bits(mmsi, 30) + _bits(0, 2) + _bits(imo, 30)
+            + _text(callsign, 7) + _text(name, 20) + _bits(ship_type, 8)
+            + _bits(dims[0], 9) + _bits(dims[1], 9) + _bits(dims[2], 6) + _bits(dims[3], 6)
+            + _bits(1, 4) + _bits(1, 4) + _bits(1, 5) + _bits(0, 5) + _bits(0, 6)
+            + _bits(int(draught * 10), 8) + _text(destination, 20) + _bits(0, 1) + _bits(0, 1))
+
+def static_b(mmsi, name, ship_type, callsign, dims) -> List[str]:
+    part_a = _bits(24, 6) + _bits(0, 2) + _bits(mmsi, 30) + _bits(0, 2) + _text(name, 20)
+    part_b = (_bits(24, 6) + _bits(0, 2) + _bits(mmsi, 30) + _bits(1, 2) + _bits(ship_type, 8)
+              + '0' * 42 + _text(callsign, 7) + _bits(dims[0], 9) + _bits(dims[1], 9)
+              + _bits(dims[2], 6) + _bits(dims[3], 6) + '0' * 6)
+    return [part_a, part_b]
+
+def synthetic_log(sentences: int, vessels: int = 2000, seed: int = 0, corrupt: float = 0.002) -> List[str]:
+    rng = random.Random(seed)
+    fleet = [(366_000_000 + i, rng.uniform(35, 41), rng.uniform(-126, -118.5), i % 4 == 0) for i in range(vessels)]
+    lines = []
+    seq_id = 0
+    while len(lines) < sentences:
+        mmsi, lat, lon, class_b = rng.choice(fleet)
+        lat += rng.uniform(-0.01, 0.01)
+        lon += rng.uniform(-0.01, 0.01)
+        channel = rng.choice('AB')
+        roll = rng.random()
+        if roll < 0.05:
+            dims = (rng.randint(10, 150), rng.randint(5, 50), rng.randint(2, 20), rng.randint(2, 20))
+            if class_b:
+                for bits in static_b(mmsi, f"VESSEL {mmsi % 10000}", 37, f"WDC{mmsi % 10000:04d}", dims):
+                    lines += _sentences(bits, 0, channel)
+            else:
+                seq_id = (seq_id + 1) % 10
+                group = _sentences(static_a(mmsi, 9_000_000 + mmsi % 10000, f"WDC{mmsi % 10000:04d}",
+                                            f"VESSEL {mmsi % 10000}", 70, dims, rng.uniform(2, 14), "OAKLAND"),
+                                   seq_id, channel)
+                # Now and then the second fragment is lost on air
+                lines += group[:1] if rng.random() < 0.02 else group
+        elif class_b:
+            lines += _sentences(position_b(mmsi, lat, lon, rng.uniform(0, 20), rng.uniform(0, 359), rng.randint(0, 359)), 0, channel)
+        else:
+            lines += _sentences(position_a(mmsi, lat, lon, rng.uniform(0, 20), rng.uniform(0, 359), rng.randint(0, 359), 0), 0, channel)
+        if rng.random() < corrupt:
+            lines[-1] = lines[-1][:-2] + '00'
+    return lines[:sentences]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=None, help="Replay this NMEA log instead of a synthetic one")
+    parser.add_argument('--sentences', type=int, default=500_000, help="Size of the synthetic log")
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--write-log', default=None, help="Also save the synthetic log here")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, errors='replace') as f:
+            lines = f.read().splitlines()
+    else:
+        start = time.perf_counter()
+        lines = synthetic_log(args.sentences)
+        print(f"Generated {len(lines):,} sentences in {time.perf_counter() - start:.1f}s")
+        if args.write_log:
+            with open(args.write_log, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    best = None
+    for run in range(args.runs):
+        decoder = NMEADecoder()
+        rows = 0
+        start = time.perf_counter()
+        for i in range(0, len(lines), args.batch_size):
+            rows += decoder.decode(lines[i:i + args.batch_size]).num_rows
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        print(f"run {run + 1}: {elapsed:.2f}s, {len(lines) / elapsed:,.0f} sentences/s, {rows / elapsed:,.0f} rows/s")
+    print(f"best: {len(lines) / best:,.0f} sentences/s")
+    print(f"decoder stats: {decoder.stats()}")
+    print(f"vessels with static data: {len(decoder.static):,}")
+
+if __name__ == '__main__':
+    main()
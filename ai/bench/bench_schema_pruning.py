@@ -0,0 +1,101 @@
+"""
+Compares granule pruning and latency of the ais_data schema versions for the
+bbox query behind /api/data/geo and a per-vessel trajectory query.
+
+Run `python migrate.py` first; it keeps the v1 table as ais_data_v1_backup,
+which is the default --before table here.
+
+For every query shape and table this reports the granules selected after
+index analysis (from EXPLAIN indexes = 1), the rows and bytes ClickHouse
+actually read (from the query summary) and the median latency.
+
+Usage (from the ai/ directory):
+    python bench/bench_schema_pruning.py --before ais_data_v1_backup --after ais_data
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import get_clickhouse_client, build_geo_query
+
+BBOXES = {
+    'bbox California': (34.9337, 41.1082, -126.6365, -118.2023),
+    'bbox SF Bay': (37.4, 38.2, -122.6, -122.0),
+}
+
+TRAJECTORY_QUERY = """
+    SELECT BaseDateTime, LAT, LON, SOG, COG
+    FROM {table}
+    WHERE MMSI = %(mmsi)s
+      AND BaseDateTime >= %(start_time)s AND BaseDateTime <= %(end_time)s
+    ORDER BY BaseDateTime
+"""
+
+def granules_selected(client, query: str, params: dict) -> str:
+    """Returns 'selected/total' granules of the last index step, as reported by EXPLAIN."""
+    plan = client.query(f"EXPLAIN indexes = 1 {query}", parameters=params).result_rows
+    text = "\n".join(row[0] for row in plan)
+    matches = re.findall(r"Granules: (\d+)/(\d+)", text)
+    if not matches:
+        return "?"
+    selected = matches[-1][0]
+    total = matches[0][1]
+    return f"{selected}/{total}"
+
+def run_case(client, query: str, params: dict, runs: int) -> dict:
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = client.query(query, parameters=params, settings={'use_query_cache': 0})
+        latencies.append(time.perf_counter() - start)
+    summary = result.summary or {}
+    return {
+        'granules': granules_selected(client, query, params),
+        'read_rows': int(summary.get('read_rows', 0)),
+        'read_mb': int(summary.get('read_bytes', 0)) / 1e6,
+        'result_rows': len(result.result_rows),
+        'latency_ms': statistics.median(latencies) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--before', default='ais_data_v1_backup')
+    parser.add_argument('--after', default='ais_data')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--hours', type=float, default=6, help="Time window of the windowed and trajectory cases")
+    args = parser.parse_args()
+
+    client = get_clickhouse_client()
+    window_end = client.query(f"SELECT max(BaseDateTime) FROM {args.after}").result_rows[0][0]
+    window_start = window_end - timedelta(hours=args.hours)
+    # The busiest vessel in the window gives the longest track
+    mmsi = client.query(
+        f"SELECT MMSI FROM {args.after} WHERE BaseDateTime >= %(start)s GROUP BY MMSI ORDER BY count() DESC LIMIT 1",
+        parameters={'start': window_start}
+    ).result_rows[0][0]
+
+    cases = []
+    for name, bbox in BBOXES.items():
+        cases.append((f"{name}, all", lambda table, bbox=bbox: build_geo_query(*bbox, table=table)))
+        cases.append((f"{name}, latest {args.hours:g}h", lambda table, bbox=bbox: build_geo_query(
+            *bbox, table=table, mode='latest', limit=0, start_time=window_start, end_time=window_end)))
+    cases.append((f"trajectory {mmsi}, {args.hours:g}h", lambda table: (
+        TRAJECTORY_QUERY.format(table=table), {'mmsi': mmsi, 'start_time': window_start, 'end_time': window_end})))
+
+    header = f"{'case':<34}{'table':<22}{'granules':>16}{'rows read':>14}{'MB read':>10}{'rows out':>10}{'p50 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, build in cases:
+        for table in (args.before, args.after):
+            query, params = build(table)
+            r = run_case(client, query, params, args.runs)
+            print(f"{name:<34}{table:<22}{r['granules']:>16}{r['read_rows']:>14,}{r['read_mb']:>10.1f}{r['result_rows']:>10,}{r['latency_ms']:>10.1f}")
+
+if __name__ == '__main__':
+    main()
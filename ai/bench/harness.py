@@ -0,0 +1,149 @@
+"""
+ClickHouse backends for the benchmarks: an in-process chDB session (no
+server needed, `pip install chdb`) or a ClickHouse server.
+
+Both create a fresh ais_data table at the latest schema version in their own
+database and hand out clients through connect(), which the API's pool and
+the ingest Inserter accept in place of get_clickhouse_client.
+
+ChDBClient implements the part of the clickhouse_connect client API the app
+uses (query, query_arrow, query_arrow_stream, query_df, command, insert_arrow)
+with the same parameter binding. chDB runs one query at a time per session,
+so queries are serialized, and per query settings (max_execution_time,
+query_id, ...) are not applied. Compare chDB numbers with chDB numbers.
+"""
+import io
+import os
+import sys
+import threading
+from typing import Any, Optional
+
+import pyarrow as pa
+from clickhouse_connect.driver.binding import bind_query
+from clickhouse_connect.driver.common import StreamContext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import get_clickhouse_client
+from migrate import CREATE_STATEMENTS, LATEST_VERSION
+
+def _python_value(value: Any) -> Any:
+    """Arrow structs to tuples, as clickhouse_connect returns ClickHouse tuples."""
+    if isinstance(value, dict):
+        return tuple(_python_value(v) for v in value.values())
+    if isinstance(value, list):
+        return [_python_value(v) for v in value]
+    return value
+
+class ChDBResult:
+    """The query result attributes the app reads."""
+
+    def __init__(self, table: pa.Table):
+        self.column_names = tuple(table.column_names)
+        columns = [[_python_value(v) for v in column.to_pylist()] for column in table.columns]
+        self.result_rows = list(zip(*columns))
+
+class ChDBClient:
+    """A clickhouse_connect style client over a shared chDB session."""
+
+    def __init__(self, session, lock: threading.Lock):
+        self.session = session
+        self.lock = lock
+
+    def _run(self, query: str, parameters=None, fmt: str = 'ArrowTable', data: Optional[pa.Table] = None):
+        query, params = bind_query(query, parameters)
+        # Server side {name:Type} parameters are bound by chDB
+        params = {name[len('param_'):]: value for name, value in params.items()}
+        with self.lock:
+            return self.session.query(query, fmt, params=params) if params else self.session.query(query, fmt)
+
+    def query(self, query: str, parameters=None, settings: Optional[dict] = None, **kwargs) -> ChDBResult:
+        return ChDBResult(self._run(query, parameters))
+
+    def query_arrow(self, query: str, parameters=None, settings: Optional[dict] = None, **kwargs) -> pa.Table:
+        return self._run(query, parameters)
+
+    def query_arrow_stream(self, query: str, parameters=None, settings: Optional[dict] = None, **kwargs) -> StreamContext:
+        table = self._run(query, parameters)
+        return StreamContext(io.BytesIO(), iter(table.to_batches(max_chunksize=65536)))
+
+    def query_df(self, query: str, parameters=None, settings: Optional[dict] = None, **kwargs):
+        return self._run(query, parameters).to_pandas()
+
+    def command(self, cmd: str, parameters=None, settings: Optional[dict] = None, **kwargs):
+        if cmd.lstrip().upper().startswith('KILL'):
+            # Nothing runs in the background to kill
+            return None
+        result = self._run(cmd, parameters)
+        if result.num_rows == 1 and result.num_columns == 1:
+            return result.column(0)[0].as_py()
+        return _python_value(result.to_pylist()) if result.num_rows else None
+
+    def insert_arrow(self, table: str, arrow_table: pa.Table, database: Optional[str] = None, settings: Optional[dict] = None):
+        target = f"{database}.{table}" if database else table
+        columns = ", ".join(arrow_table.column_names)
+        with self.lock:
+            # Python() reads arrow_table from this frame
+            self.session.query(f"INSERT INTO {target} ({columns}) SELECT * FROM Python(arrow_table)")
+
+    def ping(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+class ChDBBackend:
+    """ais_data in a temporary chDB session."""
+
+    name = 'chdb'
+
+    def __init__(self, database: str = 'ais_bench', table: str = 'ais_data'):
+        try:
+            from chdb import session
+        except ImportError:
+            raise RuntimeError("The chdb backend needs chDB: pip install chdb")
+        self.database = database
+        self.table = table
+        self.session = session.Session()
+        self.lock = threading.Lock()
+
+    def setup(self):
+        """Creates an empty ais_data table and makes its database the default."""
+        client = self.connect()
+        client.command(f"CREATE DATABASE IF NOT EXISTS {self.database}")
+        client.command(f"USE {self.database}")
+        client.command(f"DROP TABLE IF EXISTS {self.table}")
+        client.command(CREATE_STATEMENTS[LATEST_VERSION].format(table=self.table))
+
+    def connect(self) -> ChDBClient:
+        return ChDBClient(self.session, self.lock)
+
+    def close(self):
+        self.session.close()
+
+class ServerBackend:
+    """ais_data in its own database on the ClickHouse server configured in .env."""
+
+    name = 'server'
+
+    def __init__(self, database: str = 'ais_bench', table: str = 'ais_data'):
+        self.database = database
+        self.table = table
+
+    def setup(self):
+        """Creates the database and an empty ais_data table."""
+        client = get_clickhouse_client(database='default')
+        try:
+            client.command(f"CREATE DATABASE IF NOT EXISTS {self.database}")
+            client.command(f"DROP TABLE IF EXISTS {self.database}.{self.table}")
+            client.command(CREATE_STATEMENTS[LATEST_VERSION].format(table=f"{self.database}.{self.table}"))
+        finally:
+            client.close()
+
+    def connect(self):
+        return get_clickhouse_client(database=self.database)
+
+    def close(self):
+        pass
+
+BACKENDS = {'chdb': ChDBBackend, 'server': ServerBackend}
@@ -0,0 +1,158 @@
+"""
+End-to-end benchmark suite: synthetic AIS data loaded into chDB or a local
+ClickHouse server, the API served from this process against it, and a stub
+LM standing in for Ollama.
+
+Suites:
+    ingest         rows/s through the ingest Inserter
+    geo            /api/data/geo latency percentiles per bbox size and mode
+    serialization  CPU and bytes per 100k rows of each geo output format
+    chat           /api/chat/stream latency over a stub LM that answers instantly
+
+Results are written as JSON with the commit they were measured on. Pass an
+earlier file with --compare to print the change of every measurement.
+
+Usage (from the ai/ directory):
+    python bench/run.py --backend chdb --out bench-results.json
+    python bench/run.py --backend server --suites geo,chat --compare bench-results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.bench_chat_stream import fake_lm_app, free_port, serve_in_thread
+from bench.harness import BACKENDS
+from bench.synthetic import DEFAULT_BBOX, generate
+
+SUITES = ('ingest', 'geo', 'serialization', 'chat')
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {'commit': commit, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+def flatten(value, prefix: str = '') -> dict:
+    """Numeric leaves of nested dicts, keyed by their dotted path."""
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            out.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+        return out
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def compare(baseline: dict, current: dict):
+    """Prints every measurement present in both results with its relative change."""
+    old, new = flatten(baseline['suites']), flatten(current['suites'])
+    print(f"\nCompared with {baseline.get('commit') or 'unknown commit'} ({baseline.get('created')}):")
+    print(f"{'measurement':<55}{'before':>14}{'after':>14}{'change':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        change = f"{(new[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else ''
+        print(f"{key:<55}{old[key]:>14,.2f}{new[key]:>14,.2f}{change:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='chdb')
+    parser.add_argument('--database', default='ais_bench', help="Database created for the benchmark data")
+    parser.add_argument('--suites', default=','.join(SUITES), help=f"Comma separated, from {', '.join(SUITES)}")
+    parser.add_argument('--vessels', type=int, default=1000)
+    parser.add_argument('--hours', type=float, default=6)
+    parser.add_argument('--ping-seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--insert-threads', type=int, default=4)
+    parser.add_argument('--bbox-sizes', default='0.05,0.25,1,4', help="Geo bbox side lengths in degrees")
+    parser.add_argument('--geo-requests', type=int, default=20, help="Requests per bbox size and mode")
+    parser.add_argument('--serialization-rows', type=int, default=100_000)
+    parser.add_argument('--chat-requests', type=int, default=20)
+    parser.add_argument('--out', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+    suites = [s.strip() for s in args.suites.split(',') if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    # The stub LM and API settings have to be in place before main is imported
+    lm_port, api_port = free_port(), free_port()
+    serve_in_thread(fake_lm_app(words=50, prefill=0, tokens_per_second=100_000), lm_port)
+    lm_url = f"http://127.0.0.1:{lm_port}"
+    os.environ['OLLAMA_BASE_URL'] = lm_url
+    os.environ['OLLAMA_MODEL'] = 'fake'
+    os.environ['PREDICTION_CACHE_PATH'] = ''
+    # No network fetch of litellm's model price list while measuring
+    os.environ.setdefault('LITELLM_LOCAL_MODEL_COST_MAP', 'True')
+
+    import main as api
+    from bench import suites as bench_suites
+
+    backend = BACKENDS[args.backend](database=args.database)
+    print(f"Setting up {backend.name} backend, database {args.database}...")
+    backend.setup()
+    api.db_pool.connect = backend.connect
+
+    start = time.perf_counter()
+    tables = list(generate(args.vessels, args.hours, args.ping_seconds, args.seed, block_rows=500_000))
+    generate_seconds = time.perf_counter() - start
+    rows = sum(t.num_rows for t in tables)
+    print(f"Generated {rows:,} rows for {args.vessels} vessels in {generate_seconds:.1f}s.")
+
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        **git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': backend.name,
+        'params': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+        'suites': {'generate': {'rows': rows, 'rows_per_s': round(rows / generate_seconds)}},
+    }
+
+    # Geo needs the data even when ingest isn't measured
+    if 'ingest' in suites or 'geo' in suites:
+        print("Running ingest...")
+        results['suites']['ingest'] = bench_suites.run_ingest(backend.connect, backend.table, tables, args.insert_threads)
+        if 'ingest' not in suites:
+            del results['suites']['ingest']
+
+    if 'serialization' in suites:
+        print("Running serialization...")
+        sample = tables[0].slice(0, args.serialization_rows)
+        results['suites']['serialization'] = bench_suites.run_serialization(sample)
+
+    if 'geo' in suites or 'chat' in suites:
+        serve_in_thread(api.app, api_port)
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    if 'geo' in suites:
+        print("Running geo...")
+        sizes = [float(s) for s in args.bbox_sizes.split(',')]
+        results['suites']['geo'] = bench_suites.run_geo(api_url, api.geo_cache.clear, DEFAULT_BBOX, sizes,
+                                                        ['all', 'latest'], args.geo_requests, args.seed)
+
+    if 'chat' in suites:
+        print("Running chat...")
+        results['suites']['chat'] = bench_suites.run_chat(api_url, lm_url, args.chat_requests)
+
+    backend.close()
+    print(json.dumps(results['suites'], indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+if __name__ == '__main__':
+    main()
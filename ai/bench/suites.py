@@ -0,0 +1,136 @@
+"""
+Benchmark suites run by bench/run.py. Each returns a JSON serializable dict
+of measurements; latencies are in milliseconds.
+"""
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import httpx
+import numpy as np
+import pyarrow as pa
+
+from bench.bench_geo_formats import encode_records, measure
+from formats import ENCODERS
+from ingest.ingest_ais import Inserter
+
+def percentiles(samples: List[float]) -> dict:
+    """p50/p90/p99/mean/max of latencies in seconds, as milliseconds."""
+    ms = np.array(samples) * 1000
+    return {
+        'n': len(samples),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+def run_ingest(connect: Callable, table_name: str, tables: List[pa.Table], threads: int = 4) -> dict:
+    """
+    Inserts the tables through the ingest Inserter, threads at a time, and
+    reports rows and Arrow bytes per second of wall clock.
+    """
+    inserter = Inserter(table_name, threads, connect=connect)
+    rows = sum(t.num_rows for t in tables)
+    nbytes = sum(t.nbytes for t in tables)
+    start = time.perf_counter()
+    try:
+        list(inserter.executor.map(inserter.insert_table, tables))
+    finally:
+        inserter.executor.shutdown()
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'blocks': len(tables),
+        'threads': threads,
+        'seconds': round(elapsed, 3),
+        'rows_per_s': round(rows / elapsed),
+        'mb_per_s': round(nbytes / elapsed / 1e6, 2),
+    }
+
+def run_geo(api_url: str, clear_cache: Callable[[], None], bbox: tuple, sizes: List[float], modes: List[str],
+            requests: int, seed: int = 0) -> dict:
+    """
+    Times /api/data/geo over random bboxes of each size (degrees per side)
+    inside the data's bbox. Every request first runs uncached, then again
+    to time the cached path.
+    """
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = bbox
+    results = {}
+    with httpx.Client(base_url=api_url, timeout=120) as client:
+        for size in sizes:
+            for mode in modes:
+                cold, warm, rows, body_bytes = [], [], [], []
+                for _ in range(requests):
+                    lat = rng.uniform(min_lat, max(min_lat, max_lat - size))
+                    lon = rng.uniform(min_lon, max(min_lon, max_lon - size))
+                    body = {'min_lat': lat, 'max_lat': lat + size, 'min_lon': lon, 'max_lon': lon + size, 'mode': mode}
+                    clear_cache()
+                    for samples in (cold, warm):
+                        start = time.perf_counter()
+                        response = client.post('/api/data/geo', json=body)
+                        samples.append(time.perf_counter() - start)
+                        response.raise_for_status()
+                    rows.append(len(response.json()))
+                    body_bytes.append(len(response.content))
+                results[f"{size:g}deg_{mode}"] = {
+                    'uncached': percentiles(cold),
+                    'cached': percentiles(warm),
+                    'mean_rows': round(statistics.mean(rows)),
+                    'mean_bytes': round(statistics.mean(body_bytes)),
+                }
+    return results
+
+def run_serialization(table: pa.Table, runs: int = 3) -> dict:
+    """CPU time per 100k rows and body size of each /api/data/geo output format."""
+    per_100k = 100_000 / max(table.num_rows, 1)
+    results = {}
+    for name, encoder in [('records', encode_records)] + list(ENCODERS.items()):
+        body, cpu = measure(encoder, table, runs)
+        results[name] = {'cpu_ms_per_100k': round(cpu * 1000 * per_100k, 2), 'bytes_per_100k': round(len(body) * per_100k)}
+    return {'rows': table.num_rows, 'formats': results}
+
+def run_chat(api_url: str, lm_url: str, requests: int, concurrency: int = 1) -> dict:
+    """
+    Latency of /api/chat/stream against a stub LM that answers instantly,
+    next to the latency of calling the stub directly. The difference is
+    what the API adds: DSPy prompt building and parsing, streaming and
+    history handling.
+    """
+    completion = {'model': 'fake', 'stream': True, 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+    def call_lm(i: int) -> float:
+        start = time.perf_counter()
+        with httpx.stream('POST', f"{lm_url}/v1/chat/completions", json=completion, timeout=60) as response:
+            for _ in response.iter_lines():
+                pass
+        return time.perf_counter() - start
+
+    def call_api(i: int) -> float:
+        # A new question every time so no cache answers
+        body = {'message': f"benchmark question {i} {time.time()}",
+                'history': [{'role': 'user', 'content': f"earlier question {j}"} for j in range(4)]}
+        start = time.perf_counter()
+        with httpx.stream('POST', f"{api_url}/api/chat/stream", json=body, timeout=60) as response:
+            lines = [line for line in response.iter_lines() if line]
+        if not any(json.loads(line).get('type') == 'text' for line in lines):
+            raise RuntimeError(f"No answer from /api/chat/stream: {lines}")
+        return time.perf_counter() - start
+
+    # The first call pays for connection setup and DSPy's adapter, keep it out
+    call_lm(-1)
+    call_api(-1)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        lm = list(executor.map(call_lm, range(requests)))
+        api = list(executor.map(call_api, range(requests)))
+    lm_stats, api_stats = percentiles(lm), percentiles(api)
+    return {
+        'concurrency': concurrency,
+        'lm': lm_stats,
+        'endpoint': api_stats,
+        'overhead_p50_ms': round(api_stats['p50_ms'] - lm_stats['p50_ms'], 3),
+    }
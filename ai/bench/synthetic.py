@@ -0,0 +1,238 @@
+"""
+Deterministic synthetic AIS data shaped like the ais_data table.
+
+A fleet of vessels with a realistic mix of types, sizes and transceiver
+classes moves through a bbox. Vessels under way follow smooth courses
+(a random walk on heading, speed around a per type cruising speed) and
+bounce off the bbox edges, fishing vessels wander slowly, and moored
+vessels sit still. Each vessel reports at its own rate: every --ping-seconds
+under way for class A, three times slower for class B and eighteen times
+slower when moored, like the real AIS reporting intervals. The same seed
+gives the same rows.
+
+Usage (from the ai/ directory):
+    python bench/synthetic.py --vessels 2000 --hours 24 --out /tmp/ais.parquet
+    python bench/synthetic.py --vessels 500 --hours 1 --out /tmp/ais.csv
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest.ingest_ais import AIS_ARROW_SCHEMA, normalize_chunk
+
+# Off the US west coast, roughly the area of the MarineCadastre sample days
+DEFAULT_BBOX = (32.0, 42.0, -126.0, -117.0)
+DEFAULT_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# name, share of the fleet, AIS type codes, cruising knots, length range (m)
+VESSEL_CLASSES = [
+    ('cargo', 0.30, (70, 79), 14.0, (120, 400)),
+    ('tanker', 0.15, (80, 89), 12.0, (100, 330)),
+    ('passenger', 0.05, (60, 69), 18.0, (30, 300)),
+    ('fishing', 0.15, (30, 30), 4.0, (10, 60)),
+    ('tug', 0.10, (31, 32), 8.0, (15, 40)),
+    ('pleasure', 0.20, (36, 37), 7.0, (6, 30)),
+    ('other', 0.05, (50, 59), 10.0, (10, 80)),
+]
+# Share of vessels moored for the whole run
+MOORED_SHARE = 0.2
+# Reporting interval multipliers relative to --ping-seconds
+CLASS_B_EVERY = 3
+MOORED_EVERY = 18
+
+def make_fleet(vessels: int, bbox: Tuple[float, float, float, float] = DEFAULT_BBOX, seed: int = 0) -> dict:
+    """
+    Draws the static data and initial state of a fleet.
+
+    Returns:
+        dict: Arrays of length vessels: MMSI, VesselName, IMO, CallSign,
+        VesselType, Length, Width, Draft, TransceiverClass, cruise (knots),
+        wander (heading noise), moored, every (reporting interval in steps),
+        phase, and the initial lat, lon, heading.
+    """
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = bbox
+    shares = np.array([c[1] for c in VESSEL_CLASSES])
+    kind = rng.choice(len(VESSEL_CLASSES), size=vessels, p=shares / shares.sum())
+
+    type_lo = np.array([c[2][0] for c in VESSEL_CLASSES])[kind]
+    type_hi = np.array([c[2][1] for c in VESSEL_CLASSES])[kind]
+    length_lo = np.array([c[4][0] for c in VESSEL_CLASSES])[kind]
+    length_hi = np.array([c[4][1] for c in VESSEL_CLASSES])[kind]
+    length = rng.uniform(length_lo, length_hi)
+    small = length < 40
+    class_b = small & (rng.random(vessels) < 0.8)
+    moored = rng.random(vessels) < MOORED_SHARE
+
+    every = np.where(class_b, CLASS_B_EVERY, 1) * np.where(moored, MOORED_EVERY, 1)
+    mmsi = 200_000_000 + rng.choice(600_000_000, size=vessels, replace=False)
+    names = np.array([f"{VESSEL_CLASSES[k][0].upper()} {i:05d}" for i, k in enumerate(kind)], dtype=object)
+    # Some transceivers never send their static data
+    names[rng.random(vessels) < 0.02] = ''
+    return {
+        'MMSI': mmsi.astype(np.uint32),
+        'VesselName': names,
+        'IMO': np.array([f"IMO{9_000_000 + i}" if not b else '' for i, b in enumerate(class_b)], dtype=object),
+        'CallSign': np.array([f"W{i:05d}" for i in range(vessels)], dtype=object),
+        'VesselType': rng.integers(type_lo, type_hi + 1).astype(np.uint16),
+        'Length': length.astype(np.float32),
+        'Width': (length / rng.uniform(5, 8, vessels)).astype(np.float32),
+        'Draft': np.where(class_b, np.nan, length / 25 + rng.uniform(0, 2, vessels)).astype(np.float32),
+        'TransceiverClass': np.where(class_b, 'B', 'A').astype(object),
+        'cruise': np.array([c[3] for c in VESSEL_CLASSES])[kind] * rng.uniform(0.7, 1.3, vessels),
+        'wander': np.where(kind == 3, 0.3, 0.02),
+        'moored': moored,
+        'every': every.astype(np.int64),
+        'phase': rng.integers(0, every),
+        'lat': rng.uniform(min_lat, max_lat, vessels),
+        'lon': rng.uniform(min_lon, max_lon, vessels),
+        'heading': rng.uniform(0, 2 * np.pi, vessels),
+    }
+
+def _fold(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """Reflects values into [low, high], so tracks bounce off the bbox edges."""
+    width = high - low
+    return low + width - np.abs((values - low) % (2 * width) - width)
+
+def generate(vessels: int = 1000, hours: float = 24, ping_seconds: float = 10, seed: int = 0,
+             bbox: Tuple[float, float, float, float] = DEFAULT_BBOX, start: datetime = DEFAULT_START,
+             block_rows: int = 1_000_000) -> Iterator[pa.Table]:
+    """
+    Generates synthetic AIS reports in time order, as ais_data shaped Arrow
+    tables of about block_rows rows each (normalized like ingested chunks).
+
+    Args:
+        vessels: Fleet size.
+        hours: Length of the run.
+        ping_seconds: Reporting interval of class A vessels under way.
+        seed: Seed for the fleet and the tracks.
+        bbox: (min_lat, max_lat, min_lon, max_lon) the fleet stays within.
+        start: Time of the first report.
+        block_rows: Approximate rows per yielded table.
+    """
+    fleet = make_fleet(vessels, bbox, seed)
+    rng = np.random.default_rng(seed + 1)
+    min_lat, max_lat, min_lon, max_lon = bbox
+    steps = int(hours * 3600 / ping_seconds)
+    reports_per_step = max(1.0, float(np.sum(1 / fleet['every'])))
+    steps_per_block = max(1, int(block_rows / reports_per_step))
+    start_ms = np.datetime64(start.replace(tzinfo=None), 'ms')
+
+    # Unfolded positions, folded into the bbox when reported
+    lat, lon, heading = fleet['lat'].copy(), fleet['lon'].copy(), fleet['heading'].copy()
+    speed = np.where(fleet['moored'], 0.0, fleet['cruise'])
+    prev_lat, prev_lon = _fold(lat, min_lat, max_lat), _fold(lon, min_lon, max_lon)
+    status = np.where(fleet['moored'], 5, np.where(fleet['VesselType'] == 30, 7, 0)).astype(np.uint8)
+
+    for first in range(0, steps, steps_per_block):
+        n = min(steps_per_block, steps - first)
+        # (n, vessels) state for every step of the block
+        heading_steps = heading + np.cumsum(rng.normal(0, fleet['wander'], (n, vessels)), axis=0)
+        speed_steps = np.clip(speed + np.cumsum(rng.normal(0, 0.05, (n, vessels)), axis=0) * ~fleet['moored'], 0, 40)
+        speed_steps = np.where(fleet['moored'], np.abs(rng.normal(0, 0.05, (n, vessels))), speed_steps)
+        # Knots to degrees: a nautical mile is a minute of latitude
+        distance = speed_steps * ping_seconds / 3600 / 60
+        lat_steps = lat + np.cumsum(distance * np.cos(heading_steps), axis=0)
+        lon_steps = lon + np.cumsum(distance * np.sin(heading_steps) / np.cos(np.radians(_fold(lat_steps, min_lat, max_lat))), axis=0)
+        heading, speed, lat, lon = heading_steps[-1], speed_steps[-1], lat_steps[-1], lon_steps[-1]
+
+        folded_lat = _fold(lat_steps, min_lat, max_lat)
+        folded_lon = _fold(lon_steps, min_lon, max_lon)
+        # Course over ground from the actual movement, which flips at the edges
+        d_lat = np.diff(folded_lat, axis=0, prepend=prev_lat[None, :])
+        d_lon = np.diff(folded_lon, axis=0, prepend=prev_lon[None, :]) * np.cos(np.radians(folded_lat))
+        cog = np.degrees(np.arctan2(d_lon, d_lat)) % 360
+        prev_lat, prev_lon = folded_lat[-1], folded_lon[-1]
+
+        step_index = np.arange(first, first + n)[:, None]
+        reports = (step_index + fleet['phase']) % fleet['every'] == 0
+        step_of, vessel_of = np.nonzero(reports)
+        rows = len(step_of)
+        if not rows:
+            continue
+        jitter = rng.integers(0, int(ping_seconds * 1000), rows)
+        times = start_ms + ((first + step_of) * ping_seconds * 1000 + jitter).astype('timedelta64[ms]')
+        sog = np.round(speed_steps[step_of, vessel_of], 1)
+        course = np.round(cog[step_of, vessel_of], 1)
+        true_heading = np.round(course + rng.normal(0, 3, rows)) % 360
+        moving = sog >= 0.5
+        class_b = fleet['TransceiverClass'][vessel_of] == 'B'
+
+        table = pa.table({
+            'MMSI': pa.array(fleet['MMSI'][vessel_of], pa.uint32()),
+            'BaseDateTime': pa.array(times, pa.timestamp('ms')),
+            'LAT': np.round(folded_lat[step_of, vessel_of], 5),
+            'LON': np.round(folded_lon[step_of, vessel_of], 5),
+            'SOG': pa.array(sog, pa.float32()),
+            'COG': pa.array(np.where(moving, course, 360.0), pa.float32()),
+            # 511 is "not available", most class B units have no heading sensor
+            'Heading': pa.array(np.where(class_b | ~moving, 511, true_heading), pa.uint16()),
+            'VesselName': pa.array(fleet['VesselName'][vessel_of], pa.string()),
+            'IMO': pa.array(fleet['IMO'][vessel_of], pa.string()),
+            'CallSign': pa.array(fleet['CallSign'][vessel_of], pa.string()),
+            'VesselType': pa.array(fleet['VesselType'][vessel_of], pa.uint16()),
+            'Status': pa.array(np.where(class_b, 15, status[vessel_of]), pa.uint8()),
+            'Length': pa.array(fleet['Length'][vessel_of], pa.float32()),
+            'Width': pa.array(fleet['Width'][vessel_of], pa.float32()),
+            'Draft': pa.array(fleet['Draft'][vessel_of], pa.float32()),
+            'Cargo': pa.array(np.full(rows, np.nan), pa.float32()),
+            'TransceiverClass': pa.array(fleet['TransceiverClass'][vessel_of], pa.string()),
+        }, schema=AIS_ARROW_SCHEMA)
+        yield normalize_chunk(table)
+
+def generate_table(vessels: int = 1000, hours: float = 24, ping_seconds: float = 10, seed: int = 0,
+                   bbox: Tuple[float, float, float, float] = DEFAULT_BBOX, start: datetime = DEFAULT_START,
+                   max_rows: Optional[int] = None) -> pa.Table:
+    """Generates a whole run as one table, optionally cut at max_rows."""
+    tables, rows = [], 0
+    for table in generate(vessels, hours, ping_seconds, seed, bbox, start):
+        tables.append(table)
+        rows += table.num_rows
+        if max_rows is not None and rows >= max_rows:
+            break
+    table = pa.concat_tables(tables) if tables else normalize_chunk(AIS_ARROW_SCHEMA.empty_table())
+    return table.slice(0, max_rows) if max_rows is not None else table
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vessels', type=int, default=1000)
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--ping-seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True, help="Output file, .parquet, .arrow or .csv")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = 0
+    writer = None
+    try:
+        for table in generate(args.vessels, args.hours, args.ping_seconds, args.seed):
+            if writer is None:
+                if args.out.endswith('.parquet'):
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(args.out, table.schema)
+                elif args.out.endswith('.arrow'):
+                    writer = pa.ipc.new_file(args.out, table.schema)
+                elif args.out.endswith('.csv'):
+                    from pyarrow import csv
+                    writer = csv.CSVWriter(args.out, table.schema)
+                else:
+                    parser.error("--out must end in .parquet, .arrow or .csv")
+            writer.write_table(table)
+            rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {rows:,} rows for {args.vessels} vessels to {args.out} in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s).")
+
+if __name__ == '__main__':
+    main()
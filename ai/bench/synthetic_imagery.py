@@ -0,0 +1,152 @@
+"""
+Synthetic satellite scenes as tiled GeoTIFFs with overviews, for the imagery
+service and its benchmarks.
+
+A scene covers a bbox in the UTM zone of its centre at a given ground
+resolution: sea texture with swell, and optionally the vessels of a
+bench/synthetic.py fleet drawn as bright hulls, sized and oriented from
+their AIS Length, Width and COG, where they were at the acquisition time.
+The acquisition time is written to the TIFF DateTime tag like imagery.py
+expects. Scenes are written block by block, so their size is not limited
+by memory.
+
+Usage (from the ai/ directory):
+    python bench/synthetic_imagery.py --out imagery/scene.tif --bbox 36,36.2,-122.2,-122 --resolution 0.5
+    python bench/synthetic_imagery.py --out imagery/big.tif --bbox 35,36,-123,-122 --resolution 0.5 \
+        --vessels 2000 --ais-out /tmp/ais.csv
+    python ingest/ingest_ais.py /tmp/ais.csv
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.warp import transform as transform_points
+from rasterio.windows import Window
+
+from bench.synthetic import DEFAULT_START, generate_table
+
+BLOCK = 512
+
+def utm_crs(lat: float, lon: float) -> str:
+    zone = int((lon + 180) // 6) + 1
+    return f"EPSG:{32600 + zone if lat >= 0 else 32700 + zone}"
+
+def vessels_at(table: pa.Table, at: datetime) -> pa.Table:
+    """
+    Every vessel of an AIS table (e.g. a bench/synthetic.py run) where it was
+    at the moment at, interpolated between its reports around it like
+    imagery.load_vessels_at. Insert the same table to get matching chips, the
+    report times of a synthetic run depend on its length.
+    """
+    times = table.column('BaseDateTime').cast(pa.int64()).to_numpy()
+    mmsi = table.column('MMSI').to_numpy()
+    order = np.lexsort((times, mmsi))
+    times, mmsi = times[order], mmsi[order]
+    at_ms = int(at.timestamp() * 1000)
+    # Last report of each vessel up to at, and the vessel's next report if there is one
+    last = np.append((mmsi[1:] != mmsi[:-1]) | (times[1:] > at_ms), True)
+    before = np.flatnonzero((times <= at_ms) & last)
+    after = np.minimum(before + 1, len(times) - 1)
+    has_after = (mmsi[after] == mmsi[before]) & (times[after] > at_ms)
+    fraction = np.where(has_after, (at_ms - times[before]) / np.maximum(times[after] - times[before], 1), 0.0)
+    result = table.take(pa.array(order[before]))
+    for name in ('LAT', 'LON'):
+        values = table.column(name).to_numpy()[order]
+        result = result.set_column(result.schema.get_field_index(name), name,
+                                   pa.array(values[before] + fraction * (values[after] - values[before])))
+    return result
+
+def write_scene(path: str, bbox: Tuple[float, float, float, float], resolution_m: float, acquired: datetime,
+                vessels: Optional[pa.Table] = None, dtype: str = 'uint8', seed: int = 0,
+                overviews: Tuple[int, ...] = (2, 4, 8, 16, 32, 64)) -> dict:
+    """
+    Writes an RGB scene covering bbox (min_lat, max_lat, min_lon, max_lon).
+
+    Returns:
+        dict: Size and write time of the scene.
+    """
+    min_lat, max_lat, min_lon, max_lon = bbox
+    crs = utm_crs((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+    xs, ys = transform_points('EPSG:4326', crs, [min_lon, max_lon, min_lon, max_lon], [min_lat, min_lat, max_lat, max_lat])
+    left, right, bottom, top = min(xs), max(xs), min(ys), max(ys)
+    width, height = math.ceil((right - left) / resolution_m), math.ceil((top - bottom) / resolution_m)
+    transform = rasterio.transform.from_origin(left, top, resolution_m, resolution_m)
+    scale = 255 if dtype == 'uint8' else 4095
+
+    hulls = np.empty((0, 6))
+    if vessels is not None and vessels.num_rows:
+        vx, vy = transform_points('EPSG:4326', crs, vessels.column('LON').to_pylist(), vessels.column('LAT').to_pylist())
+        length = np.nan_to_num(vessels.column('Length').to_numpy(zero_copy_only=False), nan=20)
+        beam = np.nan_to_num(vessels.column('Width').to_numpy(zero_copy_only=False), nan=6)
+        cog = np.radians(np.nan_to_num(vessels.column('COG').to_numpy(zero_copy_only=False), nan=0))
+        hulls = np.column_stack([vx, vy, np.maximum(length, 5) / 2, np.maximum(beam, 2) / 2, np.sin(cog), np.cos(cog)])
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    start = time.perf_counter()
+    profile = dict(driver='GTiff', width=width, height=height, count=3, dtype=dtype, crs=crs, transform=transform,
+                   tiled=True, blockxsize=BLOCK, blockysize=BLOCK, compress='deflate', nodata=0, BIGTIFF='IF_SAFER')
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.update_tags(TIFFTAG_DATETIME=acquired.strftime('%Y:%m:%d %H:%M:%S'))
+        for row in range(0, height, BLOCK):
+            for col in range(0, width, BLOCK):
+                window = Window(col, row, min(BLOCK, width - col), min(BLOCK, height - row))
+                cols, rows = np.meshgrid(np.arange(window.width) + col + 0.5, np.arange(window.height) + row + 0.5)
+                x, y = left + cols * resolution_m, top - rows * resolution_m
+                # Swell plus per pixel noise, seeded by block so every block is reproducible
+                rng = np.random.default_rng((seed, row, col))
+                sea = 0.18 + 0.04 * np.sin(x / 37.0 + y / 53.0) + 0.02 * rng.standard_normal(x.shape)
+                image = np.stack([sea * 0.35, sea * 0.6, sea]).clip(0.01, 1)
+                near = hulls[(np.abs(hulls[:, 0] - x.mean()) < BLOCK * resolution_m + 500) &
+                             (np.abs(hulls[:, 1] - y.mean()) < BLOCK * resolution_m + 500)]
+                for hx, hy, half_length, half_beam, sin_cog, cos_cog in near:
+                    # Along and across the vessel's course, COG clockwise from north
+                    along = (x - hx) * sin_cog + (y - hy) * cos_cog
+                    across = (x - hx) * cos_cog - (y - hy) * sin_cog
+                    hull = (np.abs(along) <= half_length) & (np.abs(across) <= half_beam * (1 - 0.5 * np.clip(along / half_length, 0, 1)))
+                    image[:, hull] = 0.9
+                dst.write((image * scale).astype(dtype), window=window)
+        dst.build_overviews(list(overviews), Resampling.average)
+        dst.update_tags(ns='rio_overview', resampling='average')
+    return {'path': path, 'width': width, 'height': height, 'bytes': os.path.getsize(path),
+            'seconds': round(time.perf_counter() - start, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help="Output GeoTIFF")
+    parser.add_argument('--bbox', required=True, help="min_lat,max_lat,min_lon,max_lon")
+    parser.add_argument('--resolution', type=float, default=0.5, help="Ground resolution in metres")
+    parser.add_argument('--acquired', type=datetime.fromisoformat, default=datetime(2024, 1, 1, 12, tzinfo=DEFAULT_START.tzinfo))
+    parser.add_argument('--vessels', type=int, default=0, help="Draw the vessels of a synthetic fleet of this size")
+    parser.add_argument('--ais-out', help="Write the fleet's AIS reports to this .csv (for ingest_ais.py) or .parquet file")
+    parser.add_argument('--dtype', choices=['uint8', 'uint16'], default='uint8')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    bbox = tuple(float(v) for v in args.bbox.split(','))
+    vessels = None
+    if args.vessels:
+        # A run covering the acquisition time, --ais-out writes it for loading the matching AIS data
+        hours = (args.acquired - DEFAULT_START).total_seconds() / 3600 + 1
+        table = generate_table(args.vessels, hours, seed=args.seed, bbox=bbox)
+        vessels = vessels_at(table, args.acquired)
+        if args.ais_out and args.ais_out.endswith('.csv'):
+            from pyarrow import csv
+            csv.write_csv(table, args.ais_out)
+        elif args.ais_out:
+            import pyarrow.parquet as pq
+            pq.write_table(table, args.ais_out)
+    info = write_scene(args.out, bbox, args.resolution, args.acquired, vessels, args.dtype, args.seed)
+    print(f"Wrote {info['width']}x{info['height']} scene ({info['bytes'] / 1e6:.1f} MB) to {args.out} in {info['seconds']:.1f}s.")
+
+if __name__ == '__main__':
+    main()
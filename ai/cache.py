@@ -0,0 +1,189 @@
+import logging
+import os
+import sys
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from db import QueryCancelledError
+
+logger = logging.getLogger(__name__)
+
+def _sizeof(value: Any) -> int:
+    """Approximate memory footprint of a cached result in bytes."""
+    if isinstance(value, pa.Table):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
+
+class _Entry:
+    __slots__ = ('value', 'size', 'expires_at', 'watermark')
+
+    def __init__(self, value: Any, size: int, expires_at: float, watermark: Any):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.watermark = watermark
+
+class QueryCache:
+    """
+    Memory-bounded LRU cache for query results with a TTL, single-flight
+    loading and invalidation on a per-table watermark.
+
+    Every entry is stamped with its table's watermark (the newest BaseDateTime)
+    at load time and is dropped once the table's current watermark differs,
+    i.e. as soon as new data has been ingested. Watermarks are re-read at most
+    every watermark_interval seconds. Concurrent misses on the same key share
+    one load; the load is cancelled only if every waiter goes away.
+
+    Settings are read from the environment unless given explicitly:
+        GEO_CACHE_MAX_MB: Memory budget for cached results (default 256).
+        GEO_CACHE_TTL: Seconds an entry stays valid (default 60).
+        GEO_CACHE_WATERMARK_INTERVAL: Seconds between watermark reads (default 5).
+    """
+
+    def __init__(self, watermark_fn: Callable[[str], Awaitable[Any]], max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, watermark_interval: Optional[float] = None):
+        self.watermark_fn = watermark_fn
+        self.max_bytes = max_bytes or int(float(os.getenv('GEO_CACHE_MAX_MB', 256)) * 1024 * 1024)
+        self.ttl = ttl or float(os.getenv('GEO_CACHE_TTL', 60))
+        self.watermark_interval = watermark_interval or float(os.getenv('GEO_CACHE_WATERMARK_INTERVAL', 5))
+
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[Hashable, list] = {}
+        self._watermarks: Dict[str, tuple] = {}
+        self._watermark_locks: Dict[str, asyncio.Lock] = {}
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+            'oversized': 0,
+        }
+
+    def stats(self) -> dict:
+        """Returns the hit/miss/eviction counters and current usage."""
+        lookups = self.counters['hits'] + self.counters['misses'] + self.counters['coalesced']
+        return {
+            **self.counters,
+            'hit_rate': round(self.counters['hits'] / lookups, 4) if lookups else 0.0,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    async def watermark(self, table: str) -> Any:
+        """Returns the table's watermark, re-reading it at most every watermark_interval."""
+        cached = self._watermarks.get(table)
+        if cached and time.monotonic() - cached[1] < self.watermark_interval:
+            return cached[0]
+        lock = self._watermark_locks.setdefault(table, asyncio.Lock())
+        async with lock:
+            cached = self._watermarks.get(table)
+            if cached and time.monotonic() - cached[1] < self.watermark_interval:
+                return cached[0]
+            try:
+                value = await self.watermark_fn(table)
+            except Exception as e:
+                # Without a watermark entries still expire through the TTL
+                logger.error(f"Error reading cache watermark for {table}: {e}")
+                value = None
+            self._watermarks[table] = (value, time.monotonic())
+            return value
+
+    def _lookup(self, key: Hashable, watermark: Any) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self.counters['expirations'] += 1
+        elif entry.watermark != watermark:
+            self.counters['invalidations'] += 1
+        else:
+            self._entries.move_to_end(key)
+            return entry
+        self._remove(key)
+        return None
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _store(self, key: Hashable, value: Any, watermark: Any):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            self.counters['oversized'] += 1
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, size, time.monotonic() + self.ttl, watermark)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.counters['evictions'] += 1
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], watermark: Any) -> Any:
+        try:
+            value = await loader()
+            self._store(key, value, watermark)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, table: str, loader: Callable[[], Awaitable[Any]],
+                          is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                          poll_interval: float = 0.25) -> Any:
+        """
+        Returns the cached value for key, or awaits loader() to produce it.
+
+        Args:
+            key: Hashable cache key, should include the table.
+            table: Table whose watermark guards the entry.
+            loader: Coroutine function loading the value on a miss.
+            is_disconnected: Optional disconnect check for this caller,
+                             e.g. Request.is_disconnected.
+
+        Raises:
+            QueryCancelledError: If this caller disconnected while waiting.
+        """
+        watermark = await self.watermark(table)
+        entry = self._lookup(key, watermark)
+        if entry is not None:
+            self.counters['hits'] += 1
+            return entry.value
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.counters['misses'] += 1
+            task = asyncio.create_task(self._load(key, loader, watermark))
+            flight = self._inflight[key] = [task, 0]
+        else:
+            self.counters['coalesced'] += 1
+        task = flight[0]
+        flight[1] += 1
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=poll_interval if is_disconnected else None)
+                if done:
+                    return task.result()
+                if await is_disconnected():
+                    raise QueryCancelledError("Client disconnected while waiting for a cached query")
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not task.done():
+                task.cancel()
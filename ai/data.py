@@ -1,35 +1,136 @@
+import logging
 import os
 import clickhouse_connect
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from datetime import datetime
+from typing import List, Optional, Tuple
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 # Load environment variables from .env file
 load_dotenv(dotenv_path='.env')
 
-def get_clickhouse_client():
+def get_clickhouse_client(**kwargs):
     """
     Establishes a connection to the ClickHouse database using credentials
     from environment variables.
 
+    Args:
+        **kwargs: Extra options for clickhouse_connect.get_client, e.g.
+                  connect_timeout or send_receive_timeout. They override
+                  the environment, e.g. database.
+
     Returns:
         clickhouse_connect.driver.client.Client: The ClickHouse client instance.
     """
     try:
-        client = clickhouse_connect.get_client(
-            host=os.getenv('CLICKHOUSE_URL', 'localhost').replace('http://', '').replace('https://', ''), # Remove protocol if present
-            port=int(os.getenv('CLICKHOUSE_PORT', 8123)), # Default http port
-            username=os.getenv('CLICKHOUSE_USER'),
-            password=os.getenv('CLICKHOUSE_PASSWORD'),
-            database=os.getenv('CLICKHOUSE_DATABASE')
-        )
+        client = clickhouse_connect.get_client(**{
+            'host': os.getenv('CLICKHOUSE_URL', 'localhost').replace('http://', '').replace('https://', ''), # Remove protocol if present
+            'port': int(os.getenv('CLICKHOUSE_PORT', 8123)), # Default http port
+            'username': os.getenv('CLICKHOUSE_USER'),
+            'password': os.getenv('CLICKHOUSE_PASSWORD'),
+            'database': os.getenv('CLICKHOUSE_DATABASE'),
+            **kwargs
+        })
         client.ping() # Verify connection
-        print("Successfully connected to ClickHouse.")
+        logger.info("Successfully connected to ClickHouse.")
         return client
     except Exception as e:
-        print(f"Error connecting to ClickHouse: {e}")
-        raise # Re-raise the exception after printing
+        logger.error(f"Error connecting to ClickHouse: {e}")
+        raise # Re-raise the exception after logging
+
+# Columns of the ais_data table, in table order. Used to validate column
+# projections since column names cannot be passed as query parameters.
+AIS_COLUMNS = [
+    'MMSI', 'BaseDateTime', 'LAT', 'LON', 'SOG', 'COG', 'Heading',
+    'VesselName', 'IMO', 'CallSign', 'VesselType', 'Status',
+    'Length', 'Width', 'Draft', 'Cargo', 'TransceiverClass'
+]
+
+# 'all' returns every ping in the bbox, 'latest' returns one row per MMSI
+GEO_QUERY_MODES = ('all', 'latest')
+
+def build_geo_query(min_lat: float, max_lat: float, min_lon: float, max_lon: float, table: str = 'ais_data', limit: int = 10000,
+                    start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                    mode: str = 'all', columns: Optional[List[str]] = None) -> Tuple[str, dict]:
+    """
+    Builds the SQL and parameters for a bounding box query.
+
+    In 'latest' mode the rows are grouped by MMSI and every projected column
+    is taken with argMax over BaseDateTime, so each vessel appears once with
+    its most recent position inside the box and time window.
+
+    Args:
+        min_lat, max_lat, min_lon, max_lon: The bounding box.
+        table: The name of the table to query.
+        limit: Maximum number of rows (vessels in 'latest' mode). 0 disables it.
+        start_time: Only include rows with BaseDateTime >= start_time.
+        end_time: Only include rows with BaseDateTime <= end_time.
+        mode: One of GEO_QUERY_MODES.
+        columns: Optional column projection. Defaults to all AIS_COLUMNS.
+
+    Returns:
+        Tuple[str, dict]: The query string and its parameters.
+    """
+    if mode not in GEO_QUERY_MODES:
+        raise ValueError(f"Unknown geo query mode '{mode}', expected one of {GEO_QUERY_MODES}")
+    if columns:
+        unknown = [col for col in columns if col not in AIS_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown columns requested: {unknown}")
+    else:
+        columns = AIS_COLUMNS
+
+    conditions = [
+        "LAT >= %(min_lat)s AND LAT <= %(max_lat)s",
+        "LON >= %(min_lon)s AND LON <= %(max_lon)s",
+    ]
+    params = {
+        'min_lat': min_lat,
+        'max_lat': max_lat,
+        'min_lon': min_lon,
+        'max_lon': max_lon
+    }
+    if start_time is not None:
+        conditions.append("BaseDateTime >= %(start_time)s")
+        params['start_time'] = start_time
+    if end_time is not None:
+        conditions.append("BaseDateTime <= %(end_time)s")
+        params['end_time'] = end_time
+    where = "\n      AND ".join(conditions)
+    limit_clause = f"LIMIT {int(limit)}" if limit > 0 else ""
+
+    if mode == 'latest':
+        # MMSI is always returned since it is the grouping key. The inner query
+        # uses prefixed aliases so they don't shadow the columns in WHERE.
+        value_columns = [col for col in columns if col != 'MMSI']
+        inner = ", ".join(f"argMax({col}, BaseDateTime) AS latest_{col}" for col in value_columns)
+        outer = ", ".join(f"latest_{col} AS {col}" for col in value_columns)
+        query = f"""
+    SELECT MMSI{", " + outer if outer else ""}
+    FROM (
+        SELECT MMSI{", " + inner if inner else ""}
+        FROM {table}
+        WHERE {where}
+        GROUP BY MMSI
+        {limit_clause}
+    )
+    """
+    else:
+        query = f"""
+    SELECT {", ".join(columns)}
+    FROM {table}
+    WHERE {where}
+      {limit_clause}
+    """
+    return query, params
 
-def load_data_by_geolocation(min_lat: float, max_lat: float, min_lon: float, max_lon: float, table: str = 'ais_data', client = None, limit: int = 10000) -> pd.DataFrame:
+def load_data_by_geolocation(min_lat: float, max_lat: float, min_lon: float, max_lon: float, table: str = 'ais_data', client = None, limit: int = 10000,
+                             start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                             mode: str = 'all', columns: Optional[List[str]] = None, settings: Optional[dict] = None) -> pd.DataFrame:
     """
     Loads data from a specified ClickHouse table within a given
     geographical bounding box.
@@ -42,37 +143,107 @@ def load_data_by_geolocation(min_lat: float, max_lat: float, min_lon: float, max
         table: The name of the table to query (defaults to 'ais_data').
         client: An existing ClickHouse client instance. If None, a new
                 connection will be established.
+        limit: Maximum number of rows to return. 0 disables the limit.
+        start_time: (Optional) Start of the BaseDateTime window, inclusive.
+        end_time: (Optional) End of the BaseDateTime window, inclusive.
+        mode: 'all' for every ping, 'latest' for one row per MMSI.
+        columns: (Optional) Subset of AIS_COLUMNS to return.
+        settings: (Optional) ClickHouse settings for the query, e.g. query_id.
 
     Returns:
         pd.DataFrame: A DataFrame containing the queried data.
+
+    Raises:
+        clickhouse_connect.driver.exceptions.DatabaseError: If the query fails,
+            rather than returning an empty result that would pass for no data.
     """
+    query, params = build_geo_query(
+        min_lat, max_lat, min_lon, max_lon, table=table, limit=limit,
+        start_time=start_time, end_time=end_time, mode=mode, columns=columns
+    )
+
     if client is None:
         client = get_clickhouse_client()
 
-    query = f"""
-    SELECT *
-    FROM {table}
-    WHERE LAT >= %(min_lat)s AND LAT <= %(max_lat)s
-      AND LON >= %(min_lon)s AND LON <= %(max_lon)s
-      {f"LIMIT {limit}" if limit > 0 else ""}
+    logger.debug(f"Querying data from {table} within bounding box: LAT({min_lat}, {max_lat}), LON({min_lon}, {max_lon}), Mode: {mode}")
+    df = client.query_df(query, parameters=params, settings=settings)
+    logger.debug(f"Successfully loaded {len(df)} records.")
+    return df
+
+def load_arrow_by_geolocation(min_lat: float, max_lat: float, min_lon: float, max_lon: float, table: str = 'ais_data', client = None, limit: int = 10000,
+                              start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                              mode: str = 'all', columns: Optional[List[str]] = None, settings: Optional[dict] = None) -> pa.Table:
     """
-    params = {
-        'min_lat': min_lat,
-        'max_lat': max_lat,
-        'min_lon': min_lon,
-        'max_lon': max_lon
-    }
+    Same as load_data_by_geolocation, but reads ClickHouse's Arrow output
+    directly into a pyarrow Table without going through pandas.
 
-    try:
-        print(f"Querying data from {table} within bounding box: LAT({min_lat}, {max_lat}), LON({min_lon}, {max_lon})")
-        df = client.query_df(query, parameters=params)
-        print(f"Successfully loaded {len(df)} records.")
-        return df
-    except Exception as e:
-        print(f"Error querying data: {e}")
-        # Consider whether to return an empty DataFrame or raise the exception
-        # For now, let's return an empty one
-        return pd.DataFrame()
+    Returns:
+        pa.Table: A table containing the queried data.
+    """
+    query, params = build_geo_query(
+        min_lat, max_lat, min_lon, max_lon, table=table, limit=limit,
+        start_time=start_time, end_time=end_time, mode=mode, columns=columns
+    )
+
+    if client is None:
+        client = get_clickhouse_client()
+
+    logger.debug(f"Querying Arrow data from {table} within bounding box: LAT({min_lat}, {max_lat}), LON({min_lon}, {max_lon}), Mode: {mode}")
+    arrow_table = client.query_arrow(query, parameters=params, settings=settings, use_strings=True)
+    logger.debug(f"Successfully loaded {arrow_table.num_rows} records.")
+    return arrow_table
+
+def stream_arrow_by_geolocation(min_lat: float, max_lat: float, min_lon: float, max_lon: float, table: str = 'ais_data', client = None, limit: int = 0,
+                                start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                                mode: str = 'all', columns: Optional[List[str]] = None, settings: Optional[dict] = None):
+    """
+    Streams a bounding box query as Arrow record batches, one per ClickHouse
+    block, so large extracts never have to fit in memory.
+
+    Returns:
+        StreamContext: Use as a context manager and iterate for pa.RecordBatch blocks.
+    """
+    query, params = build_geo_query(
+        min_lat, max_lat, min_lon, max_lon, table=table, limit=limit,
+        start_time=start_time, end_time=end_time, mode=mode, columns=columns
+    )
+
+    if client is None:
+        client = get_clickhouse_client()
+
+    logger.debug(f"Streaming data from {table} within bounding box: LAT({min_lat}, {max_lat}), LON({min_lon}, {max_lon}), Mode: {mode}")
+    return client.query_arrow_stream(query, parameters=params, settings=settings, use_strings=True)
+
+def crop_to_bbox(result, min_lat: float, max_lat: float, min_lon: float, max_lon: float):
+    """
+    Filters a DataFrame or pyarrow Table with LAT/LON columns down to a bbox.
+    Used to serve a requested bbox from a result loaded for a larger one.
+    """
+    if len(result) == 0:
+        return result
+    if isinstance(result, pa.Table):
+        lat, lon = result.column('LAT'), result.column('LON')
+        mask = pc.and_(
+            pc.and_(pc.greater_equal(lat, min_lat), pc.less_equal(lat, max_lat)),
+            pc.and_(pc.greater_equal(lon, min_lon), pc.less_equal(lon, max_lon))
+        )
+        return result.filter(mask)
+    mask = result['LAT'].between(min_lat, max_lat) & result['LON'].between(min_lon, max_lon)
+    return result[mask]
+
+def get_table_watermark(table: str = 'ais_data', client = None, settings: Optional[dict] = None):
+    """
+    Returns the newest BaseDateTime in a table. It only moves forward as data
+    is ingested, so cached results stamped with an older value are stale.
+
+    Returns:
+        The max BaseDateTime, or None if the table is empty. Errors are raised,
+        QueryCache treats them as an unknown watermark.
+    """
+    if client is None:
+        client = get_clickhouse_client()
+
+    return client.command(f"SELECT max(BaseDateTime) FROM {table}", settings=settings)
 
 if __name__ == '__main__':
     # Define an example bounding box (e.g., around a specific area)
@@ -0,0 +1,267 @@
+import os
+import time
+import uuid
+import queue
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from clickhouse_connect.driver.exceptions import OperationalError
+
+from data import get_clickhouse_client
+from telemetry import record_query_result, span
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeoutError(TimeoutError):
+    """Raised when no ClickHouse connection becomes available in time."""
+
+class QueryCancelledError(Exception):
+    """Raised when a query was killed because the HTTP client went away."""
+
+class ClickHousePool:
+    """
+    A fixed-size pool of ClickHouse clients shared by the FastAPI app.
+
+    Queries are run on a bounded thread pool (one worker per connection) so
+    the blocking clickhouse_connect calls never run on the event loop. Idle
+    connections are pinged before reuse and replaced if the ping fails.
+
+    Settings are read from the environment unless given explicitly:
+        CLICKHOUSE_POOL_SIZE: Number of connections / worker threads (default 4).
+        CLICKHOUSE_POOL_TIMEOUT: Seconds to wait for a free connection (default 10).
+        CLICKHOUSE_CONNECT_TIMEOUT: HTTP connect timeout in seconds (default 10).
+        CLICKHOUSE_QUERY_TIMEOUT: Server side max_execution_time in seconds (default 30).
+        CLICKHOUSE_HEALTH_CHECK_INTERVAL: Ping connections idle longer than this (default 30).
+
+    connect replaces get_clickhouse_client as the way new clients are made,
+    e.g. to run the app against the benchmark harness's chDB backend.
+    """
+
+    def __init__(self, size: Optional[int] = None, acquire_timeout: Optional[float] = None,
+                 connect_timeout: Optional[float] = None, query_timeout: Optional[float] = None,
+                 health_check_interval: Optional[float] = None, connect: Optional[Callable[[], Any]] = None):
+        self.size = size or int(os.getenv('CLICKHOUSE_POOL_SIZE', 4))
+        self.acquire_timeout = acquire_timeout or float(os.getenv('CLICKHOUSE_POOL_TIMEOUT', 10))
+        self.connect_timeout = connect_timeout or float(os.getenv('CLICKHOUSE_CONNECT_TIMEOUT', 10))
+        self.query_timeout = query_timeout or float(os.getenv('CLICKHOUSE_QUERY_TIMEOUT', 30))
+        self.health_check_interval = health_check_interval or float(os.getenv('CLICKHOUSE_HEALTH_CHECK_INTERVAL', 30))
+        self.connect = connect
+
+        # Each slot is [client or None, last_used]. Clients are created lazily
+        # so the app still starts (and chat still works) if ClickHouse is down.
+        self._slots: "queue.LifoQueue[list]" = queue.LifoQueue()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._control_client = None
+        self._control_lock = threading.Lock()
+
+    def open(self):
+        """Creates the worker threads and tries to warm up one connection."""
+        if self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='clickhouse')
+        for _ in range(self.size):
+            self._slots.put([None, 0.0])
+        try:
+            with self.connection():
+                pass
+        except Exception as e:
+            logger.warning(f"ClickHouse pool started without a live connection: {e}")
+
+    def close(self):
+        """Shuts down the worker threads and closes every connection."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        while True:
+            try:
+                client, _ = self._slots.get_nowait()
+            except queue.Empty:
+                break
+            self._close_client(client)
+        self._close_client(self._control_client)
+        self._control_client = None
+
+    def _connect(self):
+        if self.connect is not None:
+            return self.connect()
+        return get_clickhouse_client(
+            connect_timeout=self.connect_timeout,
+            send_receive_timeout=self.query_timeout + self.connect_timeout
+        )
+
+    @staticmethod
+    def _close_client(client):
+        if client is None:
+            return
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks a client out of the pool, reconnecting it if it is missing or
+        fails its health check.
+
+        Raises:
+            PoolTimeoutError: If no connection is free within acquire_timeout.
+        """
+        with span('clickhouse.acquire'):
+            try:
+                slot = self._slots.get(timeout=self.acquire_timeout)
+            except queue.Empty:
+                raise PoolTimeoutError(f"No ClickHouse connection available after {self.acquire_timeout}s")
+        try:
+            client, last_used = slot
+            if client is not None and time.monotonic() - last_used > self.health_check_interval:
+                if not client.ping():
+                    logger.warning("ClickHouse connection failed health check, reconnecting.")
+                    self._close_client(client)
+                    client = None
+            if client is None:
+                with span('clickhouse.connect'):
+                    client = self._connect()
+            slot[0] = client
+            yield client
+        except OperationalError:
+            # Drop the connection on network errors so the next user reconnects
+            self._close_client(slot[0])
+            slot[0] = None
+            raise
+        finally:
+            slot[1] = time.monotonic()
+            self._slots.put(slot)
+
+    def kill_query(self, query_id: str):
+        """Kills a running query using a dedicated connection outside the pool."""
+        with self._control_lock:
+            try:
+                if self._control_client is None:
+                    self._control_client = self._connect()
+                self._control_client.command(
+                    "KILL QUERY WHERE query_id = %(query_id)s ASYNC",
+                    parameters={'query_id': query_id}
+                )
+                logger.info(f"Killed ClickHouse query {query_id}")
+            except Exception as e:
+                self._close_client(self._control_client)
+                self._control_client = None
+                logger.error(f"Error killing ClickHouse query {query_id}: {e}")
+
+    async def run(self, fn: Callable[..., Any], *args,
+                  is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                  poll_interval: float = 0.25, **kwargs) -> Any:
+        """
+        Runs fn(*args, client=..., settings=..., **kwargs) on the query executor.
+
+        fn receives a pooled client and a settings dict carrying a query_id
+        and max_execution_time. Its duration and result size are recorded
+        under fn's name. If is_disconnected (e.g. Request.is_disconnected)
+        reports that the caller went away, or the awaiting task is cancelled,
+        the query is killed on the server.
+
+        Raises:
+            QueryCancelledError: If the client disconnected before completion.
+        """
+        if self._executor is None:
+            self.open()
+        query_id = uuid.uuid4().hex
+        settings = {'query_id': query_id, 'max_execution_time': int(self.query_timeout)}
+
+        def call():
+            with self.connection() as client:
+                with span('clickhouse.query', fn.__name__, query_id=query_id):
+                    result = fn(*args, client=client, settings=settings, **kwargs)
+            record_query_result(fn.__name__, result)
+            return result
+
+        loop = asyncio.get_running_loop()
+        # The worker logs under the caller's request id
+        future = loop.run_in_executor(self._executor, contextvars.copy_context().run, call)
+        try:
+            if is_disconnected is None:
+                return await future
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=poll_interval)
+                if done:
+                    return future.result()
+                if await is_disconnected():
+                    await loop.run_in_executor(None, self.kill_query, query_id)
+                    raise QueryCancelledError(f"Client disconnected, query {query_id} cancelled")
+        except asyncio.CancelledError:
+            await asyncio.shield(loop.run_in_executor(None, self.kill_query, query_id))
+            raise
+
+    async def stream(self, fn: Callable[..., Any], *args, max_pending: int = 4,
+                     max_execution_time: Optional[int] = None, **kwargs) -> AsyncIterator[Any]:
+        """
+        Runs a streaming query on the executor and yields its blocks as they arrive.
+
+        fn(*args, client=..., settings=..., **kwargs) must return a stream context
+        (e.g. client.query_arrow_stream). At most max_pending blocks are buffered;
+        beyond that the worker stops reading, which pushes back on ClickHouse
+        through the HTTP connection. If the consumer stops early (the client
+        disconnected or the generator was closed) the worker stops and the
+        query is killed.
+
+        Streams hold a pooled connection for their whole duration. They are
+        not bound by the pool's query_timeout unless max_execution_time is given.
+        """
+        if self._executor is None:
+            self.open()
+        query_id = uuid.uuid4().hex
+        settings = {'query_id': query_id}
+        if max_execution_time:
+            settings['max_execution_time'] = int(max_execution_time)
+
+        loop = asyncio.get_running_loop()
+        blocks: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        stop = threading.Event()
+        end_of_stream = object()
+
+        def put(item) -> bool:
+            # Blocks the worker while the queue is full, giving up once the consumer has left
+            pending = asyncio.run_coroutine_threadsafe(blocks.put(item), loop)
+            while True:
+                try:
+                    pending.result(timeout=0.5)
+                    return True
+                except TimeoutError:
+                    if stop.is_set():
+                        pending.cancel()
+                        return False
+
+        def produce():
+            try:
+                with self.connection() as client:
+                    with span('clickhouse.stream', fn.__name__, query_id=query_id):
+                        with fn(*args, client=client, settings=settings, **kwargs) as stream_context:
+                            for block in stream_context:
+                                if stop.is_set() or not put(block):
+                                    return
+                put(end_of_stream)
+            except Exception as e:
+                if not stop.is_set():
+                    put(e)
+
+        future = loop.run_in_executor(self._executor, contextvars.copy_context().run, produce)
+        finished = False
+        try:
+            while True:
+                item = await blocks.get()
+                if item is end_of_stream or isinstance(item, Exception):
+                    finished = True
+                    if isinstance(item, Exception):
+                        raise item
+                    break
+                yield item
+        finally:
+            if not finished and not future.done():
+                stop.set()
+                await loop.run_in_executor(None, self.kill_query, query_id)
@@ -0,0 +1,160 @@
+import io
+import json
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Output formats for /api/data/geo and their media types.
+#   records: [{"MMSI": ..., "LAT": ...}, ...] (the original format)
+#   columns: {"MMSI": [...], "LAT": [...], ...}, one array per field
+#   ndjson:  one JSON record per line
+#   arrow:   Arrow IPC stream
+MEDIA_TYPES = {
+    'records': 'application/json',
+    'columns': 'application/vnd.amis.columns+json',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+def negotiate_format(requested: Optional[str] = None, accept: Optional[str] = None) -> str:
+    """
+    Picks the response format from an explicit request field or the Accept header.
+
+    Args:
+        requested: Format named in the request body, takes precedence.
+        accept: The HTTP Accept header.
+
+    Returns:
+        str: One of the MEDIA_TYPES keys, 'records' if nothing matched.
+    """
+    if requested:
+        if requested not in MEDIA_TYPES:
+            raise ValueError(f"Unknown format '{requested}', expected one of {list(MEDIA_TYPES)}")
+        return requested
+    if accept:
+        # Honour the client's order of preference, ignoring q-values
+        for part in accept.split(','):
+            media_type = part.split(';')[0].strip()
+            for fmt, fmt_media_type in MEDIA_TYPES.items():
+                if fmt != 'records' and media_type == fmt_media_type:
+                    return fmt
+    return 'records'
+
+def clean_records(df: pd.DataFrame) -> list:
+    """
+    Converts a DataFrame to a list of JSON-safe dicts, replacing NaN/inf/NaT
+    with None. This is the original /api/data/geo 'records' path.
+    """
+    # Replace infinity values with NaN
+    df.replace([np.inf, -np.inf], np.nan, inplace=True)
+    # Replace NaN values with None (which becomes null in JSON)
+    for col in df.select_dtypes(include=np.number).columns:
+         if df[col].isnull().any():
+              df[col] = df[col].fillna(np.nan).astype(object).where(df[col].notnull(), None)
+    # Handle potential NaT in datetime columns if necessary
+    for col in df.select_dtypes(include=['datetime64[ns]', 'datetime64[ns, UTC]']).columns:
+        if df[col].isnull().any():
+            # Convert NaT to None before JSON serialization
+            df[col] = df[col].astype(object).where(df[col].notnull(), None)
+    # Convert DataFrame to list of dictionaries (JSON serializable)
+    return df.to_dict(orient='records')
+
+def mask_non_finite(table: pa.Table) -> pa.Table:
+    """Replaces NaN and +/-inf with null in every floating point column, vectorized."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type):
+            column = table.column(i)
+            finite = pc.fill_null(pc.is_finite(column), False)
+            table = table.set_column(i, field.with_nullable(True), pc.if_else(finite, column, pa.scalar(None, field.type)))
+    return table
+
+def _json_ready(table: pa.Table) -> pa.Table:
+    """Masks non-finite floats and renders timestamps as ISO 8601 strings."""
+    table = mask_non_finite(table)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            column = table.column(i)
+            if field.type.tz is not None:
+                column = pc.strftime(column.cast(pa.timestamp(field.type.unit, 'UTC')), format='%Y-%m-%dT%H:%M:%SZ')
+            else:
+                column = pc.strftime(column, format='%Y-%m-%dT%H:%M:%S')
+            table = table.set_column(i, pa.field(field.name, pa.string()), column)
+        elif pa.types.is_binary(field.type):
+            table = table.set_column(i, pa.field(field.name, pa.string()), table.column(i).cast(pa.string()))
+    return table
+
+def to_columns_json(table: pa.Table) -> bytes:
+    """Encodes the table as {"field": [values, ...], ...}."""
+    table = _json_ready(table)
+    columns = {name: table.column(name).to_pylist() for name in table.column_names}
+    return json.dumps(columns, separators=(',', ':')).encode()
+
+def to_ndjson(table: pa.Table) -> bytes:
+    """Encodes the table as newline-delimited JSON records."""
+    if table.num_rows == 0:
+        return b''
+    df = _json_ready(table).to_pandas()
+    # pandas' C encoder writes NaN/None as null without building per-row dicts
+    return df.to_json(orient='records', lines=True).encode()
+
+def to_arrow_ipc(table: pa.Table) -> bytes:
+    """Encodes the table as an Arrow IPC stream."""
+    table = mask_non_finite(table)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+ENCODERS = {
+    'columns': to_columns_json,
+    'ndjson': to_ndjson,
+    'arrow': to_arrow_ipc,
+}
+
+# Formats that can be written incrementally by StreamEncoder
+STREAM_FORMATS = ('ndjson', 'arrow')
+
+class StreamEncoder:
+    """
+    Incrementally encodes Arrow blocks as NDJSON or a single Arrow IPC stream.
+
+    For arrow the schema is written with the first block and the end-of-stream
+    marker by finish(), so the concatenated output is one valid IPC stream.
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in STREAM_FORMATS:
+            raise ValueError(f"Format '{fmt}' cannot be streamed, expected one of {STREAM_FORMATS}")
+        self.fmt = fmt
+        self.rows = 0
+        self._sink = io.BytesIO()
+        self._writer = None
+
+    def encode(self, block) -> bytes:
+        """Encodes one pa.RecordBatch or pa.Table and returns the bytes to send."""
+        table = block if isinstance(block, pa.Table) else pa.Table.from_batches([block])
+        self.rows += table.num_rows
+        if self.fmt == 'ndjson':
+            return to_ndjson(table)
+        table = mask_non_finite(table)
+        if self._writer is None:
+            self._writer = pa.ipc.new_stream(self._sink, table.schema)
+        self._writer.write_table(table)
+        return self._drain()
+
+    def finish(self) -> bytes:
+        """Returns any trailing bytes, i.e. the Arrow end-of-stream marker."""
+        if self._writer is None:
+            return b''
+        self._writer.close()
+        self._writer = None
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
@@ -0,0 +1,186 @@
+import logging
+import os
+import re
+import asyncio
+import hashlib
+import functools
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import dspy
+import litellm
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the chat history block of the prompt
+HISTORY_MAX_TOKENS = int(os.getenv('HISTORY_MAX_TOKENS', 2000))
+# Most recent turns (a user message and the replies to it) kept verbatim
+HISTORY_KEEP_TURNS = int(os.getenv('HISTORY_KEEP_TURNS', 4))
+# Length the rolling summary of older turns is asked to stay within
+HISTORY_SUMMARY_TOKENS = int(os.getenv('HISTORY_SUMMARY_TOKENS', 300))
+# Summaries kept, one per folded prefix of a conversation
+HISTORY_SUMMARY_CACHE_SIZE = int(os.getenv('HISTORY_SUMMARY_CACHE_SIZE', 1024))
+
+# Messages carrying tool output rather than conversation, e.g. "Map summary result: {...}"
+_TOOL_MESSAGE = re.compile(r"^\s*(map summary result|zoom tool result|tool result)\s*:", re.IGNORECASE)
+
+# The whole history is resent every turn, so the same lines are counted again and again
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Counts tokens with litellm's bundled tokenizer (cl100k); close enough for gemma and llama."""
+    if not text:
+        return 0
+    try:
+        return litellm.token_counter(text=text)
+    except Exception:
+        return len(text) // 4 + 1
+
+def _is_tool_message(message: dict) -> bool:
+    return message.get('role') in ('tool', 'function') or bool(_TOOL_MESSAGE.match(message.get('content') or ''))
+
+def _format(message: dict) -> str:
+    role = (message.get('role') or 'user').capitalize()
+    return f"{role}: {message.get('content') or ''}"
+
+def split_turns(messages: List[dict]) -> List[List[dict]]:
+    """Groups messages into turns, each starting at a user message."""
+    turns = []
+    for message in messages:
+        if not turns or (message.get('role') == 'user' and not _is_tool_message(message)):
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+class SummarizeHistorySignature(dspy.Signature):
+    """Update the running summary of a conversation between a user and a maritime map assistant with the new turns.
+    Keep the facts the user may refer back to: places, vessels (names, MMSIs), times, numbers and conclusions."""
+    previous_summary = dspy.InputField(desc="The summary of the conversation so far, may be empty.")
+    new_turns = dspy.InputField(desc="The turns that happened after the summary.")
+    max_words = dspy.InputField(desc="The summary must stay within this many words.")
+
+    summary = dspy.OutputField(desc="The updated summary, as short prose.")
+
+class HistoryManager:
+    """
+    Keeps the chat history in the agent's prompt under a token budget.
+
+    The last keep_turns turns are kept verbatim, older turns are folded into
+    a rolling summary. Tool output in older turns (map summaries and the like)
+    is dropped before anything is summarized. If the verbatim turns alone
+    exceed the budget, the oldest of them are folded as well.
+
+    The frontend sends the whole history with every message, so summaries are
+    cached by a hash of the turns they cover. Extending a summary only sends
+    the previous summary and the newly folded turns to the LM, and it runs in
+    the background: until it's done the turns not yet covered are kept
+    verbatim if the budget allows, so compaction never adds an LM call to a
+    chat turn.
+    """
+
+    def __init__(self, max_tokens: int = HISTORY_MAX_TOKENS, keep_turns: int = HISTORY_KEEP_TURNS,
+                 summary_tokens: int = HISTORY_SUMMARY_TOKENS, cache_size: int = HISTORY_SUMMARY_CACHE_SIZE):
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary_tokens = summary_tokens
+        self.cache_size = cache_size
+        self.summarize = dspy.Predict(SummarizeHistorySignature)
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _prefix_hashes(turns: List[List[str]]) -> List[str]:
+        """The hash of every prefix of the turns, hashes[i] covering turns[:i + 1]."""
+        digest = hashlib.sha256()
+        hashes = []
+        for turn in turns:
+            for line in turn:
+                digest.update(line.encode())
+                digest.update(b"\0")
+            hashes.append(digest.copy().hexdigest())
+        return hashes
+
+    def _cached_summary(self, hashes: List[str]) -> Tuple[int, str]:
+        """The longest prefix of the folded turns with a summary: (turns covered, summary)."""
+        for i in range(len(hashes) - 1, -1, -1):
+            summary = self._summaries.get(hashes[i])
+            if summary is not None:
+                self._summaries.move_to_end(hashes[i])
+                return i + 1, summary
+        return 0, ""
+
+    def _summarize(self, previous_summary: str, turns: List[List[str]]) -> str:
+        new_turns = "\n".join(line for turn in turns for line in turn)
+        prediction = self.summarize(previous_summary=previous_summary, new_turns=new_turns,
+                                    max_words=str(int(self.summary_tokens * 0.75)))
+        return (prediction.summary or "").strip()
+
+    async def _extend(self, key: str, previous_summary: str, turns: List[List[str]]):
+        try:
+            summary = await asyncio.to_thread(self._summarize, previous_summary, turns)
+            if summary:
+                self._summaries[key] = summary
+                while len(self._summaries) > self.cache_size:
+                    self._summaries.popitem(last=False)
+        except Exception as e:
+            logger.error(f"Error summarizing chat history: {e}")
+        finally:
+            self._pending.pop(key, None)
+
+    def _schedule(self, key: str, previous_summary: str, turns: List[List[str]]):
+        if key in self._pending or not dspy.settings.lm:
+            return
+        self._pending[key] = asyncio.create_task(self._extend(key, previous_summary, turns))
+
+    async def compact(self, messages: List[dict]) -> Tuple[List[str], dict]:
+        """
+        Compacts a chat history for the prompt.
+
+        Args:
+            messages: The history as {'role', 'content'} dicts, oldest first.
+
+        Returns:
+            Tuple[List[str], dict]: The history lines ("User: ...", "Assistant: ...",
+            a leading "Summary of earlier conversation: ..." once turns are folded)
+            and stats on the compaction (tokens, turns kept, folded, summarized).
+        """
+        turns = split_turns(messages)
+        lines = [[_format(m) for m in turn] for turn in turns]
+        tokens = [sum(count_tokens(line) for line in turn) for turn in lines]
+
+        # Keep the newest turns that fit, always at least the latest one
+        keep = min(self.keep_turns, len(turns))
+        while keep > 1 and sum(tokens[-keep:]) > self.max_tokens - self.summary_tokens:
+            keep -= 1
+        folded = len(turns) - keep
+        kept_lines = [line for turn in lines[folded:] for line in turn]
+        info = {'messages': len(messages), 'turns': len(turns), 'verbatim_turns': keep, 'folded_turns': folded,
+                'summarized_turns': 0, 'dropped_tool_messages': 0, 'input_tokens': sum(tokens)}
+        if not folded:
+            info['tokens'] = sum(tokens)
+            return kept_lines, info
+
+        # Tool output in folded turns is bulky and stale, the replies to it say what mattered
+        folded_lines = []
+        for turn in turns[:folded]:
+            conversation = [m for m in turn if not _is_tool_message(m)]
+            info['dropped_tool_messages'] += len(turn) - len(conversation)
+            folded_lines.append([_format(m) for m in conversation])
+        hashes = self._prefix_hashes(folded_lines)
+        covered, summary = self._cached_summary(hashes)
+        if covered < folded:
+            self._schedule(hashes[folded - 1], summary, folded_lines[covered:])
+        info['summarized_turns'] = covered
+
+        # Turns the summary doesn't cover yet, newest first while they fit
+        budget = self.max_tokens - sum(tokens[folded:]) - count_tokens(summary)
+        uncovered = []
+        for turn in reversed(folded_lines[covered:]):
+            turn_tokens = sum(count_tokens(line) for line in turn)
+            if turn_tokens > budget:
+                break
+            uncovered[:0] = turn
+            budget -= turn_tokens
+
+        history = ([f"Summary of earlier conversation: {summary}"] if summary else []) + uncovered + kept_lines
+        info['tokens'] = self.max_tokens - budget
+        return history, info
@@ -0,0 +1,483 @@
+"""
+Satellite imagery from local GeoTIFF/COG files, e.g. Maxar deliveries.
+
+Scenes in IMAGERY_DIR are indexed by their footprint (the bounds in WGS84)
+in a grid of IMAGERY_INDEX_CELL_DEGREES cells, so a tile or bbox only looks
+at the scenes of the cells it touches. Only headers are read to index a
+scene.
+
+Map tiles and vessel chips never read more of a scene than they show: the
+window under the tile or chip is read from the overview level closest to
+the output resolution (build overviews with gdaladdo or write COGs), so a
+zoomed out tile of a multi-gigabyte scene reads a few blocks of a small
+overview. Uncompressed scenes are memory-mapped by GDAL instead of read
+through its block cache. Open datasets are kept per thread.
+
+Overlapping scenes are mosaicked newest first. Scenes that aren't 8 bit
+are stretched to 8 bit between their 2nd and 98th percentile, measured on
+an overview when the scene is indexed.
+
+Needs rasterio (pip install rasterio); without it the index stays empty and
+the imagery endpoints answer 503.
+
+Settings are read from the environment:
+    IMAGERY_DIR: Directory searched recursively for .tif/.tiff scenes (default imagery).
+    IMAGERY_INDEX_CELL_DEGREES: Cell size of the footprint index (default 1).
+    IMAGERY_RESCAN_SECONDS: Seconds between checks for new or changed files (default 60).
+    IMAGERY_TILE_SIZE: Tile width and height in pixels (default 256).
+    IMAGERY_TILE_CACHE_MB: Memory budget of the rendered tile cache (default 128).
+    IMAGERY_TILE_CACHE_TTL: Seconds a rendered tile stays cached (default 3600).
+    IMAGERY_OPEN_FILES: Open datasets kept per thread (default 16).
+    IMAGERY_CHIP_SIZE_M: Ground size of a vessel chip in metres (default 250).
+    IMAGERY_CHIP_PIXELS: Chip width and height in pixels (default 128).
+    IMAGERY_CHIP_WINDOW_MINUTES: AIS reports this close to a scene's acquisition
+        time place a vessel on it (default 10).
+    IMAGERY_MAX_CHIPS: Vessels cropped per scene at most (default 100).
+"""
+import argparse
+import logging
+import math
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+from data import get_clickhouse_client
+from tiles import MAX_MERCATOR_LAT, tile_bounds
+
+try:
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.errors import NotGeoreferencedWarning
+    from rasterio.io import MemoryFile
+    from rasterio.warp import reproject, transform as transform_points, transform_bounds
+    from rasterio.windows import Window, from_bounds
+except ImportError:
+    rasterio = None
+
+logger = logging.getLogger(__name__)
+
+IMAGERY_DIR = os.getenv('IMAGERY_DIR', 'imagery')
+IMAGERY_INDEX_CELL_DEGREES = float(os.getenv('IMAGERY_INDEX_CELL_DEGREES', 1))
+IMAGERY_RESCAN_SECONDS = float(os.getenv('IMAGERY_RESCAN_SECONDS', 60))
+IMAGERY_TILE_SIZE = int(os.getenv('IMAGERY_TILE_SIZE', 256))
+# Tiles only change when the index does, so they are kept long
+IMAGERY_TILE_CACHE_MB = float(os.getenv('IMAGERY_TILE_CACHE_MB', 128))
+IMAGERY_TILE_CACHE_TTL = float(os.getenv('IMAGERY_TILE_CACHE_TTL', 3600))
+IMAGERY_OPEN_FILES = int(os.getenv('IMAGERY_OPEN_FILES', 16))
+IMAGERY_CHIP_SIZE_M = float(os.getenv('IMAGERY_CHIP_SIZE_M', 250))
+IMAGERY_CHIP_PIXELS = int(os.getenv('IMAGERY_CHIP_PIXELS', 128))
+IMAGERY_CHIP_WINDOW_MINUTES = float(os.getenv('IMAGERY_CHIP_WINDOW_MINUTES', 10))
+IMAGERY_MAX_CHIPS = int(os.getenv('IMAGERY_MAX_CHIPS', 100))
+
+# Memory-map uncompressed GeoTIFFs, and don't list the directory of every opened file
+GDAL_OPTIONS = {'GTIFF_VIRTUAL_MEM_IO': 'IF_ENOUGH_RAM', 'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR'}
+SCENE_EXTENSIONS = ('.tif', '.tiff')
+EARTH_RADIUS_M = 6_378_137.0 # Web Mercator sphere
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+# Vessel columns returned with every chip
+CHIP_VESSEL_COLUMNS = ['VesselName', 'VesselType', 'Length', 'Width', 'SOG', 'COG']
+
+BBox = Tuple[float, float, float, float]
+
+class Scene:
+    """What the index knows about one image file, from its header."""
+
+    __slots__ = ('id', 'path', 'mtime', 'size', 'bounds', 'crs', 'width', 'height', 'count',
+                 'dtype', 'resolution_m', 'overviews', 'acquired', 'stretch')
+
+    def to_dict(self) -> dict:
+        min_lat, max_lat, min_lon, max_lon = self.bounds
+        return {
+            'id': self.id,
+            'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon,
+            'acquired': self.acquired.isoformat() if self.acquired else None,
+            'width': self.width, 'height': self.height, 'bands': self.count, 'dtype': self.dtype,
+            'resolution_m': round(self.resolution_m, 3),
+            'overviews': self.overviews,
+            'size_bytes': self.size,
+        }
+
+def _parse_acquired(tags: dict) -> Optional[datetime]:
+    """Acquisition time from the TIFF DateTime tag ('YYYY:MM:DD HH:MM:SS', UTC), if present."""
+    value = tags.get('TIFFTAG_DATETIME') or tags.get('ACQUISITION_TIME')
+    if not value:
+        return None
+    for fmt in ('%Y:%m:%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        try:
+            parsed = datetime.strptime(value.strip().replace('Z', '+0000'), fmt)
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    logger.warning(f"Unrecognized acquisition time '{value}'")
+    return None
+
+def _resolution_m(dataset) -> float:
+    """Ground size of a pixel in metres, at the centre of the scene for geographic CRSs."""
+    if dataset.crs.is_geographic:
+        center_lat = (dataset.bounds.bottom + dataset.bounds.top) / 2
+        return abs(dataset.res[0]) * METERS_PER_DEGREE * math.cos(math.radians(center_lat))
+    return abs(dataset.res[0]) * dataset.crs.linear_units_factor[1]
+
+def read_scene(path: str, scene_id: str) -> Scene:
+    """Indexes one file. Reads the header, plus a small overview for scenes that need a stretch."""
+    stat = os.stat(path)
+    with rasterio.Env(**GDAL_OPTIONS), rasterio.open(path) as dataset:
+        if dataset.crs is None:
+            raise ValueError("Scene has no CRS")
+        scene = Scene()
+        scene.id = scene_id
+        scene.path = path
+        scene.mtime = stat.st_mtime
+        scene.size = stat.st_size
+        left, bottom, right, top = transform_bounds(dataset.crs, 'EPSG:4326', *dataset.bounds, densify_pts=21)
+        scene.bounds = (bottom, top, left, right)
+        scene.crs = dataset.crs
+        scene.width, scene.height, scene.count = dataset.width, dataset.height, dataset.count
+        scene.dtype = dataset.dtypes[0]
+        scene.resolution_m = _resolution_m(dataset)
+        scene.overviews = dataset.overviews(1)
+        scene.acquired = _parse_acquired(dataset.tags())
+        scene.stretch = None
+        if scene.dtype != 'uint8':
+            bands = _bands(scene)
+            # At most 1024 pixels a side, which GDAL reads from the closest overview
+            factor = max(1, math.ceil(max(dataset.width, dataset.height) / 1024))
+            shape = (len(bands), max(1, dataset.height // factor), max(1, dataset.width // factor))
+            sample = dataset.read(bands, out_shape=shape, masked=True, resampling=Resampling.nearest)
+            valid = sample.compressed()
+            if valid.size:
+                low, high = np.percentile(valid, [2, 98])
+                scene.stretch = (float(low), float(max(high, low + 1)))
+    return scene
+
+def _bands(scene: Scene) -> List[int]:
+    """RGB for scenes with three or more bands, otherwise the first band as grey."""
+    return [1, 2, 3] if scene.count >= 3 else [1]
+
+def _to_uint8(scene: Scene, data: np.ndarray) -> np.ndarray:
+    if scene.dtype == 'uint8':
+        return data.astype(np.uint8, copy=False)
+    low, high = scene.stretch or (0.0, 255.0)
+    return np.clip((data.astype(np.float32) - low) * (255.0 / (high - low)), 0, 255).astype(np.uint8)
+
+class ImageryIndex:
+    """
+    Footprint index of the scenes under a directory, refreshed when files are
+    added, changed or removed. version changes with every refresh that found
+    a change, which is what invalidates cached tiles.
+    """
+
+    def __init__(self, directory: Optional[str] = None, cell_degrees: Optional[float] = None,
+                 rescan_interval: Optional[float] = None):
+        self.directory = directory or IMAGERY_DIR
+        self.cell_degrees = cell_degrees or IMAGERY_INDEX_CELL_DEGREES
+        self.rescan_interval = IMAGERY_RESCAN_SECONDS if rescan_interval is None else rescan_interval
+        self.scenes: Dict[str, Scene] = {}
+        self.version = 0
+        self._cells: Dict[Tuple[int, int], List[str]] = {}
+        self._scanned_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _cell_range(self, bbox: BBox) -> Tuple[range, range]:
+        min_lat, max_lat, min_lon, max_lon = bbox
+        rows = range(math.floor(min_lat / self.cell_degrees), math.floor(max_lat / self.cell_degrees) + 1)
+        cols = range(math.floor(min_lon / self.cell_degrees), math.floor(max_lon / self.cell_degrees) + 1)
+        return rows, cols
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Rescans the directory if rescan_interval has passed (or force), reading
+        the headers of new and changed files only.
+
+        Returns:
+            int: The index version.
+        """
+        if rasterio is None:
+            return self.version
+        with self._lock:
+            if not force and self._scanned_at is not None and time.monotonic() - self._scanned_at < self.rescan_interval:
+                return self.version
+            self._scanned_at = time.monotonic()
+            found = {}
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.lower().endswith(SCENE_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        found[os.path.relpath(path, self.directory)] = path
+            scenes, changed = {}, set(self.scenes) - set(found)
+            for scene_id, path in sorted(found.items()):
+                known = self.scenes.get(scene_id)
+                try:
+                    if known is not None and os.stat(path).st_mtime == known.mtime:
+                        scenes[scene_id] = known
+                        continue
+                    scenes[scene_id] = read_scene(path, scene_id)
+                    changed.add(scene_id)
+                except Exception as e:
+                    # Files still being copied in fail here and are retried on the next scan
+                    logger.warning(f"Skipping scene {path}: {e}")
+                    if known is not None:
+                        changed.add(scene_id)
+            if not changed:
+                return self.version
+            cells: Dict[Tuple[int, int], List[str]] = {}
+            for scene_id, scene in scenes.items():
+                rows, cols = self._cell_range(scene.bounds)
+                for row in rows:
+                    for col in cols:
+                        cells.setdefault((row, col), []).append(scene_id)
+            self.scenes, self._cells = scenes, cells
+            self.version += 1
+            logger.info(f"Imagery index version {self.version}: {len(scenes)} scenes, {len(changed)} changed")
+            return self.version
+
+    def search(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> List[Scene]:
+        """Scenes whose footprint overlaps the bbox, newest acquisition first."""
+        bbox = (min_lat, max_lat, min_lon, max_lon)
+        rows, cols = self._cell_range(bbox)
+        scenes, cells = self.scenes, self._cells
+        if len(rows) * len(cols) > len(scenes):
+            # Cheaper to look at every scene than at every cell of a large bbox
+            candidates = scenes.keys()
+        else:
+            candidates = {scene_id for row in rows for col in cols for scene_id in cells.get((row, col), ())}
+        hits = []
+        for scene_id in candidates:
+            s_min_lat, s_max_lat, s_min_lon, s_max_lon = scenes[scene_id].bounds
+            if s_min_lat <= max_lat and s_max_lat >= min_lat and s_min_lon <= max_lon and s_max_lon >= min_lon:
+                hits.append(scenes[scene_id])
+        oldest = datetime.min.replace(tzinfo=timezone.utc)
+        return sorted(hits, key=lambda s: (s.acquired or oldest, s.id), reverse=True)
+
+_local = threading.local()
+
+def _open(scene: Scene, overview: Optional[int]):
+    """An open dataset of a scene or one of its overview levels, cached per thread."""
+    handles = getattr(_local, 'handles', None)
+    if handles is None:
+        handles = _local.handles = OrderedDict()
+    key = (scene.path, scene.mtime, overview)
+    dataset = handles.get(key)
+    if dataset is not None:
+        handles.move_to_end(key)
+        return dataset
+    dataset = rasterio.open(scene.path, overview_level=overview) if overview is not None else rasterio.open(scene.path)
+    handles[key] = dataset
+    while len(handles) > IMAGERY_OPEN_FILES:
+        _, oldest = handles.popitem(last=False)
+        oldest.close()
+    return dataset
+
+def _overview_for(scene: Scene, resolution_m: float) -> Optional[int]:
+    """The coarsest overview level still at least as sharp as resolution_m, None for full resolution."""
+    level = None
+    for i, factor in enumerate(scene.overviews):
+        if scene.resolution_m * factor <= resolution_m:
+            level = i
+    return level
+
+def _encode_png(rgb: np.ndarray, alpha: np.ndarray) -> bytes:
+    bands = np.concatenate([np.broadcast_to(rgb, (3,) + alpha.shape), alpha[None]])
+    # PNGs carry no georeference, which rasterio would warn about
+    with warnings.catch_warnings(), MemoryFile() as memfile:
+        warnings.simplefilter('ignore', NotGeoreferencedWarning)
+        with memfile.open(driver='PNG', width=alpha.shape[1], height=alpha.shape[0], count=4, dtype='uint8') as png:
+            png.write(bands)
+        return memfile.read()
+
+def _mercator_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(left, bottom, right, top) of a tile in EPSG:3857 metres."""
+    extent = math.pi * EARTH_RADIUS_M
+    size = 2 * extent / 2 ** z
+    return -extent + x * size, extent - (y + 1) * size, -extent + (x + 1) * size, extent - y * size
+
+def _paint(scene: Scene, rgb: np.ndarray, alpha: np.ndarray, dst_bounds: Tuple[float, float, float, float],
+           resolution_m: float):
+    """Draws the part of a scene under a tile into the tile's still empty pixels."""
+    size = alpha.shape[0]
+    dataset = _open(scene, _overview_for(scene, resolution_m))
+    left, bottom, right, top = transform_bounds('EPSG:3857', dataset.crs, *dst_bounds, densify_pts=21)
+    window = from_bounds(left, bottom, right, top, dataset.transform)
+    # Whole pixels plus one around for the resampling kernel, clipped to the scene
+    col0, row0 = max(math.floor(window.col_off) - 1, 0), max(math.floor(window.row_off) - 1, 0)
+    col1 = min(math.ceil(window.col_off + window.width) + 1, dataset.width)
+    row1 = min(math.ceil(window.row_off + window.height) + 1, dataset.height)
+    if col1 <= col0 or row1 <= row0:
+        return
+    window = Window(col0, row0, col1 - col0, row1 - row0)
+    bands = _bands(scene)
+    data = dataset.read(bands, window=window)
+    mask = dataset.read_masks(1, window=window)
+    src_transform = dataset.window_transform(window)
+    dst_transform = rasterio.transform.from_bounds(*dst_bounds, size, size)
+    warped = np.zeros((len(bands), size, size), dtype=data.dtype)
+    warped_mask = np.zeros((size, size), dtype=np.uint8)
+    common = dict(src_transform=src_transform, src_crs=dataset.crs, dst_transform=dst_transform, dst_crs='EPSG:3857')
+    reproject(data, warped, resampling=Resampling.bilinear, **common)
+    reproject(mask, warped_mask, resampling=Resampling.nearest, **common)
+    fill = (warped_mask > 0) & (alpha == 0)
+    if fill.any():
+        rgb[:, fill] = _to_uint8(scene, warped[:, fill])
+        alpha[fill] = 255
+
+def render_tile(index: ImageryIndex, z: int, x: int, y: int, tile_size: int = IMAGERY_TILE_SIZE) -> Optional[bytes]:
+    """
+    Renders a Web Mercator (XYZ) tile as an RGBA PNG from the scenes under it,
+    newest on top. Returns None where no scene has data.
+
+    Raises:
+        ValueError: If the tile does not exist at zoom z.
+    """
+    min_lat, max_lat, min_lon, max_lon = tile_bounds(z, x, y)
+    scenes = index.search(min_lat, max_lat, min_lon, max_lon)
+    if not scenes:
+        return None
+    dst_bounds = _mercator_bounds(z, x, y)
+    # Mercator metres per pixel shrink to ground metres towards the poles
+    center_lat = min(max((min_lat + max_lat) / 2, -MAX_MERCATOR_LAT), MAX_MERCATOR_LAT)
+    resolution_m = (dst_bounds[2] - dst_bounds[0]) / tile_size * math.cos(math.radians(center_lat))
+    rgb = np.zeros((3, tile_size, tile_size), dtype=np.uint8)
+    alpha = np.zeros((tile_size, tile_size), dtype=np.uint8)
+    with rasterio.Env(**GDAL_OPTIONS):
+        for scene in scenes:
+            try:
+                _paint(scene, rgb, alpha, dst_bounds, resolution_m)
+            except Exception as e:
+                logger.error(f"Error reading scene {scene.id} for tile {z}/{x}/{y}: {e}")
+            if alpha.all():
+                break
+    if not alpha.any():
+        return None
+    return _encode_png(rgb, alpha)
+
+def render_chip(scene: Scene, lat: float, lon: float, size_m: float = IMAGERY_CHIP_SIZE_M,
+                pixels: int = IMAGERY_CHIP_PIXELS) -> Optional[bytes]:
+    """
+    Crops a pixels x pixels RGBA PNG of size_m metres around a point from a
+    scene, in the scene's own orientation. Returns None if the scene has no
+    data there.
+    """
+    dataset = _open(scene, _overview_for(scene, size_m / pixels))
+    (x,), (y,) = transform_points('EPSG:4326', dataset.crs, [lon], [lat])
+    if dataset.crs.is_geographic:
+        half_y = size_m / 2 / METERS_PER_DEGREE
+        half_x = half_y / max(math.cos(math.radians(lat)), 1e-6)
+    else:
+        half_x = half_y = size_m / 2 / dataset.crs.linear_units_factor[1]
+    window = from_bounds(x - half_x, y - half_y, x + half_x, y + half_y, dataset.transform)
+    bands = _bands(scene)
+    # boundless reads pad chips at the scene edge instead of shifting them
+    data = dataset.read(bands, window=window, out_shape=(len(bands), pixels, pixels), boundless=True,
+                        fill_value=0, resampling=Resampling.bilinear)
+    mask = dataset.read_masks(1, window=window, out_shape=(pixels, pixels), boundless=True,
+                              resampling=Resampling.nearest)
+    if not mask.any():
+        return None
+    alpha = np.where(mask > 0, 255, 0).astype(np.uint8)
+    return _encode_png(_to_uint8(scene, data), alpha)
+
+def render_chips(scene: Scene, vessels: pa.Table, size_m: float = IMAGERY_CHIP_SIZE_M,
+                 pixels: int = IMAGERY_CHIP_PIXELS) -> List[Optional[bytes]]:
+    """render_chip for every row of a table with LAT/LON, sharing the scene's open dataset."""
+    lats, lons = vessels.column('LAT').to_pylist(), vessels.column('LON').to_pylist()
+    with rasterio.Env(**GDAL_OPTIONS):
+        return [render_chip(scene, lat, lon, size_m, pixels) for lat, lon in zip(lats, lons)]
+
+def build_vessels_at_query(min_lat: float, max_lat: float, min_lon: float, max_lon: float, at: datetime,
+                           table: str = 'ais_data', window_minutes: float = IMAGERY_CHIP_WINDOW_MINUTES,
+                           limit: int = IMAGERY_MAX_CHIPS) -> Tuple[str, dict]:
+    """
+    Builds the query for the vessels in a bbox around a moment, with their
+    last report before it and first report after it (within window_minutes)
+    so their position at that moment can be interpolated.
+
+    Returns:
+        Tuple[str, dict]: The query string and its parameters.
+    """
+    static = ", ".join(f"argMax({col}, BaseDateTime) AS {col}" for col in CHIP_VESSEL_COLUMNS)
+    query = f"""
+    SELECT
+        MMSI,
+        countIf(BaseDateTime <= %(at)s) AS before_count,
+        maxIf(BaseDateTime, BaseDateTime <= %(at)s) AS before_time,
+        argMaxIf(LAT, BaseDateTime, BaseDateTime <= %(at)s) AS before_lat,
+        argMaxIf(LON, BaseDateTime, BaseDateTime <= %(at)s) AS before_lon,
+        countIf(BaseDateTime > %(at)s) AS after_count,
+        minIf(BaseDateTime, BaseDateTime > %(at)s) AS after_time,
+        argMinIf(LAT, BaseDateTime, BaseDateTime > %(at)s) AS after_lat,
+        argMinIf(LON, BaseDateTime, BaseDateTime > %(at)s) AS after_lon,
+        {static}
+    FROM {table}
+    WHERE LAT >= %(min_lat)s AND LAT <= %(max_lat)s
+      AND LON >= %(min_lon)s AND LON <= %(max_lon)s
+      AND BaseDateTime >= %(start_time)s AND BaseDateTime <= %(end_time)s
+    GROUP BY MMSI
+    {f"LIMIT {int(limit)}" if limit > 0 else ""}
+    """
+    window = timedelta(minutes=window_minutes)
+    params = {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon,
+              'at': at, 'start_time': at - window, 'end_time': at + window}
+    return query, params
+
+def load_vessels_at(min_lat: float, max_lat: float, min_lon: float, max_lon: float, at: datetime,
+                    table: str = 'ais_data', client = None, window_minutes: float = IMAGERY_CHIP_WINDOW_MINUTES,
+                    limit: int = IMAGERY_MAX_CHIPS, settings: Optional[dict] = None) -> pa.Table:
+    """
+    Loads the vessels in a bbox with their position at a moment, linearly
+    interpolated between the reports around it (or the nearest report when
+    there is only one side).
+
+    Returns:
+        pa.Table: MMSI, LAT, LON, ReportOffsetSeconds (to the nearest report) and CHIP_VESSEL_COLUMNS.
+    """
+    query, params = build_vessels_at_query(min_lat, max_lat, min_lon, max_lon, at, table=table,
+                                           window_minutes=window_minutes, limit=limit)
+    if client is None:
+        client = get_clickhouse_client()
+    result = client.query_arrow(query, parameters=params, settings=settings, use_strings=True)
+    if result.num_rows == 0:
+        return result
+
+    def epoch_s(name: str) -> np.ndarray:
+        return result.column(name).cast(pa.timestamp('ms')).cast(pa.int64()).to_numpy().astype(np.float64) / 1000
+
+    at_s = at.timestamp()
+    has_before = result.column('before_count').to_numpy() > 0
+    has_after = result.column('after_count').to_numpy() > 0
+    t0, t1 = epoch_s('before_time'), epoch_s('after_time')
+    # Only one side known: weight all on it
+    fraction = np.where(has_before & has_after, (at_s - t0) / np.maximum(t1 - t0, 1e-3), np.where(has_before, 0.0, 1.0))
+    lat0, lat1 = result.column('before_lat').to_numpy(), result.column('after_lat').to_numpy()
+    lon0, lon1 = result.column('before_lon').to_numpy(), result.column('after_lon').to_numpy()
+    offset = np.minimum(np.where(has_before, at_s - t0, np.inf), np.where(has_after, t1 - at_s, np.inf))
+    return pa.table({
+        'MMSI': result.column('MMSI'),
+        'LAT': lat0 + fraction * (lat1 - lat0),
+        'LON': lon0 + fraction * (lon1 - lon0),
+        'ReportOffsetSeconds': np.round(offset, 1),
+        **{col: result.column(col) for col in CHIP_VESSEL_COLUMNS},
+    })
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=IMAGERY_DIR, help="Directory of scenes to index")
+    args = parser.parse_args()
+    if rasterio is None:
+        parser.error("Imagery needs rasterio: pip install rasterio")
+    index = ImageryIndex(args.dir)
+    start = time.perf_counter()
+    index.refresh(force=True)
+    print(f"Indexed {len(index.scenes)} scenes in {time.perf_counter() - start:.2f}s")
+    for scene in sorted(index.scenes.values(), key=lambda s: s.id):
+        info = scene.to_dict()
+        print(f"  {info['id']}: {info['width']}x{info['height']}x{info['bands']} {info['dtype']}, "
+              f"{info['resolution_m']}m, overviews {info['overviews']}, acquired {info['acquired']}, "
+              f"LAT({info['min_lat']:.4f}, {info['max_lat']:.4f}) LON({info['min_lon']:.4f}, {info['max_lon']:.4f})")
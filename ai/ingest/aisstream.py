@@ -0,0 +1,388 @@
+"""
+Live AIS ingestion from the aisstream.io websocket into ClickHouse.
+
+Subscribes to position and static data reports for the configured bounding
+boxes, normalizes them to ais_data rows and hands them to a bounded queue.
+A flusher drains the queue into Arrow batches and inserts them through the
+same insert_arrow path as the file ingest, whenever a batch is full or the
+flush interval has passed. Up to --insert-threads batches are inserted at once
+on the inserter's thread pool. If ClickHouse falls behind the queue fills up
+and new messages are dropped rather than growing memory (dropped_queue_full);
+batches that still fail after three insert attempts are counted separately
+(dropped_insert_failed).
+
+Static reports (name, IMO, call sign, type, dimensions) carry no position,
+so they are cached per MMSI and merged into that vessel's later position rows.
+
+Usage (from the ai/ directory):
+    AISSTREAM_API_KEY=... python ingest/aisstream.py --bbox 32,-126,42,-117
+    # Against the local replay server, without ClickHouse:
+    python ingest/fake_aisstream.py --rate 20000 &
+    python ingest/aisstream.py --url ws://localhost:8765 --dry-run
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import websockets
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ingest_ais import AIS_ARROW_SCHEMA, Inserter, normalize_chunk
+
+load_dotenv()
+
+AISSTREAM_URL = 'wss://stream.aisstream.io/v0/stream'
+MESSAGE_TYPES = ['PositionReport', 'StandardClassBPositionReport', 'ShipStaticData']
+# Same area as the map's default view: [[min_lat, min_lon], [max_lat, max_lon]]
+DEFAULT_BBOXES = [[[34.9337, -126.6365], [41.1082, -118.2023]]]
+
+def parse_time(value: Optional[str]) -> datetime:
+    """Parses aisstream's '2024-01-01 12:00:00.123456789 +0000 UTC' timestamps (naive UTC)."""
+    if not value:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    stamp = value.split(' +')[0]
+    if '.' in stamp:
+        # Python only takes up to microseconds
+        seconds, fraction = stamp.split('.', 1)
+        stamp = f"{seconds}.{fraction[:6]:0<6}"
+    return datetime.fromisoformat(stamp)
+
+class MessageNormalizer:
+    """Turns aisstream.io messages into ais_data rows (tuples in AIS_ARROW_SCHEMA order)."""
+
+    def __init__(self):
+        # MMSI -> (VesselName, IMO, CallSign, VesselType, Length, Width, Draft)
+        self.static: Dict[int, Tuple] = {}
+
+    def normalize(self, message: dict) -> Optional[Tuple]:
+        """Returns a row for position reports, None for static data and other types."""
+        message_type = message.get('MessageType')
+        body = message.get('Message', {}).get(message_type)
+        if body is None:
+            return None
+        meta = message.get('MetaData', {})
+        mmsi = int(body.get('UserID') or meta.get('MMSI'))
+
+        if message_type == 'ShipStaticData':
+            dimension = body.get('Dimension') or {}
+            imo = body.get('ImoNumber')
+            self.static[mmsi] = (
+                (body.get('Name') or '').strip(),
+                f"IMO{imo}" if imo else '',
+                (body.get('CallSign') or '').strip(),
+                body.get('Type'),
+                float(dimension.get('A', 0) + dimension.get('B', 0)) or None,
+                float(dimension.get('C', 0) + dimension.get('D', 0)) or None,
+                body.get('MaximumStaticDraught'),
+            )
+            return None
+
+        name, imo, call_sign, vessel_type, length, width, draft = self.static.get(
+            mmsi, ((meta.get('ShipName') or '').strip(), '', '', None, None, None, None)
+        )
+        return (
+            mmsi,
+            parse_time(meta.get('time_utc')),
+            body.get('Latitude'),
+            body.get('Longitude'),
+            body.get('Sog'),
+            body.get('Cog'),
+            body.get('TrueHeading'),
+            name,
+            imo,
+            call_sign,
+            vessel_type,
+            body.get('NavigationalStatus'),
+            length,
+            width,
+            draft,
+            None,
+            'A' if message_type == 'PositionReport' else 'B',
+        )
+
+def rows_to_table(rows: List[Tuple]) -> pa.Table:
+    """Builds an ais_data shaped Arrow table from normalized rows."""
+    columns = list(zip(*rows))
+    arrays = [pa.array(column, type=field.type) for column, field in zip(columns, AIS_ARROW_SCHEMA)]
+    return normalize_chunk(pa.Table.from_arrays(arrays, schema=AIS_ARROW_SCHEMA))
+
+def rows_to_table_skipping_bad(rows: List[Tuple]) -> Tuple[Optional[pa.Table], int]:
+    """
+    Like rows_to_table, but leaves out rows with values that don't fit the
+    schema (out of range or mistyped). On failure the rows are bisected, so
+    finding a few bad rows costs a few conversions per bad row.
+
+    Returns:
+        Tuple: (table of the good rows or None if there are none, number of bad rows).
+    """
+    try:
+        return rows_to_table(rows), 0
+    except (pa.ArrowException, OverflowError, TypeError, ValueError):
+        if len(rows) == 1:
+            return None, 1
+    middle = len(rows) // 2
+    first, first_bad = rows_to_table_skipping_bad(rows[:middle])
+    second, second_bad = rows_to_table_skipping_bad(rows[middle:])
+    tables = [table for table in (first, second) if table is not None]
+    return (pa.concat_tables(tables) if tables else None), first_bad + second_bad
+
+class AISStreamIngestor:
+    """
+    Websocket reader and batching ClickHouse writer.
+
+    Args:
+        url: Websocket URL, aisstream.io or a local fake server.
+        api_key: aisstream.io API key.
+        bboxes: Bounding boxes as [[[min_lat, min_lon], [max_lat, max_lon]], ...].
+        inserter: Inserter for the target table, or None to only count rows (dry run).
+        queue_size: Maximum rows buffered between reader and flusher.
+        batch_size: Flush once this many rows are buffered.
+        flush_interval: Flush at least this often (seconds) when rows are pending.
+        max_backoff: Upper bound for the reconnect delay (seconds).
+        record_path: Optional file to append the raw messages to, for replay.
+        insert_concurrency: Batches inserted at once, at most the inserter's thread count.
+    """
+
+    def __init__(self, url: str, api_key: str, bboxes: list, inserter: Optional[Inserter] = None,
+                 queue_size: int = 200_000, batch_size: int = 50_000, flush_interval: float = 2.0,
+                 max_backoff: float = 60.0, record_path: Optional[str] = None,
+                 insert_concurrency: int = 1):
+        self.url = url
+        self.api_key = api_key
+        self.bboxes = bboxes
+        self.inserter = inserter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.record_path = record_path
+        self.insert_concurrency = max(1, insert_concurrency)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.normalizer = MessageNormalizer()
+        self.stopping = asyncio.Event()
+        self.metrics = {
+            'received': 0,
+            'rows_queued': 0,
+            'rows_inserted': 0,
+            'dropped_queue_full': 0,
+            'dropped_insert_failed': 0,
+            'parse_errors': 0,
+            'insert_errors': 0,
+            'reconnects': 0,
+            'batches': 0,
+            'lag_seconds': 0.0,
+            'max_lag_seconds': 0.0,
+        }
+
+    def stats(self) -> dict:
+        """Current counters plus queue depth. lag_seconds is receive time minus report time."""
+        return {**self.metrics, 'queue_depth': self.queue.qsize()}
+
+    # --- Reader ---
+
+    def handle_message(self, raw) -> None:
+        self.metrics['received'] += 1
+        try:
+            row = self.normalizer.normalize(json.loads(raw))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.metrics['parse_errors'] += 1
+            return
+        if row is None:
+            return
+        lag = (datetime.now(timezone.utc).replace(tzinfo=None) - row[1]).total_seconds()
+        self.metrics['lag_seconds'] = lag
+        self.metrics['max_lag_seconds'] = max(self.metrics['max_lag_seconds'], lag)
+        try:
+            self.queue.put_nowait(row)
+            self.metrics['rows_queued'] += 1
+        except asyncio.QueueFull:
+            self.metrics['dropped_queue_full'] += 1
+
+    async def read_forever(self):
+        backoff = 1.0
+        record = open(self.record_path, 'a') if self.record_path else None
+        try:
+            while not self.stopping.is_set():
+                try:
+                    async with websockets.connect(self.url, max_size=2 ** 22, ping_interval=20) as ws:
+                        await ws.send(json.dumps({
+                            'APIKey': self.api_key,
+                            'BoundingBoxes': self.bboxes,
+                            'FilterMessageTypes': MESSAGE_TYPES,
+                        }))
+                        print(f"Subscribed to {self.url} for {len(self.bboxes)} bounding boxes.")
+                        backoff = 1.0
+                        async for raw in ws:
+                            if record:
+                                record.write(raw if isinstance(raw, str) else raw.decode())
+                                record.write('\n')
+                            self.handle_message(raw)
+                            if self.stopping.is_set():
+                                return
+                except (OSError, websockets.exceptions.WebSocketException) as e:
+                    print(f"Websocket error: {e}")
+                if self.stopping.is_set():
+                    return
+                self.metrics['reconnects'] += 1
+                delay = backoff * (0.5 + random.random())
+                print(f"Reconnecting in {delay:.1f}s...")
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, self.max_backoff)
+        finally:
+            if record:
+                record.close()
+
+    # --- Flusher ---
+
+    async def flush(self, rows: List[Tuple]):
+        # A bad value must not take the flusher down with it, its row is dropped
+        # and counted as a parse error
+        table, bad = rows_to_table_skipping_bad(rows)
+        if bad:
+            self.metrics['parse_errors'] += bad
+            print(f"Dropped {bad} of {len(rows)} rows with values that don't fit the schema.")
+        if table is None:
+            return
+        for attempt in range(3):
+            try:
+                if self.inserter is not None:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self.inserter.executor, self.inserter.insert_table, table)
+                self.metrics['rows_inserted'] += table.num_rows
+                self.metrics['batches'] += 1
+                return
+            except Exception as e:
+                self.metrics['insert_errors'] += 1
+                print(f"Insert of {table.num_rows} rows failed (attempt {attempt + 1}/3): {e}")
+                await asyncio.sleep(2 ** attempt)
+        self.metrics['dropped_insert_failed'] += table.num_rows
+
+    async def flush_forever(self):
+        # Each batch is inserted in its own task, the semaphore keeps at most
+        # insert_concurrency in flight so a slow ClickHouse still backs up the queue
+        slots = asyncio.Semaphore(self.insert_concurrency)
+        pending = set()
+
+        async def flush_in_slot(rows):
+            try:
+                await self.flush(rows)
+            finally:
+                slots.release()
+
+        while not (self.stopping.is_set() and self.queue.empty()):
+            rows = []
+            try:
+                rows.append(await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval))
+            except asyncio.TimeoutError:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                # Drain what is already buffered without yielding per row
+                while len(rows) < self.batch_size and not self.queue.empty():
+                    rows.append(self.queue.get_nowait())
+                remaining = deadline - time.monotonic()
+                if len(rows) >= self.batch_size or remaining <= 0 or self.stopping.is_set():
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            await slots.acquire()
+            task = asyncio.create_task(flush_in_slot(rows))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def report_forever(self, interval: float):
+        last = dict(self.metrics)
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            stats = self.stats()
+            print(f"msgs {(stats['received'] - last['received']) / interval:,.0f}/s | "
+                  f"inserted {(stats['rows_inserted'] - last['rows_inserted']) / interval:,.0f} rows/s | "
+                  f"queue {stats['queue_depth']:,} | dropped full={stats['dropped_queue_full']:,} "
+                  f"failed={stats['dropped_insert_failed']:,} | "
+                  f"lag {stats['lag_seconds']:.1f}s (max {stats['max_lag_seconds']:.1f}s) | "
+                  f"errors parse={stats['parse_errors']} insert={stats['insert_errors']} | reconnects {stats['reconnects']}")
+            last = dict(stats)
+
+    async def run(self, report_interval: float = 10.0, duration: Optional[float] = None):
+        """Runs until cancelled, or for duration seconds, then flushes what is left."""
+        tasks = [
+            asyncio.create_task(self.read_forever()),
+            asyncio.create_task(self.flush_forever()),
+            asyncio.create_task(self.report_forever(report_interval)),
+        ]
+        try:
+            if duration:
+                await asyncio.sleep(duration)
+            else:
+                await asyncio.gather(*tasks)
+        finally:
+            self.stopping.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def parse_bbox(value: str) -> list:
+    min_lat, min_lon, max_lat, max_lon = (float(v) for v in value.split(','))
+    return [[min_lat, min_lon], [max_lat, max_lon]]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=os.getenv('AISSTREAM_URL', AISSTREAM_URL))
+    parser.add_argument('--bbox', action='append', type=parse_bbox, help="min_lat,min_lon,max_lat,max_lon (repeatable)")
+    parser.add_argument('--table', default='ais_data')
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    parser.add_argument('--flush-interval', type=float, default=2.0)
+    parser.add_argument('--queue-size', type=int, default=200_000)
+    parser.add_argument('--insert-threads', type=int, default=2)
+    parser.add_argument('--report-interval', type=float, default=10.0)
+    parser.add_argument('--duration', type=float, default=None, help="Stop after this many seconds")
+    parser.add_argument('--record', default=None, help="Append raw messages to this file for replay")
+    parser.add_argument('--dry-run', action='store_true', help="Normalize and batch, but skip ClickHouse")
+    args = parser.parse_args()
+
+    inserter = None
+    if not args.dry_run:
+        from data import get_clickhouse_client
+        from migrate import SchemaOutdatedError, ensure_schema
+        try:
+            ensure_schema(get_clickhouse_client(), args.table)
+        except SchemaOutdatedError as e:
+            sys.exit(str(e))
+        inserter = Inserter(args.table, args.insert_threads)
+
+    ingestor = AISStreamIngestor(
+        url=args.url,
+        api_key=os.getenv('AISSTREAM_API_KEY', ''),
+        bboxes=args.bbox or DEFAULT_BBOXES,
+        inserter=inserter,
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        record_path=args.record,
+        insert_concurrency=args.insert_threads,
+    )
+    try:
+        asyncio.run(ingestor.run(report_interval=args.report_interval, duration=args.duration))
+    except KeyboardInterrupt:
+        pass
+    print(f"Final stats: {ingestor.stats()}")
+
+if __name__ == '__main__':
+    main()
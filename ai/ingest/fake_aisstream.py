@@ -0,0 +1,114 @@
+"""
+Local stand-in for the aisstream.io websocket, for testing ingest/aisstream.py.
+
+Waits for the subscription message and then replays messages at a fixed
+rate. Messages come from a file recorded with `aisstream.py --record`, one
+JSON message per line, looped as needed; without a file, synthetic position
+and static reports are generated. Timestamps are rewritten to the send time
+so the ingestor's lag metric stays meaningful.
+
+Usage (from the ai/ directory):
+    python ingest/fake_aisstream.py --rate 20000
+    python ingest/fake_aisstream.py --file recorded.jsonl --rate 10000 --port 8765
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List
+
+import websockets
+
+def synthetic_messages(vessels: int = 2000, seed: int = 0) -> List[dict]:
+    """One static report and a few position reports per vessel, in aisstream's message format."""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(vessels):
+        mmsi = 366_000_000 + i
+        lat, lon = rng.uniform(35, 41), rng.uniform(-126, -118.5)
+        messages.append({
+            'MessageType': 'ShipStaticData',
+            'MetaData': {'MMSI': mmsi, 'ShipName': f"VESSEL {i}"},
+            'Message': {'ShipStaticData': {
+                'UserID': mmsi, 'Name': f"VESSEL {i}", 'CallSign': f"WDC{i:04d}", 'ImoNumber': 9_000_000 + i,
+                'Type': rng.choice([30, 52, 60, 70, 80]), 'MaximumStaticDraught': round(rng.uniform(2, 14), 1),
+                'Dimension': {'A': rng.randint(10, 150), 'B': rng.randint(5, 50), 'C': rng.randint(2, 20), 'D': rng.randint(2, 20)},
+            }},
+        })
+        for _ in range(5):
+            lat += rng.uniform(-0.01, 0.01)
+            lon += rng.uniform(-0.01, 0.01)
+            message_type = 'PositionReport' if i % 4 else 'StandardClassBPositionReport'
+            messages.append({
+                'MessageType': message_type,
+                'MetaData': {'MMSI': mmsi, 'ShipName': f"VESSEL {i}", 'latitude': lat, 'longitude': lon},
+                'Message': {message_type: {
+                    'UserID': mmsi, 'Latitude': lat, 'Longitude': lon, 'Sog': round(rng.uniform(0, 20), 1),
+                    'Cog': round(rng.uniform(0, 360), 1), 'TrueHeading': rng.randint(0, 359), 'NavigationalStatus': 0,
+                }},
+            })
+    rng.shuffle(messages)
+    return messages
+
+def load_messages(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def replay(messages: List[dict], per_tick: int) -> Iterator[List[str]]:
+    """Loops over the messages forever in bursts of per_tick, stamped with the current time."""
+    source = itertools.cycle(messages)
+    while True:
+        stamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f +0000 UTC')
+        burst = []
+        for message in itertools.islice(source, per_tick):
+            message.setdefault('MetaData', {})['time_utc'] = stamp
+            burst.append(json.dumps(message))
+        yield burst
+
+async def serve(host: str, port: int, messages: List[dict], rate: float, total: int):
+    async def handler(websocket, *_):
+        subscription = json.loads(await asyncio.wait_for(websocket.recv(), timeout=3))
+        print(f"Client subscribed to {subscription.get('BoundingBoxes')}, sending {rate:,.0f} msg/s")
+        # Send in 10ms bursts so high rates don't need a sleep per message
+        tick = 0.01
+        per_tick = max(1, int(rate * tick))
+        source = replay(messages, per_tick)
+        sent = 0
+        start = time.perf_counter()
+        try:
+            while total <= 0 or sent < total:
+                for raw in next(source):
+                    await websocket.send(raw)
+                sent += per_tick
+                delay = start + sent / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        elapsed = time.perf_counter() - start
+        print(f"Sent {sent:,} messages in {elapsed:.1f}s ({sent / elapsed:,.0f} msg/s)")
+
+    async with websockets.serve(handler, host, port, max_size=2 ** 22):
+        print(f"Fake aisstream listening on ws://{host}:{port}")
+        await asyncio.Future()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--file', default=None, help="Recorded messages (JSON lines); synthetic if omitted")
+    parser.add_argument('--rate', type=float, default=10_000, help="Messages per second")
+    parser.add_argument('--total', type=int, default=0, help="Stop each connection after this many messages (0 = never)")
+    args = parser.parse_args()
+
+    messages = load_messages(args.file) if args.file else synthetic_messages()
+    try:
+        asyncio.run(serve(args.host, args.port, messages, args.rate, args.total))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
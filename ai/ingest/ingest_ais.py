@@ -0,0 +1,326 @@
+"""
+Parallel, resumable ingestion of MarineCadastre AIS CSV files into ClickHouse.
+
+Files are parsed with pyarrow's typed CSV reader across a process pool.
+Parsed chunks flow through a bounded queue to insert threads that write
+them with insert_arrow, so parsing and inserting overlap. A JSON manifest
+records finished files and chunks; rerunning the same command skips them.
+
+Connection settings come from the same environment variables as the API
+(CLICKHOUSE_URL, CLICKHOUSE_PORT, CLICKHOUSE_USER, CLICKHOUSE_PASSWORD,
+CLICKHOUSE_DATABASE).
+
+Usage (from the ai/ directory):
+    python ingest/ingest_ais.py '/data/ais/AIS_2024_*.csv' --workers 8
+    python ingest/ingest_ais.py /data/ais/ --manifest /data/ais/manifest.json
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import get_clickhouse_client
+from migrate import SchemaOutdatedError, ensure_schema
+
+# Arrow types matching the ais_data columns
+AIS_ARROW_SCHEMA = pa.schema([
+    ('MMSI', pa.uint32()),
+    ('BaseDateTime', pa.timestamp('ms')),
+    ('LAT', pa.float64()),
+    ('LON', pa.float64()),
+    ('SOG', pa.float32()),
+    ('COG', pa.float32()),
+    ('Heading', pa.uint16()),
+    ('VesselName', pa.string()),
+    ('IMO', pa.string()),
+    ('CallSign', pa.string()),
+    ('VesselType', pa.uint16()),
+    ('Status', pa.uint8()),
+    ('Length', pa.float32()),
+    ('Width', pa.float32()),
+    ('Draft', pa.float32()),
+    ('Cargo', pa.float32()),
+    ('TransceiverClass', pa.string()),
+])
+
+# Null fills that differ from the per-type default. Class B and base station
+# reports carry no navigational status, and 0 would read as "under way using
+# engine", so they get 15 ("not defined")
+NULL_FILLS = {'Status': 15}
+
+def normalize_chunk(table: pa.Table) -> pa.Table:
+    """
+    Conforms a parsed chunk to the non-nullable ais_data columns: strings get
+    '', integers 0 (Status 15, see NULL_FILLS), floats NaN, and BaseDateTime
+    is tagged as UTC.
+    """
+    columns = []
+    for field in AIS_ARROW_SCHEMA:
+        column = table.column(field.name)
+        if pa.types.is_string(field.type):
+            column = pc.fill_null(column, '')
+        elif pa.types.is_integer(field.type):
+            column = pc.fill_null(column, pa.scalar(NULL_FILLS.get(field.name, 0), field.type))
+        elif pa.types.is_floating(field.type):
+            column = pc.fill_null(column, pa.scalar(float('nan'), field.type))
+        elif pa.types.is_timestamp(field.type):
+            column = column.cast(pa.timestamp('ms', tz='UTC'))
+        columns.append(column)
+    return pa.table(columns, names=AIS_ARROW_SCHEMA.names)
+
+def expand_paths(patterns: Iterable[str]) -> List[str]:
+    """Resolves files, directories (their *.csv) and glob patterns to sorted, unique paths."""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(glob.glob(os.path.join(pattern, '*.csv')))
+        else:
+            paths.update(glob.glob(pattern))
+    return sorted(os.path.abspath(path) for path in paths)
+
+# --- Manifest ---
+
+class Manifest:
+    """
+    Checkpoint file tracking which files and chunks are already in ClickHouse.
+
+    A file's entry is reset if its size/mtime or the chunk size changed since
+    the last run, since chunk numbers would no longer line up.
+    """
+
+    def __init__(self, path: str, block_size: int):
+        self.path = path
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self.files: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f).get('files', {})
+
+    def entry(self, path: str) -> dict:
+        stat = os.stat(path)
+        fingerprint = {'size': stat.st_size, 'mtime': int(stat.st_mtime), 'block_size': self.block_size}
+        entry = self.files.get(path)
+        if entry is None or any(entry.get(k) != v for k, v in fingerprint.items()):
+            entry = self.files[path] = {**fingerprint, 'done': False, 'chunks': [], 'total_chunks': None}
+        return entry
+
+    def chunk_done(self, path: str, chunk: int):
+        with self._lock:
+            entry = self.files[path]
+            if chunk not in entry['chunks']:
+                entry['chunks'].append(chunk)
+            self._check_done(entry)
+            self._save()
+
+    def file_parsed(self, path: str, total_chunks: int):
+        with self._lock:
+            entry = self.files[path]
+            entry['total_chunks'] = total_chunks
+            self._check_done(entry)
+            self._save()
+
+    @staticmethod
+    def _check_done(entry: dict):
+        if entry['total_chunks'] is not None and len(entry['chunks']) >= entry['total_chunks']:
+            entry['done'] = True
+            entry['chunks'] = []
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'files': self.files}, f, indent=1)
+        os.replace(tmp, self.path)
+
+# --- Parsing (worker processes) ---
+
+def parse_file(path: str, block_size: int, skip_chunks: List[int], out_queue) -> dict:
+    """
+    Parses one CSV file in chunks of about block_size bytes and puts
+    ('chunk', path, index, rows, parse_seconds, arrow_ipc_bytes) on out_queue
+    for every chunk not in skip_chunks. Runs in a worker process.
+    """
+    # MarineCadastre headers sometimes carry stray whitespace
+    with open(path) as f:
+        header = [name.strip() for name in f.readline().split(',')]
+    read_options = csv.ReadOptions(column_names=header, skip_rows=1, block_size=block_size)
+    convert_options = csv.ConvertOptions(
+        column_types={field.name: field.type for field in AIS_ARROW_SCHEMA},
+        include_columns=AIS_ARROW_SCHEMA.names,
+        strings_can_be_null=True,
+    )
+    skip = set(skip_chunks)
+    chunks = 0
+    rows = 0
+    parse_seconds = 0.0
+    reader = csv.open_csv(path, read_options=read_options, convert_options=convert_options)
+    while True:
+        start = time.perf_counter()
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            break
+        index = chunks
+        chunks += 1
+        if index in skip:
+            continue
+        table = normalize_chunk(pa.Table.from_batches([batch]))
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        elapsed = time.perf_counter() - start
+        parse_seconds += elapsed
+        rows += table.num_rows
+        out_queue.put(('chunk', path, index, table.num_rows, elapsed, sink.getvalue().to_pybytes()))
+    out_queue.put(('parsed', path, chunks, rows, parse_seconds, None))
+    return {'path': path, 'chunks': chunks, 'rows': rows}
+
+# --- Inserting (main process threads) ---
+
+class Inserter:
+    """Inserts Arrow chunks from a thread pool, one ClickHouse client per thread."""
+
+    def __init__(self, table: str, threads: int, connect: Callable[[], Any] = get_clickhouse_client):
+        self.table = table
+        self.connect = connect
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='insert')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.seconds = 0.0
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.connect()
+        return self._local.client
+
+    def insert(self, ipc_bytes: bytes) -> int:
+        """Inserts a chunk serialized as an Arrow IPC stream (as sent by parse_file)."""
+        return self.insert_table(pa.ipc.open_stream(ipc_bytes).read_all())
+
+    def insert_table(self, table: pa.Table) -> int:
+        """Inserts an ais_data shaped Arrow table on the calling thread."""
+        start = time.perf_counter()
+        try:
+            self._client().insert_arrow(self.table, table)
+        except Exception:
+            # Reconnect on the next insert from this thread
+            self._local.__dict__.pop('client', None)
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.rows += table.num_rows
+            self.seconds += elapsed
+        return table.num_rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help="CSV files, directories or glob patterns")
+    parser.add_argument('--table', default='ais_data')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Parser processes")
+    parser.add_argument('--insert-threads', type=int, default=4)
+    parser.add_argument('--block-size', type=int, default=64 << 20, help="CSV bytes per chunk (default 64 MiB)")
+    parser.add_argument('--max-pending', type=int, default=16, help="Parsed chunks buffered ahead of inserts, in the queue and again in flight")
+    parser.add_argument('--manifest', default='ingest_manifest.json', help="Checkpoint file for resuming")
+    args = parser.parse_args()
+
+    paths = expand_paths(args.paths)
+    if not paths:
+        print("No CSV files matched.")
+        return
+    manifest = Manifest(args.manifest, args.block_size)
+    todo = [(path, manifest.entry(path)) for path in paths]
+    todo = [(path, entry) for path, entry in todo if not entry['done']]
+    print(f"{len(paths)} files matched, {len(paths) - len(todo)} already ingested, {len(todo)} to go.")
+    if not todo:
+        return
+
+    client = get_clickhouse_client()
+    # Creates the table on first use, migrating an existing one is up to migrate.py
+    try:
+        ensure_schema(client, args.table)
+    except SchemaOutdatedError as e:
+        sys.exit(str(e))
+
+    inserter = Inserter(args.table, args.insert_threads)
+    parse_rows = 0
+    parse_seconds = 0.0
+    files_done = 0
+    pending_inserts = []
+    # Chunks handed to the inserter and not yet inserted, at least one per thread
+    max_inserts = max(args.max_pending, args.insert_threads)
+    errors = []
+    wall_start = time.perf_counter()
+
+    def on_inserted(future, path, index):
+        if future.exception() is not None:
+            errors.append(f"{os.path.basename(path)} chunk {index}: {future.exception()}")
+            return
+        manifest.chunk_done(path, index)
+
+    with multiprocessing.Manager() as mp_manager:
+        chunk_queue = mp_manager.Queue(maxsize=args.max_pending)
+        with ProcessPoolExecutor(max_workers=args.workers) as parsers:
+            parse_jobs = [
+                parsers.submit(parse_file, path, args.block_size, entry['chunks'], chunk_queue)
+                for path, entry in todo
+            ]
+            remaining = len(parse_jobs)
+            while remaining:
+                try:
+                    kind, path, index, rows, seconds, payload = chunk_queue.get(timeout=1)
+                except queue.Empty:
+                    failed = [job for job in parse_jobs if job.done() and job.exception() is not None]
+                    if failed:
+                        raise failed[0].exception()
+                    continue
+                if kind == 'chunk':
+                    parse_rows += rows
+                    parse_seconds += seconds
+                    # Wait for inserts to catch up rather than piling up chunks in
+                    # memory, the parsers block on the full queue meanwhile
+                    pending_inserts = [f for f in pending_inserts if not f.done()]
+                    while len(pending_inserts) >= max_inserts:
+                        done, _ = wait(pending_inserts, return_when=FIRST_COMPLETED)
+                        pending_inserts = [f for f in pending_inserts if f not in done]
+                    future = inserter.executor.submit(inserter.insert, payload)
+                    future.add_done_callback(lambda f, path=path, index=index: on_inserted(f, path, index))
+                    pending_inserts.append(future)
+                else:
+                    # Every chunk of this file has been handed to the inserter
+                    remaining -= 1
+                    files_done += 1
+                    manifest.file_parsed(path, index)
+                    elapsed = time.perf_counter() - wall_start
+                    print(f"[{files_done}/{len(todo)}] parsed {os.path.basename(path)} ({rows:,} new rows) | "
+                          f"parse {parse_rows / max(parse_seconds, 1e-9):,.0f} rows/s/worker, "
+                          f"insert {inserter.rows / max(inserter.seconds, 1e-9):,.0f} rows/s/thread, "
+                          f"overall {inserter.rows / elapsed:,.0f} rows/s")
+    inserter.executor.shutdown(wait=True)
+
+    elapsed = time.perf_counter() - wall_start
+    print("\nIngestion summary:")
+    print(f"  parse:   {parse_rows:,} rows in {parse_seconds:.1f} worker-s ({parse_rows / max(parse_seconds, 1e-9):,.0f} rows/s per worker)")
+    print(f"  insert:  {inserter.rows:,} rows in {inserter.seconds:.1f} thread-s ({inserter.rows / max(inserter.seconds, 1e-9):,.0f} rows/s per thread)")
+    print(f"  overall: {inserter.rows:,} rows in {elapsed:.1f}s ({inserter.rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    if errors:
+        print(f"\n{len(errors)} chunks failed to insert and will be retried on the next run:")
+        for error in errors:
+            print(f"  {error}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
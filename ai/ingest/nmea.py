@@ -0,0 +1,432 @@
+"""
+NMEA 0183 !AIVDM/!AIVDO decoder for the SDR scanner feed.
+
+Sentences are decoded in batches: checksums are validated with one NumPy
+reduction over the whole batch, multi-fragment messages are reassembled
+(and dropped if incomplete after a timeout), and the 6-bit payloads of each
+message type are unpacked into a bit matrix so every field is extracted for
+all messages at once. Supported message types:
+
+    1, 2, 3  Class A position report
+    5        Class A static and voyage data
+    18       Class B position report
+    19       Class B extended position report (position + static)
+    24       Class B static data report (parts A and B)
+
+Position reports become ais_data rows. Static data is cached per MMSI and
+merged into that vessel's position rows, like the aisstream.io ingestor.
+
+Usage (from the ai/ directory):
+    rtl_ais -n | python ingest/nmea.py -           # decode stdin
+    python ingest/nmea.py --udp 10110              # listen for NMEA over UDP
+    python ingest/nmea.py capture.nmea --dry-run   # decode a log, skip ClickHouse
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ingest_ais import AIS_ARROW_SCHEMA, Inserter, normalize_chunk
+
+# Payload armoring: '0'..'W' -> 0..39 and '`'..'w' -> 40..63
+_ARMOR = np.zeros(256, dtype=np.uint8)
+_ARMOR[48:88] = np.arange(0, 40)
+_ARMOR[96:120] = np.arange(40, 64)
+# AIS 6-bit text: 0..31 -> '@'..'_', 32..63 -> ' '..'?'
+_SIXBIT_TEXT = np.array([c + 64 if c < 32 else c for c in range(64)], dtype=np.uint8)
+_SIXBIT_WEIGHTS = np.array([32, 16, 8, 4, 2, 1], dtype=np.uint8)
+
+# Payload length in characters each type is unpacked to, and the minimum
+# length needed for the fields we read. Shorter payloads are dropped. Type 5
+# must be complete (424 bits), so a two-part message assembled from a short
+# first part can't pass for one.
+_PAYLOAD_CHARS = {1: 28, 2: 28, 3: 28, 5: 71, 18: 28, 19: 52, 24: 28}
+_MIN_CHARS = {1: 23, 2: 23, 3: 23, 5: 71, 18: 23, 19: 51, 24: 27}
+
+# --- Bit level helpers ---
+
+def payload_bits(payloads: Sequence[str], nchars: int) -> np.ndarray:
+    """Unpacks payloads into an (n, nchars * 6) bit matrix, zero padded or truncated to nchars."""
+    joined = ''.join(p[:nchars].ljust(nchars, '0') for p in payloads).encode('ascii', 'replace')
+    values = _ARMOR[np.frombuffer(joined, dtype=np.uint8)].reshape(len(payloads), nchars, 1)
+    return np.unpackbits(values, axis=2)[:, :, 2:].reshape(len(payloads), nchars * 6)
+
+def _uint(bits: np.ndarray, start: int, length: int) -> np.ndarray:
+    weights = np.left_shift(np.int64(1), np.arange(length - 1, -1, -1, dtype=np.int64))
+    return bits[:, start:start + length].astype(np.int64) @ weights
+
+def _int(bits: np.ndarray, start: int, length: int) -> np.ndarray:
+    value = _uint(bits, start, length)
+    return np.where(value >= 1 << (length - 1), value - (1 << length), value)
+
+def _text(bits: np.ndarray, start: int, nchars: int) -> List[str]:
+    groups = bits[:, start:start + nchars * 6].reshape(len(bits), nchars, 6) @ _SIXBIT_WEIGHTS
+    chars = _SIXBIT_TEXT[groups]
+    return [row.tobytes().decode('ascii').split('@')[0].strip() for row in chars]
+
+def _scaled(value: np.ndarray, scale: float, missing: int) -> np.ndarray:
+    return np.where(value == missing, np.nan, value / scale)
+
+# --- Sentence level ---
+
+class FragmentAssembler:
+    """
+    Reassembles multi-sentence messages, keyed on (sequence id, channel).
+    Messages not completed within timeout seconds, or superseded by a new
+    message on the same key, are discarded.
+    """
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        # key -> [total, fragments by number, fill bits, timestamp, first seen]
+        self.pending: Dict[Tuple[str, str], list] = {}
+        self.dropped = 0
+
+    def add(self, total: int, number: int, seq_id: str, channel: str, payload: str,
+            fill: int, timestamp: float, now: float) -> Optional[Tuple[str, int, float]]:
+        """Adds a fragment. Returns (payload, fill_bits, timestamp) once the message is complete."""
+        key = (seq_id, channel)
+        entry = self.pending.get(key)
+        if number == 1 or entry is None or entry[0] != total:
+            if entry is not None:
+                self.dropped += 1
+            entry = self.pending[key] = [total, {}, 0, timestamp, now]
+        entry[1][number] = payload
+        if number == total:
+            entry[2] = fill
+        if len(entry[1]) < total:
+            return None
+        del self.pending[key]
+        fragments = entry[1]
+        if any(n not in fragments for n in range(1, total + 1)):
+            return None
+        return ''.join(fragments[n] for n in range(1, total + 1)), entry[2], entry[3]
+
+    def expire(self, now: float):
+        stale = [key for key, entry in self.pending.items() if now - entry[4] > self.timeout]
+        for key in stale:
+            del self.pending[key]
+        self.dropped += len(stale)
+
+def _tag_block_time(tag: str) -> Optional[float]:
+    """Reads the c: (unix time) field of an NMEA 4.0 tag block."""
+    for field in tag.split('*')[0].split(','):
+        if field.startswith('c:'):
+            value = float(field[2:])
+            # Some receivers write milliseconds
+            return value / 1000 if value > 1e11 else value
+    return None
+
+class NMEADecoder:
+    """
+    Batch decoder from raw NMEA lines to ais_data shaped Arrow tables.
+
+    Keeps fragment and static data state between batches, so consecutive
+    calls to decode() can split messages across batch boundaries.
+    """
+
+    def __init__(self, fragment_timeout: float = 5.0):
+        self.assembler = FragmentAssembler(fragment_timeout)
+        # MMSI -> {VesselName, IMO, CallSign, VesselType, Length, Width, Draft}
+        self.static: Dict[int, dict] = {}
+        self.metrics = {
+            'sentences': 0,
+            'bad_checksum': 0,
+            'malformed': 0,
+            'messages': 0,
+            'unsupported': 0,
+            'rows': 0,
+        }
+
+    def stats(self) -> dict:
+        return {**self.metrics, 'fragments_dropped': self.assembler.dropped, 'fragments_pending': len(self.assembler.pending)}
+
+    def _sentences(self, lines: Iterable[str], received_at: float) -> Tuple[List[str], List[int], List[float]]:
+        """Validates sentences and returns the complete (payloads, fill bits, timestamps)."""
+        bodies, checksums, stamps = [], [], []
+        for line in lines:
+            line = line.strip()
+            stamp = received_at
+            if line.startswith('\\'):
+                end = line.find('\\', 1)
+                try:
+                    stamp = _tag_block_time(line[1:end]) or received_at
+                except ValueError:
+                    pass
+                line = line[end + 1:]
+            star = line.rfind('*')
+            if star < 0 or not line.startswith('!') or line[3:6] not in ('VDM', 'VDO'):
+                self.metrics['malformed'] += 1
+                continue
+            bodies.append(line[1:star])
+            checksums.append(line[star + 1:star + 3])
+            stamps.append(stamp)
+        self.metrics['sentences'] += len(bodies)
+        if not bodies:
+            return [], [], []
+
+        # XOR of every character between '!' and '*', for the whole batch at once
+        lengths = np.fromiter((len(body) for body in bodies), dtype=np.int64, count=len(bodies))
+        buffer = np.frombuffer(''.join(bodies).encode('latin-1', 'replace'), dtype=np.uint8)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        actual = np.bitwise_xor.reduceat(buffer, offsets)
+        expected = np.array([int(c, 16) if len(c) == 2 else -1 for c in checksums], dtype=np.int64)
+        valid = actual == expected
+        self.metrics['bad_checksum'] += int((~valid).sum())
+
+        payloads, fills, times = [], [], []
+        now = time.monotonic()
+        for body, stamp, ok in zip(bodies, stamps, valid):
+            if not ok:
+                continue
+            fields = body.split(',')
+            if len(fields) < 7:
+                self.metrics['malformed'] += 1
+                continue
+            try:
+                total, number, fill = int(fields[1]), int(fields[2]), int(fields[6] or 0)
+            except ValueError:
+                self.metrics['malformed'] += 1
+                continue
+            if total == 1:
+                payloads.append(fields[5])
+                fills.append(fill)
+                times.append(stamp)
+                continue
+            complete = self.assembler.add(total, number, fields[3], fields[4], fields[5], fill, stamp, now)
+            if complete is not None:
+                payloads.append(complete[0])
+                fills.append(complete[1])
+                times.append(complete[2])
+        self.assembler.expire(now)
+        return payloads, fills, times
+
+    def _update_static(self, mmsi: np.ndarray, values: Dict[str, list]):
+        for i, key in enumerate(mmsi.tolist()):
+            entry = self.static.setdefault(key, {})
+            for field, column in values.items():
+                value = column[i]
+                # Missing values in a report don't wipe what an earlier one told us
+                if value is not None and value == value and value != '':
+                    entry[field] = value
+
+    def decode(self, lines: Iterable[str], received_at: Optional[float] = None) -> pa.Table:
+        """
+        Decodes a batch of NMEA lines into position rows.
+
+        Args:
+            lines: Raw sentences, optionally prefixed with a tag block.
+            received_at: Unix time used for sentences without a tag block
+                         timestamp (default: now).
+
+        Returns:
+            pa.Table: ais_data shaped rows, one per valid position report.
+        """
+        received_at = time.time() if received_at is None else received_at
+        payloads, _, times = self._sentences(lines, received_at)
+        self.metrics['messages'] += len(payloads)
+        if not payloads:
+            return normalize_chunk(AIS_ARROW_SCHEMA.empty_table())
+
+        types = _ARMOR[np.frombuffer(''.join(p[:1] or '0' for p in payloads).encode('ascii', 'replace'), dtype=np.uint8)]
+        lengths = np.fromiter((len(p) for p in payloads), dtype=np.int64, count=len(payloads))
+        times = np.asarray(times, dtype=np.float64)
+        groups = {}
+        for message_type in _PAYLOAD_CHARS:
+            index = np.flatnonzero((types == message_type) & (lengths >= _MIN_CHARS[message_type]))
+            if len(index):
+                groups[message_type] = index
+        self.metrics['unsupported'] += len(payloads) - sum(len(index) for index in groups.values())
+
+        def bits_for(*message_types):
+            index = np.concatenate([groups[t] for t in message_types if t in groups] or [np.empty(0, dtype=np.int64)])
+            nchars = max(_PAYLOAD_CHARS[t] for t in message_types)
+            return index, payload_bits([payloads[i] for i in index], nchars)
+
+        # Static data first, so positions in the same batch pick it up
+        if 5 in groups:
+            index, bits = bits_for(5)
+            imo = _uint(bits, 40, 30)
+            self._update_static(_uint(bits, 8, 30), {
+                'IMO': [f"IMO{n}" if n else '' for n in imo.tolist()],
+                'CallSign': _text(bits, 70, 7),
+                'VesselName': _text(bits, 112, 20),
+                'VesselType': _uint(bits, 232, 8).tolist(),
+                'Length': (_uint(bits, 240, 9) + _uint(bits, 249, 9)).astype(float).tolist(),
+                'Width': (_uint(bits, 258, 6) + _uint(bits, 264, 6)).astype(float).tolist(),
+                'Draft': (_uint(bits, 294, 8) / 10).tolist(),
+            })
+        if 24 in groups:
+            index, bits = bits_for(24)
+            part = _uint(bits, 38, 2)
+            mmsi = _uint(bits, 8, 30)
+            a, b = part == 0, part == 1
+            if a.any():
+                self._update_static(mmsi[a], {'VesselName': _text(bits[a], 40, 20)})
+            if b.any():
+                bits_b = bits[b]
+                self._update_static(mmsi[b], {
+                    'VesselType': _uint(bits_b, 40, 8).tolist(),
+                    'CallSign': _text(bits_b, 90, 7),
+                    'Length': (_uint(bits_b, 132, 9) + _uint(bits_b, 141, 9)).astype(float).tolist(),
+                    'Width': (_uint(bits_b, 150, 6) + _uint(bits_b, 156, 6)).astype(float).tolist(),
+                })
+        if 19 in groups:
+            index, bits = bits_for(19)
+            self._update_static(_uint(bits, 8, 30), {
+                'VesselName': _text(bits, 143, 20),
+                'VesselType': _uint(bits, 263, 8).tolist(),
+                'Length': (_uint(bits, 271, 9) + _uint(bits, 280, 9)).astype(float).tolist(),
+                'Width': (_uint(bits, 289, 6) + _uint(bits, 295, 6)).astype(float).tolist(),
+            })
+
+        # Positions: Class A (1/2/3) and Class B (18/19) share a layout shifted by 4 bits
+        parts = []
+        for message_types, offset, transceiver in (((1, 2, 3), 0, 'A'), ((18, 19), -4, 'B')):
+            if not any(t in groups for t in message_types):
+                continue
+            index, bits = bits_for(*message_types)
+            parts.append({
+                'MMSI': _uint(bits, 8, 30),
+                'time': times[index],
+                'LAT': _scaled(_int(bits, 89 + offset, 27), 600000.0, 91 * 600000),
+                'LON': _scaled(_int(bits, 61 + offset, 28), 600000.0, 181 * 600000),
+                'SOG': _scaled(_uint(bits, 50 + offset, 10), 10.0, 1023),
+                'COG': _scaled(_uint(bits, 116 + offset, 12), 10.0, 3600),
+                'Heading': _uint(bits, 128 + offset, 9),
+                'Status': _uint(bits, 38, 4) if transceiver == 'A' else np.full(len(index), -1),
+                'TransceiverClass': np.full(len(index), transceiver, dtype=object),
+            })
+        if not parts:
+            return normalize_chunk(AIS_ARROW_SCHEMA.empty_table())
+        rows = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        keep = ~(np.isnan(rows['LAT']) | np.isnan(rows['LON']))
+        rows = {key: value[keep] for key, value in rows.items()}
+
+        # Static fields per unique MMSI, spread to rows with the inverse index
+        unique, inverse = np.unique(rows['MMSI'], return_inverse=True)
+        static = [self.static.get(m, {}) for m in unique.tolist()]
+        def static_column(field, arrow_type):
+            return pa.array([entry.get(field) for entry in static], type=arrow_type).take(pa.array(inverse))
+
+        table = pa.table({
+            'MMSI': pa.array(rows['MMSI'], pa.uint32()),
+            'BaseDateTime': pa.array((rows['time'] * 1000).astype(np.int64), pa.timestamp('ms')),
+            'LAT': pa.array(rows['LAT'], pa.float64()),
+            'LON': pa.array(rows['LON'], pa.float64()),
+            'SOG': pa.array(rows['SOG'], pa.float32()),
+            'COG': pa.array(rows['COG'], pa.float32()),
+            'Heading': pa.array(rows['Heading'], pa.uint16()),
+            'VesselName': static_column('VesselName', pa.string()),
+            'IMO': static_column('IMO', pa.string()),
+            'CallSign': static_column('CallSign', pa.string()),
+            'VesselType': static_column('VesselType', pa.uint16()),
+            # Class B has no navigational status
+            'Status': pa.array(rows['Status'], pa.int16(), mask=rows['Status'] < 0).cast(pa.uint8()),
+            'Length': static_column('Length', pa.float32()),
+            'Width': static_column('Width', pa.float32()),
+            'Draft': static_column('Draft', pa.float32()),
+            'Cargo': pa.nulls(len(rows['MMSI']), pa.float32()),
+            'TransceiverClass': pa.array(rows['TransceiverClass'], pa.string()),
+        })
+        self.metrics['rows'] += table.num_rows
+        return normalize_chunk(table)
+
+# --- CLI ---
+
+def read_lines(paths: List[str]) -> Iterator[str]:
+    for path in paths:
+        stream = sys.stdin if path == '-' else open(path, errors='replace')
+        try:
+            yield from stream
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+def udp_lines(port: int, timeout: float) -> Iterator[Optional[str]]:
+    """Yields lines from UDP datagrams, and None whenever timeout passes without data."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('0.0.0.0', port))
+    sock.settimeout(timeout)
+    print(f"Listening for NMEA on udp://0.0.0.0:{port}")
+    while True:
+        try:
+            data, _ = sock.recvfrom(65535)
+        except socket.timeout:
+            yield None
+            continue
+        yield from data.decode('ascii', 'replace').splitlines()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help="NMEA log files, '-' for stdin")
+    parser.add_argument('--udp', type=int, default=None, help="Listen for NMEA datagrams on this port instead")
+    parser.add_argument('--table', default='ais_data')
+    parser.add_argument('--batch-size', type=int, default=50_000, help="Sentences per decode/insert batch")
+    parser.add_argument('--flush-interval', type=float, default=2.0, help="Max seconds to hold a UDP batch")
+    parser.add_argument('--insert-threads', type=int, default=2)
+    parser.add_argument('--dry-run', action='store_true', help="Decode only, skip ClickHouse")
+    args = parser.parse_args()
+    if not args.paths and args.udp is None:
+        parser.error("Give NMEA files, '-' for stdin, or --udp PORT")
+
+    inserter = None
+    if not args.dry_run:
+        from data import get_clickhouse_client
+        from migrate import SchemaOutdatedError, ensure_schema
+        try:
+            ensure_schema(get_clickhouse_client(), args.table)
+        except SchemaOutdatedError as e:
+            sys.exit(str(e))
+        inserter = Inserter(args.table, args.insert_threads)
+
+    decoder = NMEADecoder()
+    pending = []
+    start = time.perf_counter()
+    decode_seconds = 0.0
+
+    def flush(batch):
+        nonlocal decode_seconds
+        t0 = time.perf_counter()
+        table = decoder.decode(batch)
+        decode_seconds += time.perf_counter() - t0
+        if inserter is not None and table.num_rows:
+            # Decode the next batch while this one is inserted
+            pending.append(inserter.executor.submit(inserter.insert_table, table))
+            while len(pending) > args.insert_threads * 2:
+                pending.pop(0).result()
+
+    source = udp_lines(args.udp, args.flush_interval) if args.udp is not None else read_lines(args.paths)
+    batch = []
+    batch_started = time.monotonic()
+    try:
+        for line in source:
+            if line is not None:
+                batch.append(line)
+            if len(batch) >= args.batch_size or (batch and time.monotonic() - batch_started >= args.flush_interval):
+                flush(batch)
+                batch = []
+                batch_started = time.monotonic()
+                stats = decoder.stats()
+                print(f"{stats['sentences']:,} sentences, {stats['rows']:,} rows | "
+                      f"decode {stats['sentences'] / max(decode_seconds, 1e-9):,.0f} sentences/s | "
+                      f"bad checksum {stats['bad_checksum']:,}, dropped fragments {stats['fragments_dropped']:,}")
+        if batch:
+            flush(batch)
+    except KeyboardInterrupt:
+        pass
+    for future in pending:
+        future.result()
+    elapsed = time.perf_counter() - start
+    print(f"Done in {elapsed:.1f}s: {decoder.stats()}")
+
+if __name__ == '__main__':
+    main()
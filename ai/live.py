@@ -0,0 +1,390 @@
+"""
+Live vessel feed for the /api/live WebSocket.
+
+A client sends its viewport and gets a snapshot of the latest position of
+every vessel in it, then only deltas: vessels that appeared, moved or
+expired. Moving the map is another viewport message on the same socket and
+is answered with a delta too.
+
+Messages from the client:
+    {"type": "viewport", "min_lat": .., "max_lat": .., "min_lon": .., "max_lon": .., "table": "ais_data"}
+
+Messages to the client, vessels as parallel arrays:
+    {"type": "snapshot", "time": .., "new": {"MMSI": [..], "LAT": [..], "LON": [..], "COG": [..], "SOG": [..],
+                                              "Heading": [..], "VesselName": [..], "VesselType": [..], ...}}
+    {"type": "delta", "time": .., "new": {..}, "moved": {"MMSI": [..], "LAT": [..], "LON": [..], "COG": [..], "SOG": [..]},
+     "expired": [mmsi, ..]}
+    {"type": "error", "detail": ".."}
+
+time is the table's watermark (newest BaseDateTime), which is "now" for the
+feed: a vessel is live while its latest report is within LIVE_WINDOW_MINUTES
+of it. Positions are rounded to about a metre, COG and SOG to a tenth, and a
+vessel only counts as moved when one of the rounded values changed.
+
+Once every LIVE_INTERVAL seconds the feed checks the watermark. Nothing can
+have changed while it stands still, so only viewports that were moved are
+queried then. Otherwise the viewports are merged into as few boxes as
+possible and each box is queried once, with every subscriber inside it
+cropping its own view from the shared result. A merged box that reaches
+LIVE_MAX_VESSELS is cut short, so its subscribers are queried one by one
+instead.
+
+Settings are read from the environment:
+    LIVE_INTERVAL: Seconds between ticks (default 2).
+    LIVE_WINDOW_MINUTES: How old a vessel's latest report may be (default 30).
+    LIVE_MAX_VESSELS: Upper bound on vessels loaded per query (default 20000).
+    LIVE_SEND_TIMEOUT: Subscribers that take longer to accept a message are dropped (default 10).
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+from data import crop_to_bbox, get_clickhouse_client
+from formats import mask_non_finite
+from telemetry import RESPONSE_BYTES, span
+
+logger = logging.getLogger(__name__)
+
+LIVE_INTERVAL = float(os.getenv('LIVE_INTERVAL', 2))
+LIVE_WINDOW_MINUTES = float(os.getenv('LIVE_WINDOW_MINUTES', 30))
+LIVE_MAX_VESSELS = int(os.getenv('LIVE_MAX_VESSELS', 20000))
+LIVE_SEND_TIMEOUT = float(os.getenv('LIVE_SEND_TIMEOUT', 10))
+
+# Sent once per vessel, when it enters the view
+LIVE_STATIC_COLUMNS = ['Heading', 'VesselName', 'VesselType', 'Length', 'Width']
+# Sent whenever a vessel moves, compared to decide whether it did
+LIVE_MOVING_COLUMNS = ['LAT', 'LON', 'COG', 'SOG']
+LIVE_COLUMNS = ['MMSI'] + LIVE_MOVING_COLUMNS + LIVE_STATIC_COLUMNS
+# Decimals kept per moving column: 1e-5 degrees is about a metre
+LIVE_DECIMALS = {'LAT': 5, 'LON': 5, 'COG': 1, 'SOG': 1}
+
+BBox = Tuple[float, float, float, float]
+
+def build_live_query(min_lat: float, max_lat: float, min_lon: float, max_lon: float, since,
+                     table: str = 'ais_data', limit: int = LIVE_MAX_VESSELS) -> Tuple[str, dict]:
+    """
+    Builds the query for the vessels whose latest report since since lies in
+    the bbox, with that report's LIVE_COLUMNS. Beyond limit vessels only
+    those with the lowest MMSIs are returned.
+
+    Unlike the geo query's 'latest' mode the latest report is taken before
+    filtering on the bbox, so a vessel that sailed out of the box is gone
+    rather than shown where it last was inside it. So as long as a larger
+    box stays under limit, the vessels cropped from it are the same as those
+    of the box queried alone.
+
+    Returns:
+        Tuple[str, dict]: The query string and its parameters.
+    """
+    value_columns = [col for col in LIVE_COLUMNS if col != 'MMSI']
+    inner = ", ".join(f"argMax({col}, BaseDateTime) AS latest_{col}" for col in value_columns)
+    outer = ", ".join(f"latest_{col} AS {col}" for col in value_columns)
+    # Ordered so a box with more than limit vessels keeps the same ones from tick to tick
+    limit_clause = f"ORDER BY MMSI LIMIT {int(limit)}" if limit > 0 else ""
+    query = f"""
+    SELECT MMSI, {outer}
+    FROM (
+        SELECT MMSI, {inner}
+        FROM {table}
+        WHERE BaseDateTime >= %(since)s
+          AND MMSI IN (
+            SELECT DISTINCT MMSI
+            FROM {table}
+            WHERE LAT >= %(min_lat)s AND LAT <= %(max_lat)s
+              AND LON >= %(min_lon)s AND LON <= %(max_lon)s
+              AND BaseDateTime >= %(since)s
+          )
+        GROUP BY MMSI
+    )
+    WHERE latest_LAT >= %(min_lat)s AND latest_LAT <= %(max_lat)s
+      AND latest_LON >= %(min_lon)s AND latest_LON <= %(max_lon)s
+    {limit_clause}
+    """
+    params = {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon, 'since': since}
+    return query, params
+
+def load_live_positions(min_lat: float, max_lat: float, min_lon: float, max_lon: float, since,
+                        table: str = 'ais_data', client = None, limit: int = LIVE_MAX_VESSELS,
+                        settings: Optional[dict] = None) -> pa.Table:
+    """
+    Loads the live vessels of a bbox, see build_live_query. Errors are
+    raised like the geo loaders', an empty result would expire every vessel
+    on the subscribers' maps.
+
+    Returns:
+        pa.Table: One row per MMSI with LIVE_COLUMNS.
+    """
+    query, params = build_live_query(min_lat, max_lat, min_lon, max_lon, since, table=table, limit=limit)
+    if client is None:
+        client = get_clickhouse_client()
+    logger.debug(f"Querying live positions from {table}: LAT({min_lat}, {max_lat}), LON({min_lon}, {max_lon}) since {since}")
+    return client.query_arrow(query, parameters=params, settings=settings, use_strings=True)
+
+def _area(box: BBox) -> float:
+    return max(box[1] - box[0], 0.0) * max(box[3] - box[2], 0.0)
+
+def _union(a: BBox, b: BBox) -> BBox:
+    return min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+
+def merge_viewports(viewports: List[BBox]) -> List[Tuple[BBox, List[int]]]:
+    """
+    Groups viewports into boxes that are each worth one query.
+
+    Two boxes are merged when their union is no larger than the two of them
+    together, i.e. when they overlap enough that one query reads less than
+    two. Nested and identical viewports always merge.
+
+    Returns:
+        List[Tuple[BBox, List[int]]]: Each merged box with the indices of the viewports inside it.
+    """
+    groups = [(box, [i]) for i, box in enumerate(viewports)]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                union = _union(groups[i][0], groups[j][0])
+                if _area(union) <= _area(groups[i][0]) + _area(groups[j][0]):
+                    groups[i] = (union, groups[i][1] + groups[j][1])
+                    del groups[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return groups
+
+def _columns(table: pa.Table, rows: np.ndarray, names: List[str]) -> Dict[str, list]:
+    """The given rows of table as {column: list}, rounded per LIVE_DECIMALS, nulls as None."""
+    out = {}
+    for name in names:
+        if len(rows) == 0:
+            out[name] = []
+            continue
+        values = table.column(name).take(pa.array(rows, type=pa.int64())).to_pylist()
+        decimals = LIVE_DECIMALS.get(name)
+        if decimals is not None:
+            values = [None if v is None else round(v, decimals) for v in values]
+        out[name] = values
+    return out
+
+class _View:
+    """Rounded moving columns of the vessels a subscriber has been sent, sorted by MMSI."""
+
+    __slots__ = ('mmsi', 'values')
+
+    def __init__(self, mmsi: np.ndarray, values: np.ndarray):
+        self.mmsi = mmsi
+        self.values = values
+
+    @classmethod
+    def empty(cls) -> '_View':
+        return cls(np.empty(0, dtype=np.uint32), np.empty((0, len(LIVE_MOVING_COLUMNS))))
+
+    @classmethod
+    def of(cls, positions: pa.Table) -> Tuple['_View', np.ndarray]:
+        """The view of a positions table, and the row order that sorts it by MMSI."""
+        if positions.num_rows == 0:
+            return cls.empty(), np.empty(0, dtype=np.int64)
+        mmsi = positions.column('MMSI').to_numpy()
+        order = np.argsort(mmsi, kind='stable')
+        values = np.column_stack([
+            np.round(positions.column(name).to_numpy(zero_copy_only=False).astype(np.float64), LIVE_DECIMALS[name])
+            for name in LIVE_MOVING_COLUMNS
+        ])[order]
+        return cls(mmsi[order], values), order
+
+class Subscriber:
+    """One WebSocket client of the feed."""
+
+    def __init__(self, send: Callable[[str], Awaitable[Any]]):
+        self.send = send
+        self.viewport: Optional[BBox] = None
+        self.table = 'ais_data'
+        # Bumped on every viewport change so a tick that started before it
+        # doesn't mark the new viewport as served
+        self.version = 0
+        self.served_version = -1
+        self.view: Optional[_View] = None
+
+    @property
+    def dirty(self) -> bool:
+        return self.viewport is not None and self.served_version != self.version
+
+class LiveFeed:
+    """
+    Ticks while anyone is subscribed, querying each merged viewport box once
+    and sending every subscriber the difference to what it was sent before.
+
+    Args:
+        load: Coroutine function taking a bbox, since and table, returning
+              load_live_positions' table, e.g. through the ClickHouse pool.
+        watermark: Coroutine function returning a table's newest BaseDateTime,
+                   e.g. QueryCache.watermark so lookups are shared with it.
+        max_vessels: The limit load applies. A merged box that reaches it is
+                     queried again per subscriber.
+    """
+
+    def __init__(self, load: Callable[..., Awaitable[pa.Table]], watermark: Callable[[str], Awaitable[Any]],
+                 interval: float = LIVE_INTERVAL, window_minutes: float = LIVE_WINDOW_MINUTES,
+                 send_timeout: float = LIVE_SEND_TIMEOUT, max_vessels: int = LIVE_MAX_VESSELS):
+        self.load = load
+        self.max_vessels = max_vessels
+        self.watermark = watermark
+        self.interval = interval
+        self.window = timedelta(minutes=window_minutes)
+        self.send_timeout = send_timeout
+        self.subscribers: List[Subscriber] = []
+        self._watermarks: Dict[str, Any] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {'ticks': 0, 'queries': 0, 'snapshots': 0, 'deltas': 0, 'dropped': 0}
+
+    def stats(self) -> dict:
+        return {**self.counters, 'subscribers': len(self.subscribers)}
+
+    def subscribe(self, send: Callable[[str], Awaitable[Any]]) -> Subscriber:
+        """Adds a subscriber. It gets nothing until it sets a viewport."""
+        subscriber = Subscriber(send)
+        self.subscribers.append(subscriber)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def set_viewport(self, subscriber: Subscriber, min_lat: float, max_lat: float, min_lon: float, max_lon: float,
+                     table: str = 'ais_data'):
+        """
+        Moves a subscriber's view and wakes the feed so the change is answered
+        right away rather than on the next tick.
+
+        Raises:
+            ValueError: If the bbox is empty.
+        """
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError("Viewport min_lat/min_lon must not exceed max_lat/max_lon")
+        if table != subscriber.table:
+            # Vessels of another table have nothing in common with those sent
+            subscriber.view = None
+        subscriber.viewport = (min_lat, max_lat, min_lon, max_lon)
+        subscriber.table = table
+        subscriber.version += 1
+        self._wakeup.set()
+
+    async def close(self):
+        """Stops ticking. Subscribers' sockets are closed by the server."""
+        self.subscribers.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Live feed tick failed: {e}")
+
+    async def tick(self):
+        """Serves every subscriber whose view may have changed since the last tick."""
+        self.counters['ticks'] += 1
+        tables: Dict[str, List[Subscriber]] = {}
+        for subscriber in self.subscribers:
+            if subscriber.viewport is not None:
+                tables.setdefault(subscriber.table, []).append(subscriber)
+        await asyncio.gather(*(self._tick_table(table, subscribers) for table, subscribers in tables.items()))
+
+    async def _tick_table(self, table: str, subscribers: List[Subscriber]):
+        watermark = await self.watermark(table)
+        if watermark is None:
+            return
+        advanced = watermark != self._watermarks.get(table)
+        targets = subscribers if advanced else [s for s in subscribers if s.dirty]
+        if not targets:
+            return
+        # Captured now, a viewport may move while the queries run
+        versions = [s.version for s in targets]
+        viewports = [s.viewport for s in targets]
+        since = watermark - self.window
+
+        async def serve(box: BBox, members: List[int]):
+            try:
+                with span('live', 'query', subscribers=len(members)):
+                    positions = await self.load(*box, since=since, table=table)
+                # NaN (e.g. a missing Length) can't be sent as JSON
+                positions = mask_non_finite(positions)
+            except Exception as e:
+                # The subscribers stay dirty and are retried on the next tick
+                logger.warning(f"Live feed query for {table} {box} failed: {e}")
+                return False
+            self.counters['queries'] += 1
+            if self.max_vessels and positions.num_rows >= self.max_vessels and any(viewports[i] != box for i in members):
+                # The limit cut the merged box short, crops of it could miss vessels
+                served = await asyncio.gather(*(serve(viewports[i], [i]) for i in members))
+                return all(served)
+            await asyncio.gather(*(self._send_update(targets[i], viewports[i], versions[i], positions, watermark)
+                                   for i in members))
+            return True
+
+        served = await asyncio.gather(*(serve(box, members) for box, members in merge_viewports(viewports)))
+        if all(served):
+            self._watermarks[table] = watermark
+
+    async def _send_update(self, subscriber: Subscriber, viewport: BBox, version: int, positions: pa.Table, watermark: Any):
+        if positions.num_rows:
+            positions = crop_to_bbox(positions, *viewport)
+        view, order = _View.of(positions)
+        previous = subscriber.view
+        if previous is None:
+            message = {'type': 'snapshot', 'new': _columns(positions, order, LIVE_COLUMNS)}
+        else:
+            index = np.searchsorted(previous.mmsi, view.mmsi)
+            found = index < len(previous.mmsi)
+            found[found] = previous.mmsi[index[found]] == view.mmsi[found]
+            # NaN == NaN is False, so missing COG/SOG compare equal explicitly
+            old = previous.values[index[found]]
+            new = view.values[found]
+            changed = np.zeros(len(view.mmsi), dtype=bool)
+            changed[found] = ~((old == new) | (np.isnan(old) & np.isnan(new))).all(axis=1)
+            message = {
+                'type': 'delta',
+                'new': _columns(positions, order[~found], LIVE_COLUMNS),
+                'moved': _columns(positions, order[changed], ['MMSI'] + LIVE_MOVING_COLUMNS),
+                'expired': previous.mmsi[~np.isin(previous.mmsi, view.mmsi)].tolist(),
+            }
+            if not (message['new']['MMSI'] or message['moved']['MMSI'] or message['expired']):
+                subscriber.served_version = version
+                return
+        message['time'] = watermark.isoformat() if hasattr(watermark, 'isoformat') else str(watermark)
+        body = json.dumps(message, separators=(',', ':'), allow_nan=False)
+        try:
+            await asyncio.wait_for(subscriber.send(body), self.send_timeout)
+        except Exception as e:
+            # Closed or too slow, the endpoint cleans up when its socket ends
+            logger.info(f"Dropping live subscriber: {e!r}")
+            self.counters['dropped'] += 1
+            self.unsubscribe(subscriber)
+            return
+        self.counters['snapshots' if previous is None else 'deltas'] += 1
+        RESPONSE_BYTES.labels('live_' + message['type']).observe(len(body))
+        subscriber.view = view
+        subscriber.served_version = version
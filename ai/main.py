@@ -1,23 +1,74 @@
 import os
 import dspy
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from dotenv import load_dotenv
 import uvicorn
 import asyncio
+import base64
 import json
-from typing import List, Optional
-import numpy as np # Import numpy for inf handling
-import pandas as pd # Import pandas for isnull/notnull
+import logging
+import time
+from typing import List, Literal, Optional
+from contextlib import aclosing, asynccontextmanager
+from datetime import datetime
 
-from data import load_data_by_geolocation
+from data import (build_geo_query, crop_to_bbox, get_table_watermark, load_data_by_geolocation,
+                  load_arrow_by_geolocation, stream_arrow_by_geolocation)
+from formats import ENCODERS, MEDIA_TYPES, StreamEncoder, clean_records, mask_non_finite, negotiate_format
+from tiles import TILE_RAW_MIN_ZOOM, load_tile, snap_bbox
+from live import LiveFeed, load_live_positions
+from imagery import (IMAGERY_CHIP_PIXELS, IMAGERY_CHIP_SIZE_M, IMAGERY_MAX_CHIPS, IMAGERY_RESCAN_SECONDS,
+                     IMAGERY_TILE_CACHE_MB, IMAGERY_TILE_CACHE_TTL, ImageryIndex, load_vessels_at, render_chips,
+                     rasterio, render_tile)
+from tracks import build_track_query, load_tracks, simplify_tracks, to_tracks_json
+from summary import load_map_summary
+from steward import DataSteward
+from cache import QueryCache
 from agent import MapChatAgent
+from prediction_cache import PredictionCache
+from history import HistoryManager
+from db import ClickHousePool, PoolTimeoutError, QueryCancelledError
+from clickhouse_connect.driver.exceptions import DatabaseError
+from telemetry import (RESPONSE_BYTES, STAGE_SECONDS, RequestContextMiddleware, instrument_llm,
+                       setup_logging, setup_tracing, span)
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 load_dotenv()
+# Log level/format and trace export come from the environment, see telemetry.py
+setup_logging()
+setup_tracing()
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Tables clients may name (comma separated). Table names end up in SQL and in
+# cache and watermark keys, so any other name is refused with 400.
+API_TABLES = tuple(name.strip() for name in os.getenv('API_TABLES', 'ais_data').split(',') if name.strip())
+
+# Shared ClickHouse connection pool, opened at startup
+db_pool = ClickHousePool()
+# Result cache for geo and tile queries, invalidated when new data is ingested
+geo_cache = QueryCache(lambda table: db_pool.run(get_table_watermark, table))
+# Footprint index of the scenes in IMAGERY_DIR, and the tiles rendered from
+# them, dropped whenever a rescan finds new or changed files
+imagery_index = ImageryIndex()
+imagery_cache = QueryCache(lambda _: asyncio.to_thread(imagery_index.refresh),
+                           max_bytes=int(IMAGERY_TILE_CACHE_MB * 1024 * 1024), ttl=IMAGERY_TILE_CACHE_TTL,
+                           watermark_interval=IMAGERY_RESCAN_SECONDS)
+# Viewport subscriptions of /api/live, sharing the cache's watermark lookups
+live_feed = LiveFeed(lambda *bbox, **kwargs: db_pool.run(load_live_positions, *bbox, **kwargs), geo_cache.watermark)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info(f"Opening ClickHouse pool (size={db_pool.size})...")
+    await asyncio.to_thread(db_pool.open)
+    yield
+    await live_feed.close()
+    db_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -30,28 +81,66 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Request ids and per route latency, outermost so CORS preflights are timed too
+app.add_middleware(RequestContextMiddleware)
+
+async def map_summary_tool(viewport: dict) -> dict:
+    """The agent's get_map_summary. A failed query is reported as an error, not as an empty map."""
+    try:
+        return await db_pool.run(load_map_summary, **viewport)
+    except Exception as e:
+        logger.error(f"Error summarizing the map for the agent: {e}")
+        return {'error': f"Failed to summarize the map: {e}"}
 
 ollama_base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 ollama_model = os.getenv("OLLAMA_MODEL", "gemma3:27b")
 
 llm = None
 agent = None
+steward = None
+# Keeps the chat history in the prompt under HISTORY_MAX_TOKENS
+history_manager = HistoryManager()
 
 if ollama_base_url and ollama_model:
-    print(f"Configuring DSPy with Ollama: model={ollama_model} at {ollama_base_url}...")
+    logger.info(f"Configuring DSPy with Ollama: model={ollama_model} at {ollama_base_url}...")
     try:
         llm = dspy.LM(model="openai/" + ollama_model, api_key="ollama", api_base=ollama_base_url + '/v1')
         dspy.settings.configure(lm=llm)
-        print("DSPy configured with Ollama.")
-        agent = MapChatAgent()
-        print("MapChatAgent initialized.")
+        # LLM latency and token counts on /metrics
+        instrument_llm()
+        logger.info("DSPy configured with Ollama.")
+        # get_map_summary runs as a ClickHouse aggregate over the client's viewport,
+        # query_data through the data steward's generated SQL
+        steward = DataSteward()
+        agent = MapChatAgent(
+            map_summary_tool=map_summary_tool,
+            query_tool=lambda question: steward.answer(question, db_pool),
+            # Repeated turns are answered without calling the LM again
+            prediction_cache=PredictionCache()
+        )
+        logger.info("MapChatAgent initialized.")
     except Exception as e:
-        print(f"Error configuring DSPy/Agent: {e}")
+        logger.error(f"Error configuring DSPy/Agent: {e}")
         llm = None
         agent = None
+        steward = None
 else:
-    print("Warning: Ollama settings (OLLAMA_BASE_URL, OLLAMA_MODEL) not found or incomplete. API will likely fail.")
+    logger.warning("Ollama settings (OLLAMA_BASE_URL, OLLAMA_MODEL) not found or incomplete. API will likely fail.")
+
+def check_table(table: Optional[str]) -> str:
+    """Returns table if clients may query it, see API_TABLES."""
+    if table not in API_TABLES:
+        raise ValueError(f"Unknown table '{table}', expected one of {list(API_TABLES)}")
+    return table
+
+def encode(fmt: str, table, track_info: Optional[dict] = None) -> bytes:
+    """Serializes a result in one of the response formats, timed as the serialize stage."""
+    with span('serialize', fmt, rows=table.num_rows):
+        body = to_tracks_json(table, track_info) if fmt == 'tracks' else ENCODERS[fmt](table)
+    RESPONSE_BYTES.labels(fmt).observe(len(body))
+    return body
 
 # Define the structure for a single message in the history
 class HistoryMessage(BaseModel):
@@ -65,16 +154,67 @@ class GeoQueryRequest(BaseModel):
     min_lon: float
     max_lon: float
     table: Optional[str] = 'ais_data' # Optional table name, defaults to ais_data
+    start_time: Optional[datetime] = None # Optional BaseDateTime window start (inclusive)
+    end_time: Optional[datetime] = None # Optional BaseDateTime window end (inclusive)
+    mode: Literal['all', 'latest'] = 'all' # 'latest' returns one row per MMSI
+    columns: Optional[List[str]] = None # Optional column projection, defaults to all columns
+    limit: int = 10000 # Maximum rows (vessels in 'latest' mode), 0 disables the limit
+    format: Optional[Literal['records', 'columns', 'ndjson', 'arrow']] = None # Overrides the Accept header
+
+# Define the structure for the vessel track request
+class TrackQueryRequest(BaseModel):
+    mmsis: List[int]
+    table: Optional[str] = 'ais_data'
+    start_time: Optional[datetime] = None # Optional BaseDateTime window start (inclusive)
+    end_time: Optional[datetime] = None # Optional BaseDateTime window end (inclusive)
+    zoom: Optional[float] = None # Map zoom the track is drawn at, fits all tracks on screen if omitted
+    tolerance_px: float = 1.0 # Max deviation from the raw track in screen pixels at that zoom
+    columns: Optional[List[str]] = None # Optional per-point columns, defaults to MMSI, time, position, SOG, COG
+    format: Optional[Literal['tracks', 'columns', 'ndjson', 'arrow']] = None # 'tracks' groups points per vessel
+
+# Define the structure for a data steward question
+class DataQuestionRequest(BaseModel):
+    question: str
+
+# Define the structure for the visible map area sent with chat messages
+class Viewport(BaseModel):
+    min_lat: float
+    max_lat: float
+    min_lon: float
+    max_lon: float
+
+# Define the structure for a viewport message on the live feed WebSocket
+class LiveViewportMessage(BaseModel):
+    type: Literal['viewport']
+    min_lat: float
+    max_lat: float
+    min_lon: float
+    max_lon: float
+    table: str = 'ais_data'
+
+# Define the structure for the vessel image chip request
+class ImageryChipRequest(BaseModel):
+    min_lat: float
+    max_lat: float
+    min_lon: float
+    max_lon: float
+    table: Optional[str] = 'ais_data'
+    time: Optional[datetime] = None # Place vessels at this time instead of each scene's acquisition time
+    size_m: float = IMAGERY_CHIP_SIZE_M # Ground size of a chip
+    pixels: int = IMAGERY_CHIP_PIXELS # Chip width and height
+    limit: int = IMAGERY_MAX_CHIPS # Vessels per scene at most
+    max_scenes: int = 10 # Newest scenes first
 
 class ChatRequest(BaseModel):
     message: str
     history: List[HistoryMessage] = []
     image_description: Optional[str] = None
     tool_result: Optional[dict] = None # Add field for tool results from frontend
+    viewport: Optional[Viewport] = None # Current map bounds, lets get_map_summary run on the server
 
 @app.post("/api/chat/stream")
 async def stream_chat(request: ChatRequest):
-    print(f"Received message: {request.message}, History: {len(request.history)} items, Image Desc: {'Yes' if request.image_description else 'No'}, Tool Result: {'Yes' if request.tool_result else 'No'}")
+    logger.info(f"Received message: {request.message}, History: {len(request.history)} items, Image Desc: {'Yes' if request.image_description else 'No'}, Tool Result: {'Yes' if request.tool_result else 'No'}, Viewport: {'Yes' if request.viewport else 'No'}")
 
     async def event_stream():
         delimiter = "\n"
@@ -86,31 +226,73 @@ async def stream_chat(request: ChatRequest):
             return
 
         try:
+            turn_start = time.perf_counter()
+            first_event_at = None
+            with span('chat.history'):
+                chat_history, history_info = await history_manager.compact([msg.model_dump() for msg in request.history])
+            if history_info['folded_turns']:
+                logger.info(f"Compacted chat history: {history_info['turns']} turns, {history_info['input_tokens']} -> {history_info['tokens']} tokens "
+                            f"({history_info['verbatim_turns']} verbatim, {history_info['summarized_turns']} summarized, "
+                            f"{history_info['dropped_tool_messages']} tool results dropped)")
+
             # --- Agent Prediction --- 
-            # Pass tool_result to the agent
-            prediction = agent.forward(
+            # Tokens are streamed from the LM as they are generated; the LM call
+            # itself runs in a worker thread so the event loop stays free
+            prediction = None
+            streamed_text = False
+            tool_call_sent = False
+            async with aclosing(agent.astream(
                 user_input=request.message,
-                chat_history=[msg.content for msg in request.history],
+                chat_history=chat_history,
                 image_description=request.image_description,
-                tool_result=request.tool_result # Pass the tool result here
-            )
+                tool_result=request.tool_result, # Pass the tool result here
+                viewport=request.viewport.model_dump() if request.viewport else None
+            )) as events:
+                async for event in events:
+                    if first_event_at is None:
+                        first_event_at = time.perf_counter() - turn_start
+                        STAGE_SECONDS.labels('chat.first_event', '').observe(first_event_at)
+                    if event["type"] == "text":
+                        yield json.dumps({"type": "text", "content": event["content"]}) + delimiter
+                        streamed_text = True
+                        response_generated = True
+                    elif event["type"] == "action":
+                        logger.debug(f"Agent action detected: {event['action']}{' (server side)' if event['server_side'] else ''}")
+                        if event["action"] == "get_map_summary" and not event["server_side"]:
+                            # Takes no arguments, so the frontend can start on it before generation ends
+                            yield json.dumps({"type": "tool_call", "tool_name": "get_map_summary", "args": {}}) + delimiter
+                            tool_call_sent = True
+                            response_generated = True
+                    elif event["type"] == "tool_result":
+                        logger.debug(f"Agent ran {event['tool_name']} on the server: {json.dumps(event['result'], default=str)[:200]}")
+                    elif event["type"] == "prediction":
+                        prediction = event["prediction"]
 
             action = getattr(prediction, 'action', None)
             action_input_str = getattr(prediction, 'action_input', "") # Default to empty string
 
-            print(f"Agent raw prediction: Action='{action}', Input='{action_input_str}'")
+            logger.debug(f"Agent raw prediction: Action='{action}', Input='{action_input_str}'")
+            # Per turn latency against history size, to see how long sessions behave
+            prediction_seconds = time.perf_counter() - turn_start
+            STAGE_SECONDS.labels('chat.prediction', '').observe(prediction_seconds)
+            logger.info(f"Chat turn: {len(request.history)} messages, {history_info['tokens']} history tokens, "
+                        f"first event {first_event_at or 0:.2f}s, prediction {prediction_seconds:.2f}s",
+                        extra={'history_messages': len(request.history), 'history_tokens': history_info['tokens'],
+                               'first_event_s': first_event_at, 'prediction_s': prediction_seconds})
 
             # --- Handle Actions --- 
 
             # 1. Request Tool Execution from Frontend
             if action in ["zoom", "get_map_summary"]:
+                if tool_call_sent:
+                    return
                 tool_name = action
                 tool_args = {}
                 if tool_name == 'zoom':
                     try:
                         tool_args = json.loads(action_input_str or "{}")
                     except json.JSONDecodeError as json_e:
-                        print(f"Error parsing zoom tool arguments JSON: {json_e}, Input: {action_input_str}")
+                        logger.error(f"Error parsing zoom tool arguments JSON: {json_e}, Input: {action_input_str}")
                         error_payload = json.dumps({"type": "error", "content": f"Agent returned invalid zoom arguments: {action_input_str}"}) + delimiter
                         yield error_payload
                         return # Stop processing on error
@@ -123,47 +305,30 @@ async def stream_chat(request: ChatRequest):
                 }
                 yield json.dumps(payload) + delimiter
                 response_generated = True
-                print(f"Yielded Tool Call Request: {payload}")
+                logger.debug(f"Yielded Tool Call Request: {payload}")
                 # Stop processing here, wait for frontend to send back result in next request
 
-            # 2. Generate Final Answer (potentially using tool_result implicitly via agent.forward)
+            # 2. Final Answer, already streamed token by token above
             elif action == 'final_answer':
                 answer_text = action_input_str
-                # Stream the final answer text
-                words = answer_text.split()
-                if not words:
-                    payload = {"type": "text", "content": ""}
+                if not streamed_text:
+                    # Nothing was streamed, e.g. the LM answer came from DSPy's cache
+                    payload = {"type": "text", "content": answer_text or ""}
                     yield json.dumps(payload) + delimiter
-                    response_generated = True
-                else:
-                    for i, word in enumerate(words):
-                        content = word + (" " if i < len(words) - 1 else "")
-                        payload = {"type": "text", "content": content}
-                        yield json.dumps(payload) + delimiter
-                        await asyncio.sleep(0.05)
-                    response_generated = True
-                print(f"Yielded Final Answer: {answer_text}")
+                response_generated = True
+                logger.debug(f"Yielded Final Answer: {answer_text}")
 
             # 3. Fallback/Direct Answer (if agent structure differs)
             elif hasattr(prediction, 'answer'):
                  answer_text = prediction.answer
-                 print(f"Agent gave direct answer (fallback): {answer_text}")
-                 words = answer_text.split()
-                 if not words:
-                     payload = {"type": "text", "content": ""}
-                     yield json.dumps(payload) + delimiter
-                     response_generated = True
-                 else:
-                    for i, word in enumerate(words):
-                        content = word + (" " if i < len(words) - 1 else "")
-                        payload = {"type": "text", "content": content}
-                        yield json.dumps(payload) + delimiter
-                        await asyncio.sleep(0.05)
-                    response_generated = True
+                 logger.info(f"Agent gave direct answer (fallback): {answer_text}")
+                 payload = {"type": "text", "content": answer_text or ""}
+                 yield json.dumps(payload) + delimiter
+                 response_generated = True
 
             # 4. Handle unexpected predictions
             else:
-                print(f"Warning: Agent prediction structure unexpected or no action taken: {prediction}")
+                logger.warning(f"Agent prediction structure unexpected or no action taken: {prediction}")
                 # Optionally send a generic response or error
                 # For now, do nothing if no clear action/answer
                 if not response_generated:
@@ -172,9 +337,7 @@ async def stream_chat(request: ChatRequest):
                     response_generated = True
 
         except Exception as e:
-            print(f"Error during agent execution/stream: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Error during agent execution/stream: {e}")
             error_payload = json.dumps({"type": "error", "content": f"Error processing request: {str(e)}"}) + delimiter
             yield error_payload
 
@@ -182,61 +345,390 @@ async def stream_chat(request: ChatRequest):
 
 # --- New Endpoint for Geolocation Data ---
 @app.post("/api/data/geo")
-async def get_geo_data(request: GeoQueryRequest):
+async def get_geo_data(request: GeoQueryRequest, http_request: Request):
     """
     API endpoint to fetch data from ClickHouse based on geographical coordinates.
+    The query runs on the ClickHouse pool and is killed if the client disconnects.
+
+    The response format is taken from the request's `format` field or the Accept
+    header: records (default JSON list of objects), columns, ndjson or arrow.
     """
-    print(f"Received geo query: Lat({request.min_lat}, {request.max_lat}), Lon({request.min_lon}, {request.max_lon}), Table: {request.table}")
+    logger.info(f"Received geo query: Lat({request.min_lat}, {request.max_lat}), Lon({request.min_lon}, {request.max_lon}), Table: {request.table}, Mode: {request.mode}, Window: ({request.start_time}, {request.end_time})")
     try:
-        # Call the data loading function
-        df = load_data_by_geolocation(
-            min_lat=request.min_lat,
-            max_lat=request.max_lat,
-            min_lon=request.min_lon,
-            max_lon=request.max_lon,
-            table=request.table
-            # Client is handled internally by load_data_by_geolocation if not passed
-        )
+        check_table(request.table)
+        fmt = negotiate_format(request.format, http_request.headers.get('accept'))
+        bbox = (request.min_lat, request.max_lat, request.min_lon, request.max_lon)
+        # Snap the bbox to the tile grid so nearby pans share a cache entry, then
+        # crop the cached result back down. Needs LAT/LON in the projection, and
+        # only works for every ping: in 'latest' mode the larger box may hold a
+        # vessel's latest ping outside the requested one, and the crop drops it.
+        snap = request.mode == 'all' and (not request.columns or {'LAT', 'LON'} <= set(request.columns))
+        # Columnar formats read ClickHouse's Arrow output directly
+        load_fn = load_data_by_geolocation if fmt == 'records' else load_arrow_by_geolocation
+
+        async def load(grid_key, query_bbox):
+            cache_key = ('geo', request.table, grid_key, request.start_time, request.end_time, request.mode,
+                         tuple(request.columns or ()), request.limit, load_fn.__name__)
+            return await geo_cache.get_or_load(
+                cache_key, request.table,
+                lambda: db_pool.run(
+                    load_fn, min_lat=query_bbox[0], max_lat=query_bbox[1], min_lon=query_bbox[2], max_lon=query_bbox[3],
+                    table=request.table, limit=request.limit, start_time=request.start_time,
+                    end_time=request.end_time, mode=request.mode, columns=request.columns
+                ),
+                is_disconnected=http_request.is_disconnected
+            )
+
+        if snap:
+            result = await load(*snap_bbox(*bbox))
+            if request.limit and len(result) >= request.limit:
+                # The limit cut the snapped bbox short, so its crop may lack rows
+                # of the requested one. Those are only complete queried exactly.
+                snap = False
+            else:
+                result = crop_to_bbox(result, *bbox)
+        if not snap:
+            result = await load(bbox, bbox)
+
+        if fmt != 'records':
+            # Encode off the event loop
+            body = await asyncio.to_thread(encode, fmt, result)
+            logger.info(f"Successfully retrieved {result.num_rows} records as {fmt} ({len(body)} bytes).")
+            return Response(content=body, media_type=MEDIA_TYPES[fmt])
+
+        # clean_records modifies the frame in place, never hand it the cached one
+        df = result.copy()
 
         if df.empty:
             # Return 204 No Content if no data found for the criteria
             # Alternatively, return an empty list: return []
             # Raising HTTPException might be too strong if "no data" is a valid outcome
-             print("No data found for the specified geolocation.")
+             logger.info("No data found for the specified geolocation.")
              return [] # Return empty list for no data found
 
-        # --- Data Cleaning --- 
-        # Replace infinity values with NaN
-        df.replace([np.inf, -np.inf], np.nan, inplace=True)
-        # Replace NaN values with None (which becomes null in JSON)
-        # Important: Operate on a copy if you need the original df elsewhere
-        # df = df.where(pd.notnull(df), None) # This converts non-NaNs to objects, slower
-        # More efficient: Iterate through columns and fillna if needed
-        for col in df.select_dtypes(include=np.number).columns:
-             if df[col].isnull().any():
-                  # Use fillna which preserves dtype more often
-                  df[col] = df[col].fillna(np.nan).astype(object).where(df[col].notnull(), None)
-        # Handle potential NaT in datetime columns if necessary
-        for col in df.select_dtypes(include=['datetime64[ns]', 'datetime64[ns, UTC]']).columns:
-            if df[col].isnull().any():
-                # Convert NaT to None before JSON serialization
-                df[col] = df[col].astype(object).where(df[col].notnull(), None)
-        # ---------------------
-
-        # Convert DataFrame to list of dictionaries (JSON serializable)
-        # Using orient='records' is generally correct here
-        data = df.to_dict(orient='records')
-        print(f"Successfully retrieved and cleaned {len(data)} records.")
-        return data
+        # --- Data Cleaning ---
+        with span('clean', 'records', rows=len(df)):
+            data = clean_records(df)
+        # Encoded here rather than by FastAPI so serialization shows up as its own stage
+        with span('serialize', 'records', rows=len(data)):
+            body = json.dumps(jsonable_encoder(data), ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+        RESPONSE_BYTES.labels('records').observe(len(body))
+        logger.info(f"Successfully retrieved and cleaned {len(data)} records.")
+        return Response(content=body, media_type='application/json')
 
+    except ValueError as e:
+        # Invalid mode or column projection
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueryCancelledError as e:
+        # Nobody is listening anymore, 499 is the de facto "client closed request"
+        logger.info(f"Geo query cancelled: {e}")
+        return Response(status_code=499)
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DatabaseError as e:
+        logger.error(f"ClickHouse error in geo query: {e}")
+        raise HTTPException(status_code=502, detail=f"ClickHouse query failed: {e}")
     except Exception as e:
-        print(f"Error processing geo data request: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error processing geo data request: {e}")
         # Raise an HTTP exception for internal server errors
         raise HTTPException(status_code=500, detail=f"Error fetching data: {str(e)}")
 
 
+@app.post("/api/data/geo/stream")
+async def stream_geo_data(request: GeoQueryRequest, http_request: Request):
+    """
+    Streaming variant of /api/data/geo for large extracts. Rows are sent as
+    NDJSON (default) or Arrow record batches as ClickHouse produces blocks,
+    so memory stays constant regardless of the result size. Set limit to 0
+    to stream the full result.
+    """
+    logger.info(f"Received geo stream query: Lat({request.min_lat}, {request.max_lat}), Lon({request.min_lon}, {request.max_lon}), Table: {request.table}, Mode: {request.mode}, Window: ({request.start_time}, {request.end_time})")
+    query_args = dict(
+        min_lat=request.min_lat,
+        max_lat=request.max_lat,
+        min_lon=request.min_lon,
+        max_lon=request.max_lon,
+        table=request.table,
+        limit=request.limit,
+        start_time=request.start_time,
+        end_time=request.end_time,
+        mode=request.mode,
+        columns=request.columns
+    )
+    try:
+        check_table(request.table)
+        fmt = request.format or negotiate_format(accept=http_request.headers.get('accept'))
+        if fmt == 'records' and request.format is None:
+            fmt = 'ndjson' # Streams default to NDJSON rather than one JSON array
+        encoder = StreamEncoder(fmt)
+        # Validate mode/columns before the response starts
+        build_geo_query(**query_args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def encode_block(block) -> bytes:
+        with span('serialize', fmt, rows=block.num_rows):
+            return encoder.encode(block)
+
+    async def block_stream():
+        # aclosing makes sure the query is stopped as soon as Starlette stops
+        # iterating, e.g. when the client disconnects
+        sent = 0
+        async with aclosing(db_pool.stream(stream_arrow_by_geolocation, **query_args)) as blocks:
+            async for block in blocks:
+                chunk = await asyncio.to_thread(encode_block, block)
+                sent += len(chunk)
+                yield chunk
+        tail = encoder.finish()
+        yield tail
+        RESPONSE_BYTES.labels(fmt).observe(sent + len(tail))
+        logger.info(f"Finished streaming {encoder.rows} records as {fmt}.")
+
+    return StreamingResponse(block_stream(), media_type=MEDIA_TYPES[fmt])
+
+@app.post("/api/data/track")
+async def get_track_data(request: TrackQueryRequest, http_request: Request):
+    """
+    Trajectories of one or more vessels, fetched in a single query and
+    simplified with Douglas-Peucker to what is visible at the requested zoom,
+    so a day of 1 Hz pings comes back as a few hundred points per vessel.
+
+    Responds with one polyline per vessel ('tracks', the default) or the flat
+    table of kept points in any /api/data/geo format other than records.
+    """
+    logger.info(f"Received track query: {len(request.mmsis)} MMSIs, Table: {request.table}, Zoom: {request.zoom}, Window: ({request.start_time}, {request.end_time})")
+    try:
+        check_table(request.table)
+        fmt = request.format or 'tracks'
+        query_args = dict(
+            mmsis=request.mmsis,
+            table=request.table,
+            start_time=request.start_time,
+            end_time=request.end_time,
+            columns=request.columns
+        )
+        # Validate before taking a connection
+        build_track_query(**query_args)
+        # Raw tracks are cached, so zooming only re-runs the simplification
+        cache_key = ('track', request.table, tuple(sorted(set(request.mmsis))), request.start_time,
+                     request.end_time, tuple(request.columns or ()))
+        raw = await geo_cache.get_or_load(
+            cache_key, request.table,
+            lambda: db_pool.run(load_tracks, **query_args),
+            is_disconnected=http_request.is_disconnected
+        )
+
+        def simplify_and_encode():
+            with span('simplify', 'tracks', rows=raw.num_rows):
+                simplified, info = simplify_tracks(raw, zoom=request.zoom, tolerance_px=request.tolerance_px)
+            body = encode(fmt, simplified, info)
+            return simplified.num_rows, body
+
+        kept, body = await asyncio.to_thread(simplify_and_encode)
+        logger.info(f"Simplified {raw.num_rows} track points to {kept} ({fmt}, {len(body)} bytes).")
+        return Response(content=body, media_type=MEDIA_TYPES.get(fmt, 'application/json'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueryCancelledError as e:
+        logger.info(f"Track query cancelled: {e}")
+        return Response(status_code=499)
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DatabaseError as e:
+        logger.error(f"ClickHouse error in track query: {e}")
+        raise HTTPException(status_code=502, detail=f"ClickHouse query failed: {e}")
+
+@app.get("/api/tiles/{z}/{x}/{y}")
+async def get_tile(z: int, x: int, y: int, http_request: Request, table: str = 'ais_data',
+                   start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                   format: Optional[Literal['arrow', 'columns']] = None):
+    """
+    Zoom-aware vessel tile for the map. Below TILE_RAW_MIN_ZOOM the tile holds
+    grid-binned aggregates computed in ClickHouse (vessel count, dominant
+    VesselType, mean SOG per cell), above it the latest raw positions. Either
+    way the payload per screen stays roughly constant. Responds with an Arrow
+    IPC stream unless the columns JSON format is requested.
+    """
+    logger.info(f"Received tile request: {z}/{x}/{y}, Table: {table}, Window: ({start_time}, {end_time})")
+    try:
+        check_table(table)
+        fmt = format or negotiate_format(accept=http_request.headers.get('accept'))
+        if fmt not in ('arrow', 'columns'):
+            fmt = 'arrow'
+
+        async def load_encoded_tile():
+            tile = await db_pool.run(load_tile, z, x, y, table=table, start_time=start_time, end_time=end_time)
+            return await asyncio.to_thread(encode, fmt, tile)
+
+        body = await geo_cache.get_or_load(
+            ('tile', table, z, x, y, start_time, end_time, fmt), table,
+            load_encoded_tile, is_disconnected=http_request.is_disconnected
+        )
+        kind = 'raw' if z >= TILE_RAW_MIN_ZOOM else 'aggregate'
+        return Response(content=body, media_type=MEDIA_TYPES[fmt], headers={'X-Tile-Kind': kind})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueryCancelledError as e:
+        logger.info(f"Tile query cancelled: {e}")
+        return Response(status_code=499)
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DatabaseError as e:
+        logger.error(f"ClickHouse error in tile query: {e}")
+        raise HTTPException(status_code=502, detail=f"ClickHouse query failed: {e}")
+
+@app.websocket("/api/live")
+async def live_vessels(websocket: WebSocket):
+    """
+    Live vessel positions for the client's viewport. The client sends a
+    viewport message whenever the map moves and receives a snapshot, then
+    deltas of new, moved and expired vessels. See live.py for the messages.
+    """
+    await websocket.accept()
+    subscriber = live_feed.subscribe(websocket.send_text)
+    logger.info(f"Live subscriber connected ({len(live_feed.subscribers)} total)")
+    try:
+        while True:
+            try:
+                message = LiveViewportMessage.model_validate(await websocket.receive_json())
+                live_feed.set_viewport(subscriber, message.min_lat, message.max_lat, message.min_lon, message.max_lon,
+                                       table=check_table(message.table))
+            except (ValidationError, ValueError) as e:
+                # json errors are ValueErrors too, a bad message doesn't end the subscription
+                await websocket.send_json({'type': 'error', 'detail': str(e)})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_feed.unsubscribe(subscriber)
+        logger.info(f"Live subscriber disconnected ({len(live_feed.subscribers)} left)")
+
+def require_imagery():
+    if rasterio is None:
+        raise HTTPException(status_code=503, detail="Imagery needs rasterio: pip install rasterio")
+
+@app.get("/api/imagery/scenes")
+async def get_imagery_scenes(min_lat: float = -90, max_lat: float = 90, min_lon: float = -180, max_lon: float = 180):
+    """Footprints, acquisition times and resolution of the indexed scenes overlapping a bbox, newest first."""
+    require_imagery()
+    await asyncio.to_thread(imagery_index.refresh)
+    return [scene.to_dict() for scene in imagery_index.search(min_lat, max_lat, min_lon, max_lon)]
+
+@app.get("/api/imagery/tiles/{z}/{x}/{y}.png")
+async def get_imagery_tile(z: int, x: int, y: int, http_request: Request):
+    """
+    Satellite imagery tile (RGBA PNG) mosaicked from the local scenes, newest
+    on top, read from the overview level matching the zoom. 204 where no
+    scene has data.
+    """
+    require_imagery()
+    try:
+        async def load_imagery_tile():
+            with span('imagery', 'tile'):
+                return await asyncio.to_thread(render_tile, imagery_index, z, x, y)
+
+        body = await imagery_cache.get_or_load(('imagery', z, x, y), 'imagery', load_imagery_tile,
+                                               is_disconnected=http_request.is_disconnected)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueryCancelledError:
+        return Response(status_code=499)
+    if body is None:
+        return Response(status_code=204)
+    RESPONSE_BYTES.labels('png').observe(len(body))
+    return Response(content=body, media_type='image/png')
+
+@app.post("/api/imagery/chips")
+async def get_imagery_chips(request: ImageryChipRequest):
+    """
+    Image chips of the vessels in a bbox, cropped from every scene that
+    covers part of it. Vessels are placed where their AIS reports put them at
+    the scene's acquisition time (or request.time), interpolated between the
+    reports around it. Chips are PNG data URLs.
+    """
+    require_imagery()
+    try:
+        check_table(request.table)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"Received imagery chip request: Lat({request.min_lat}, {request.max_lat}), Lon({request.min_lon}, {request.max_lon}), Time: {request.time}")
+    await asyncio.to_thread(imagery_index.refresh)
+    scenes = imagery_index.search(request.min_lat, request.max_lat, request.min_lon, request.max_lon)
+    scenes = [scene for scene in scenes if request.time or scene.acquired][:request.max_scenes]
+
+    async def chips_of(scene):
+        s_min_lat, s_max_lat, s_min_lon, s_max_lon = scene.bounds
+        vessels = await db_pool.run(
+            load_vessels_at, max(request.min_lat, s_min_lat), min(request.max_lat, s_max_lat),
+            max(request.min_lon, s_min_lon), min(request.max_lon, s_max_lon), request.time or scene.acquired,
+            table=request.table, limit=request.limit
+        )
+        if vessels.num_rows == 0:
+            return []
+        with span('imagery', 'chips', scene=scene.id, vessels=vessels.num_rows):
+            images = await asyncio.to_thread(render_chips, scene, vessels, request.size_m, request.pixels)
+        acquired = scene.acquired.isoformat() if scene.acquired else None
+        return [
+            {**vessel, 'scene': scene.id, 'acquired': acquired,
+             'image': 'data:image/png;base64,' + base64.b64encode(image).decode('ascii')}
+            for vessel, image in zip(mask_non_finite(vessels).to_pylist(), images) if image is not None
+        ]
+
+    try:
+        chips = [chip for scene_chips in await asyncio.gather(*(chips_of(scene) for scene in scenes))
+                 for chip in scene_chips]
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DatabaseError as e:
+        logger.error(f"ClickHouse error in imagery chip query: {e}")
+        raise HTTPException(status_code=502, detail=f"ClickHouse query failed: {e}")
+    logger.info(f"Cropped {len(chips)} vessel chips from {len(scenes)} scenes.")
+    return {'scenes': [scene.to_dict() for scene in scenes], 'chips': chips}
+
+@app.post("/api/data/query")
+async def query_data(request: DataQuestionRequest):
+    """
+    Answers a plain language question about the AIS data with SQL written by
+    the data steward, the same tool the chat agent uses for query_data.
+    Returns the SQL, its estimated cost and a summary of the result.
+    """
+    logger.info(f"Received data question: {request.question}")
+    if not steward:
+        raise HTTPException(status_code=503, detail="Data steward not configured. Check server logs.")
+    try:
+        answer = await steward.answer(request.question, db_pool)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {**answer, 'plan_cache': steward.plans.stats()}
+
+@app.get("/api/chat/cache/stats")
+async def get_chat_cache_stats():
+    """Hit/miss counters and size of the agent's prediction cache."""
+    if not agent or not agent.prediction_cache:
+        raise HTTPException(status_code=503, detail="Agent not configured. Check server logs.")
+    return agent.prediction_cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per route and per stage latency, ClickHouse rows/bytes read, LLM latency and tokens."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Hit/miss/eviction counters and memory use of the geo/tile result cache."""
+    return geo_cache.stats()
+
+@app.get("/api/imagery/stats")
+async def get_imagery_stats():
+    """Indexed scenes and the hit/miss/eviction counters of the imagery tile cache."""
+    return {'scenes': len(imagery_index.scenes), 'index_version': imagery_index.version, 'tile_cache': imagery_cache.stats()}
+
+@app.get("/api/live/stats")
+async def get_live_stats():
+    """Subscribers, ticks, shared queries and messages sent by the live feed."""
+    return live_feed.stats()
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
     host = os.getenv("HOST", "0.0.0.0")
@@ -0,0 +1,216 @@
+"""
+Versioned schema migrations for the ais_data table.
+
+Applied versions are recorded per table in `schema_migrations`, so running
+the command again only applies what is missing.
+
+Usage (from the ai/ directory):
+    python migrate.py --status
+    python migrate.py                 # apply everything pending
+    python migrate.py --target 1      # stop at a given version
+    python migrate.py --dry-run       # print the SQL instead of running it
+"""
+import argparse
+from typing import List, Optional
+
+from data import AIS_COLUMNS, get_clickhouse_client
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+# v1: the table as originally created by ingest/ingest_ais_2024_01_01.py
+AIS_TABLE_V1 = '''
+CREATE TABLE IF NOT EXISTS {table} (
+    MMSI UInt32,
+    BaseDateTime DateTime64(3, 'UTC'),
+    LAT Float64,
+    LON Float64,
+    SOG Float32,
+    COG Float32,
+    Heading UInt16,
+    VesselName String,
+    IMO String,
+    CallSign String,
+    VesselType UInt16,
+    Status UInt8,
+    Length Float32,
+    Width Float32,
+    Draft Float32,
+    Cargo Float32,
+    TransceiverClass String
+) ENGINE = MergeTree()
+ORDER BY (BaseDateTime, MMSI)
+'''
+
+# v2: spatially sorted. Rows are clustered by a Morton (Z-order) code of
+# 16-bit quantized LON/LAT, so each granule covers a small area and the
+# LAT/LON minmax indexes can skip everything outside a bbox. Days are
+# partitions, so time windows prune whole parts. The by_mmsi projection
+# keeps a copy ordered for per-vessel track lookups.
+AIS_TABLE_V2 = '''
+CREATE TABLE {table} (
+    MMSI UInt32,
+    BaseDateTime DateTime64(3, 'UTC'),
+    LAT Float64,
+    LON Float64,
+    SOG Float32,
+    COG Float32,
+    Heading UInt16,
+    VesselName String,
+    IMO String,
+    CallSign LowCardinality(String),
+    VesselType UInt16,
+    Status UInt8,
+    Length Float32,
+    Width Float32,
+    Draft Float32,
+    Cargo Float32,
+    TransceiverClass LowCardinality(String),
+    MortonCode UInt64 MATERIALIZED mortonEncode(
+        toUInt16(least(greatest((LON + 180) / 360, 0), 1) * 65535),
+        toUInt16(least(greatest((LAT + 90) / 180, 0), 1) * 65535)
+    ),
+    INDEX idx_lat LAT TYPE minmax GRANULARITY 1,
+    INDEX idx_lon LON TYPE minmax GRANULARITY 1,
+    INDEX idx_time BaseDateTime TYPE minmax GRANULARITY 1,
+    PROJECTION by_mmsi (
+        SELECT * ORDER BY (MMSI, BaseDateTime)
+    )
+) ENGINE = MergeTree()
+PARTITION BY toDate(BaseDateTime)
+ORDER BY (MortonCode, MMSI, BaseDateTime)
+'''
+
+class Migration:
+    """A schema version and the statements that produce it from the previous one."""
+
+    def __init__(self, version: int, description: str, statements: List[str]):
+        self.version = version
+        self.description = description
+        self.statements = statements
+
+    def sql(self, table: str) -> List[str]:
+        return [statement.format(table=table, columns=", ".join(AIS_COLUMNS)) for statement in self.statements]
+
+MIGRATIONS = [
+    Migration(1, "Initial ais_data table", [AIS_TABLE_V1]),
+    Migration(2, "Day partitions, Morton sort key, LAT/LON minmax indexes, LowCardinality strings, MMSI projection", [
+        # Rebuild into a new table and swap it in, keeping the old data as a backup
+        "DROP TABLE IF EXISTS {table}_migrating",
+        AIS_TABLE_V2.replace('{table}', '{table}_migrating'),
+        "INSERT INTO {table}_migrating ({columns}) SELECT {columns} FROM {table}",
+        "RENAME TABLE {table} TO {table}_v1_backup, {table}_migrating TO {table}",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# DDL creating each version from scratch, used for fresh installs
+CREATE_STATEMENTS = {1: AIS_TABLE_V1, 2: AIS_TABLE_V2}
+
+def _ensure_migrations_table(client):
+    client.command(f'''
+    CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+        table_name String,
+        version UInt32,
+        description String,
+        applied_at DateTime DEFAULT now()
+    ) ENGINE = MergeTree()
+    ORDER BY (table_name, version)
+    ''')
+
+def current_version(client, table: str = 'ais_data') -> int:
+    """Returns the newest applied migration version for a table, 0 if none."""
+    _ensure_migrations_table(client)
+    version = client.command(
+        f"SELECT max(version) FROM {MIGRATIONS_TABLE} WHERE table_name = %(table)s",
+        parameters={'table': table}
+    )
+    version = int(version or 0)
+    if version == 0 and int(client.command(f"EXISTS TABLE {table}")) == 1:
+        # Created by the original ingest script, before migrations were tracked
+        return 1
+    return version
+
+class SchemaOutdatedError(RuntimeError):
+    """The table exists at an older schema version and needs `python migrate.py`."""
+
+def ensure_schema(client = None, table: str = 'ais_data') -> int:
+    """
+    Makes sure a table is at the latest schema version before writing to it.
+    A missing table is created at the latest version. An outdated one is left
+    alone: migrating rebuilds it with a full copy, which has to be a
+    deliberate step.
+
+    Returns:
+        int: The table's schema version.
+
+    Raises:
+        SchemaOutdatedError: If the table needs migrating first.
+    """
+    if client is None:
+        client = get_clickhouse_client()
+    version = current_version(client, table)
+    if version == 0:
+        return migrate(client, table)
+    if version < LATEST_VERSION:
+        raise SchemaOutdatedError(
+            f"{table} is at schema version {version}, latest is {LATEST_VERSION}. "
+            f"Migrate it first with: python migrate.py --table {table}"
+        )
+    return version
+
+def migrate(client = None, table: str = 'ais_data', target: Optional[int] = None, dry_run: bool = False) -> int:
+    """
+    Applies pending migrations to a table, up to target (default: latest).
+
+    Returns:
+        int: The version the table is at afterwards.
+    """
+    if client is None:
+        client = get_clickhouse_client()
+    target = LATEST_VERSION if target is None else target
+    version = current_version(client, table)
+    if version == 0:
+        # Fresh install, create the target schema directly instead of rebuilding
+        migrations = [Migration(target, MIGRATIONS[target - 1].description, [CREATE_STATEMENTS[target]])]
+    else:
+        migrations = MIGRATIONS
+    for migration in migrations:
+        if migration.version <= version or migration.version > target:
+            continue
+        print(f"Applying migration {migration.version} to {table}: {migration.description}")
+        for statement in migration.sql(table):
+            if dry_run:
+                print(statement.strip() + ";\n")
+            else:
+                client.command(statement)
+        if not dry_run:
+            client.insert(
+                MIGRATIONS_TABLE,
+                [[table, migration.version, migration.description]],
+                column_names=['table_name', 'version', 'description']
+            )
+        version = migration.version
+    return version
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default='ais_data')
+    parser.add_argument('--target', type=int, default=None, help="Version to migrate to (default: latest)")
+    parser.add_argument('--status', action='store_true', help="Only print the current and latest version")
+    parser.add_argument('--dry-run', action='store_true', help="Print the SQL without running it")
+    args = parser.parse_args()
+
+    client = get_clickhouse_client()
+    version = current_version(client, args.table)
+    print(f"{args.table} is at schema version {version}, latest is {LATEST_VERSION}.")
+    if args.status:
+        return
+    if version >= (args.target or LATEST_VERSION):
+        print("Nothing to do.")
+        return
+    version = migrate(client, args.table, target=args.target, dry_run=args.dry_run)
+    print(f"{args.table} is now at schema version {version}.")
+
+if __name__ == '__main__':
+    main()
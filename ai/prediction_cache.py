@@ -0,0 +1,221 @@
+import logging
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Keys holding coordinates in tool results, matched on the lowercased key
+_COORDINATE_KEYS = ('lat', 'lon', 'lng', 'latitude', 'longitude')
+
+def _is_coordinate_key(key: str) -> bool:
+    key = str(key).lower()
+    return any(key == name or key.endswith('_' + name) for name in _COORDINATE_KEYS)
+
+def bucket_coordinates(value: Any, decimals: int, coordinate: bool = False) -> Any:
+    """
+    Rounds the numbers under coordinate keys (lat, LON, min_lat, center.lng, ...)
+    of a nested tool result to decimals places, so results for almost the same
+    place hash alike. 3 decimals is about 100 m.
+    """
+    if isinstance(value, dict):
+        return {k: bucket_coordinates(v, decimals, coordinate or _is_coordinate_key(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [bucket_coordinates(v, decimals, coordinate) for v in value]
+    if coordinate and isinstance(value, float):
+        return round(value, decimals)
+    return value
+
+def signature_fingerprint(signature) -> str:
+    """The instructions and field descriptions of a DSPy signature, changing either changes every key."""
+    fields = [(name, field.json_schema_extra.get('desc')) for name, field in signature.fields.items()]
+    return json.dumps([signature.instructions, fields])
+
+class PredictionCache:
+    """
+    Cache of LM predictions, keyed on a hash of the model, the signature and
+    the canonical inputs: an in-memory LRU in front of a SQLite file, so
+    answers survive restarts. Entries expire after a TTL; the file is pruned
+    back to its size limit, least recently used first.
+
+    Numbers under coordinate keys of the tool result can be rounded before
+    hashing (coordinate_decimals), so a map summary of nearly the same view
+    reuses the previous answer.
+
+    Settings are read from the environment unless given explicitly:
+        PREDICTION_CACHE_PATH: SQLite file, empty to keep the cache in memory only (default .cache/predictions.sqlite).
+        PREDICTION_CACHE_MAX_ENTRIES: Entries kept in memory (default 1024).
+        PREDICTION_CACHE_MAX_DISK_ENTRIES: Entries kept in the SQLite file (default 100000).
+        PREDICTION_CACHE_TTL: Seconds an entry stays valid (default 86400).
+        PREDICTION_CACHE_COORDINATE_DECIMALS: Decimals kept of tool result coordinates, unset for exact matches.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None,
+                 max_disk_entries: Optional[int] = None, ttl: Optional[float] = None,
+                 coordinate_decimals: Optional[int] = None):
+        self.path = path if path is not None else os.getenv('PREDICTION_CACHE_PATH', '.cache/predictions.sqlite')
+        self.max_entries = max_entries or int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', 1024))
+        self.max_disk_entries = max_disk_entries or int(os.getenv('PREDICTION_CACHE_MAX_DISK_ENTRIES', 100_000))
+        self.ttl = ttl or float(os.getenv('PREDICTION_CACHE_TTL', 86400))
+        if coordinate_decimals is None and os.getenv('PREDICTION_CACHE_COORDINATE_DECIMALS'):
+            coordinate_decimals = int(os.getenv('PREDICTION_CACHE_COORDINATE_DECIMALS'))
+        self.coordinate_decimals = coordinate_decimals
+
+        # key -> (fields, expires_at), wall clock so it matches the file
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._puts_since_prune = 0
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'disk_errors': 0,
+        }
+        if self.path:
+            self._open()
+
+    def _open(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Predictions are made from worker threads as well as the event loop
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, fields TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS predictions_used_at ON predictions (used_at)")
+            logger.info(f"Prediction cache persisted to {self.path}")
+        except sqlite3.Error as e:
+            # The memory LRU still works without the file
+            logger.error(f"Error opening prediction cache at {self.path}: {e}")
+            self._db = None
+
+    def key(self, model: str, signature: str, inputs: dict) -> str:
+        """
+        Hashes the model, the signature fingerprint and the inputs. Inputs may
+        be nested (e.g. tool_result as a dict); dict order doesn't matter.
+        """
+        if self.coordinate_decimals is not None and inputs.get('tool_result'):
+            inputs = {**inputs, 'tool_result': bucket_coordinates(inputs['tool_result'], self.coordinate_decimals)}
+        canonical = json.dumps([model, signature, inputs], sort_keys=True, default=str, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Returns the cached prediction fields for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] >= now:
+                    self._entries.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return entry[0]
+                del self._entries[key]
+                self.counters['expirations'] += 1
+            fields = self._disk_get(key, now)
+            if fields is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self._remember(key, fields[0], fields[1])
+            return fields[0]
+
+    def put(self, key: str, fields: dict):
+        """Stores prediction fields (JSON serializable) for key."""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, fields, expires_at)
+            self.counters['stores'] += 1
+            self._disk_put(key, fields, expires_at)
+
+    def _remember(self, key: str, fields: dict, expires_at: float):
+        self._entries[key] = (fields, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT fields, expires_at FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._db.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                self.counters['expirations'] += 1
+                return None
+            self._db.execute("UPDATE predictions SET used_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0]), row[1]
+        except (sqlite3.Error, ValueError) as e:
+            self.counters['disk_errors'] += 1
+            logger.error(f"Error reading prediction cache: {e}")
+            return None
+
+    def _disk_put(self, key: str, fields: dict, expires_at: float):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO predictions (key, fields, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(fields), expires_at, time.time())
+            )
+            # Pruning scans the table, do it once per batch of writes
+            self._puts_since_prune += 1
+            if self._puts_since_prune >= 100:
+                self._puts_since_prune = 0
+                self._prune()
+        except sqlite3.Error as e:
+            self.counters['disk_errors'] += 1
+            logger.error(f"Error writing prediction cache: {e}")
+
+    def _prune(self):
+        self._db.execute("DELETE FROM predictions WHERE expires_at < ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM predictions WHERE key IN "
+            "(SELECT key FROM predictions ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def _disk_entries(self) -> Optional[int]:
+        if self._db is None:
+            return None
+        try:
+            return self._db.execute("SELECT count(*) FROM predictions").fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters and current usage."""
+        with self._lock:
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            lookups = hits + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'disk_entries': self._disk_entries(),
+                'coordinate_decimals': self.coordinate_decimals,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,395 @@
+"""
+Data steward: answers data questions by generating ClickHouse SQL over ais_data
+and the ais_events table written by analytics.py.
+
+Literals in the question (numbers, dates, quoted strings) are lifted out into
+query parameters before the LLM sees it, so the SQL it writes is a template
+for the question's shape. Templates that use every parameter are cached per
+shape, and the next question differing only in its values skips the LLM.
+
+Every query is validated (a single read-only SELECT without a SETTINGS
+clause, reading only the allowed tables as listed by EXPLAIN AST), costed with
+EXPLAIN ESTIMATE and refused if it would read more than
+STEWARD_MAX_ROWS_TO_READ rows, then run with readonly=1, which keeps the query
+from changing the max_rows_to_read, max_execution_time and result row cap
+enforced by ClickHouse. Results are summarized before they are handed back to
+the agent's prompt.
+"""
+import asyncio
+import math
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import dspy
+
+from analytics import ANALYTICS_EVENTS_TABLE
+from data import get_clickhouse_client
+from db import PoolTimeoutError, QueryCancelledError
+
+logger = logging.getLogger(__name__)
+
+# Queries estimated to read more rows than this are refused before they run
+STEWARD_MAX_ROWS_TO_READ = int(os.getenv('STEWARD_MAX_ROWS_TO_READ', 200_000_000))
+STEWARD_MAX_EXECUTION_TIME = int(os.getenv('STEWARD_MAX_EXECUTION_TIME', 15))
+# Rows returned by ClickHouse at most, the rest is cut off
+STEWARD_MAX_RESULT_ROWS = int(os.getenv('STEWARD_MAX_RESULT_ROWS', 10_000))
+# Rows included verbatim in a result summary
+STEWARD_SUMMARY_ROWS = int(os.getenv('STEWARD_SUMMARY_ROWS', 20))
+# Question shapes kept in the plan cache
+STEWARD_PLAN_CACHE_SIZE = int(os.getenv('STEWARD_PLAN_CACHE_SIZE', 512))
+# Tables generated SQL may read
+STEWARD_TABLES = ('ais_data', ANALYTICS_EVENTS_TABLE)
+
+SCHEMA = f"""Table ais_data, one row per AIS position report (ClickHouse):
+    MMSI UInt32              vessel identifier
+    BaseDateTime DateTime64(3, 'UTC')   report time
+    LAT Float64, LON Float64 position in degrees
+    SOG Float32              speed over ground, knots
+    COG Float32              course over ground, degrees
+    Heading UInt16           true heading, degrees (511 = not available)
+    VesselName String, IMO String, CallSign String
+    VesselType UInt16        AIS ship type: 30 fishing, 31/32/52 tug, 35 military, 36 sailing, 37 pleasure,
+                             60-69 passenger, 70-79 cargo, 80-89 tanker
+    Status UInt8             navigational status: 0 under way, 1 at anchor, 5 moored, 7 fishing
+    Length Float32, Width Float32, Draft Float32   metres
+    Cargo Float32
+    TransceiverClass String  'A' or 'B'
+Sorted by a spatial key and partitioned by day; filter on LAT/LON and BaseDateTime whenever possible.
+
+Table {ANALYTICS_EVENTS_TABLE}, vessel behaviour events detected by analytics.py (ClickHouse):
+    EventType LowCardinality(String)   'gap' (AIS silence), 'loitering' (slow within a small radius),
+                             'rendezvous' (two vessels slow and close together)
+    MMSI UInt32, OtherMMSI UInt32      vessel(s) involved, OtherMMSI is 0 unless rendezvous
+    StartTime DateTime64(3, 'UTC'), EndTime DateTime64(3, 'UTC')
+    LAT Float64, LON Float64 where the event happened (gap: position after the silence)
+    DurationSeconds UInt32
+    DistanceMeters Float32   gap: distance between the pings around it, rendezvous: mean separation,
+                             loitering: largest distance from the centre
+    Pings UInt32             reports within the event
+Events are updated in place as they grow, always read it with FINAL: FROM {ANALYTICS_EVENTS_TABLE} FINAL."""
+
+_FORBIDDEN_STATEMENT = re.compile(
+    r"\b(INSERT|ALTER|DROP|TRUNCATE|CREATE|RENAME|DETACH|ATTACH|OPTIMIZE|GRANT|REVOKE|KILL|SYSTEM|SET|SETTINGS|USE|DELETE|UPDATE|OUTFILE)\b",
+    re.IGNORECASE
+)
+_FORBIDDEN_FUNCTION = re.compile(
+    r"\b(url|file|remote|remoteSecure|cluster|s3|hdfs|mysql|postgresql|jdbc|odbc|executable|input|joinGet\w*|dict\w*)\s*\(",
+    re.IGNORECASE
+)
+_CTE_NAME = re.compile(r"\b(\w+)\s+AS\s*\(", re.IGNORECASE)
+# Functions whose second argument may name a table, e.g. MMSI IN other_table
+_IN_FUNCTIONS = {'in', 'notIn', 'globalIn', 'globalNotIn', 'nullIn', 'notNullIn', 'globalNullIn', 'globalNotNullIn'}
+_PLACEHOLDER = re.compile(r"\{(\w+):[^{}]+\}")
+
+# Literals lifted out of questions: quoted strings, dates with optional time, numbers
+_LITERAL = re.compile(
+    r"""(?P<str>'[^']*'|"[^"]*")"""
+    r"""|(?P<date>\b\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?\b)"""
+    r"""|(?P<num>(?<![\w.])-?\d+(?:\.\d+)?(?![\w.]))"""
+)
+
+def normalize_question(question: str) -> Tuple[str, Dict[str, object], Dict[str, str]]:
+    """
+    Lifts literals out of a question.
+
+    Returns:
+        Tuple: (shape, values, types). The shape is the lowercased question with
+        each literal replaced by its parameter name, e.g. "vessels faster than
+        {p0} knots"; values and types map parameter names to the literal and its
+        ClickHouse type.
+    """
+    values, types = {}, {}
+
+    def lift(match):
+        name = f"p{len(values)}"
+        if match.group('str'):
+            values[name], types[name] = match.group('str')[1:-1], 'String'
+        elif match.group('date'):
+            text = match.group('date').replace('T', ' ')
+            try:
+                parsed = datetime.fromisoformat(text) if ':' in text else datetime.combine(date.fromisoformat(text), datetime.min.time())
+            except ValueError:
+                # Date shaped but not a date (e.g. 2024-13-45), kept as text for the LLM
+                return match.group(0)
+            values[name], types[name] = parsed.replace(tzinfo=timezone.utc), "DateTime64(3, 'UTC')"
+        else:
+            text = match.group('num')
+            if '.' in text:
+                values[name], types[name] = float(text), 'Float64'
+            else:
+                values[name], types[name] = int(text), 'Int64'
+        return f"{{{name}}}"
+
+    shape = _LITERAL.sub(lift, question.strip())
+    shape = re.sub(r"\s+", " ", shape).lower().rstrip('?.! ')
+    return shape, values, types
+
+def validate_sql(sql: str, types: Dict[str, str], tables=STEWARD_TABLES) -> str:
+    """
+    Checks that generated SQL is one read-only SELECT using only known
+    {name:Type} parameters. The tables it reads are checked by check_tables.
+
+    Returns:
+        str: The SQL without trailing semicolons or code fences.
+
+    Raises:
+        ValueError: If the SQL is not acceptable.
+    """
+    sql = re.sub(r"^```(?:sql)?|```$", "", sql.strip(), flags=re.IGNORECASE).strip().rstrip(';').strip()
+    if not re.match(r"^(SELECT|WITH)\b", sql, re.IGNORECASE):
+        raise ValueError("Only SELECT queries are allowed")
+    if ';' in sql:
+        raise ValueError("Only a single statement is allowed")
+    forbidden = _FORBIDDEN_STATEMENT.search(sql) or _FORBIDDEN_FUNCTION.search(sql)
+    if forbidden:
+        raise ValueError(f"Forbidden keyword or table function: {forbidden.group(1)}")
+    for name in _PLACEHOLDER.findall(sql):
+        if name not in types:
+            raise ValueError(f"Unknown query parameter '{name}'")
+    return sql
+
+def _ast_tree(lines: List[str]) -> list:
+    """EXPLAIN AST output, one node per line indented by depth, as nested [text, children] lists."""
+    root = ['', []]
+    stack = [(-1, root)]
+    for line in lines:
+        depth = len(line) - len(line.lstrip(' '))
+        node = [re.sub(r"\s+\(children \d+\)$", "", line.strip()), []]
+        while stack[-1][0] >= depth:
+            stack.pop()
+        stack[-1][1][1].append(node)
+        stack.append((depth, node))
+    return root[1]
+
+def _table_references(nodes: list) -> List[str]:
+    """Every table a query reads: FROM/JOIN tables at any depth, table functions as 'name(...)', and IN tables."""
+    tables = []
+    for text, children in nodes:
+        kind, _, rest = text.partition(' ')
+        if kind == 'TableExpression':
+            for child_text, _ in children:
+                child_kind, _, name = child_text.partition(' ')
+                if child_kind == 'TableIdentifier':
+                    tables.append(name.split(' (alias')[0])
+                elif child_kind == 'Function':
+                    tables.append(f"{name.split(' ')[0]}(...)")
+        elif kind == 'Function' and rest.split(' ')[0] in _IN_FUNCTIONS and children:
+            arguments = children[0][1]
+            if len(arguments) == 2 and arguments[1][0].startswith('Identifier '):
+                tables.append(arguments[1][0].split(' ')[1])
+        tables.extend(_table_references(children))
+    return tables
+
+def check_tables(sql: str, params: dict, client = None, settings: Optional[dict] = None, tables=STEWARD_TABLES):
+    """
+    Checks every table the query reads, including comma joins, subqueries
+    and IN operands, against the allowed tables using ClickHouse's own parse
+    of it (EXPLAIN AST). CTE names may be read as well, table functions and
+    tables in other databases may not.
+
+    Raises:
+        ValueError: If the query reads a table that is not allowed.
+    """
+    if client is None:
+        client = get_clickhouse_client()
+    result = client.query(f"EXPLAIN AST {sql}", parameters=params, settings=settings)
+    ctes = set(_CTE_NAME.findall(sql))
+    for table in _table_references(_ast_tree([row[0] for row in result.result_rows])):
+        if table not in tables and table not in ctes:
+            raise ValueError(f"Table '{table}' is not allowed, use one of {list(tables)}")
+
+def explain_estimate(sql: str, params: dict, client = None, settings: Optional[dict] = None) -> int:
+    """Returns the number of rows ClickHouse estimates the query will read (from EXPLAIN ESTIMATE)."""
+    if client is None:
+        client = get_clickhouse_client()
+    result = client.query(f"EXPLAIN ESTIMATE {sql}", parameters=params, settings=settings)
+    rows = result.column_names.index('rows')
+    return sum(int(row[rows]) for row in result.result_rows)
+
+def run_query(sql: str, params: dict, client = None, settings: Optional[dict] = None) -> Tuple[List[str], List[tuple], bool]:
+    """
+    Runs a validated query with the steward's limits enforced by ClickHouse.
+
+    Returns:
+        Tuple: (column names, rows, truncated).
+    """
+    if client is None:
+        client = get_clickhouse_client()
+    settings = {
+        **(settings or {}),
+        # Unlike readonly=2, settings can't be changed from within the query
+        'readonly': 1,
+        'max_rows_to_read': STEWARD_MAX_ROWS_TO_READ,
+        'max_execution_time': min(STEWARD_MAX_EXECUTION_TIME, (settings or {}).get('max_execution_time') or STEWARD_MAX_EXECUTION_TIME),
+        'max_result_rows': STEWARD_MAX_RESULT_ROWS,
+        'result_overflow_mode': 'break',
+    }
+    result = client.query(sql, parameters=params, settings=settings)
+    rows = result.result_rows
+    return list(result.column_names), rows, len(rows) >= STEWARD_MAX_RESULT_ROWS
+
+def _json_value(value):
+    if isinstance(value, float):
+        return round(value, 6) if math.isfinite(value) else None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if value is None or isinstance(value, (int, str, bool)):
+        return value
+    return str(value)
+
+def summarize_rows(columns: List[str], rows: List[tuple], truncated: bool = False, max_rows: int = STEWARD_SUMMARY_ROWS) -> dict:
+    """
+    Condenses a query result for the prompt: small results are returned as is,
+    larger ones as their first max_rows rows plus per-column statistics
+    (min/max/mean for numbers, distinct count and most common values otherwise).
+    """
+    summary = {
+        'row_count': len(rows),
+        'truncated': truncated,
+        'columns': columns,
+        'rows': [[_json_value(v) for v in row] for row in rows[:max_rows]],
+    }
+    if len(rows) <= max_rows:
+        return summary
+    stats = {}
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows if row[i] is not None]
+        numbers = [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)]
+        if numbers and len(numbers) == len(values):
+            stats[column] = {'min': _json_value(min(numbers)), 'max': _json_value(max(numbers)),
+                             'mean': _json_value(sum(numbers) / len(numbers))}
+        elif values and all(isinstance(v, (datetime, date)) for v in values):
+            stats[column] = {'min': _json_value(min(values)), 'max': _json_value(max(values))}
+        else:
+            counts = {}
+            for v in values:
+                key = _json_value(v)
+                key = str(key) if isinstance(key, list) else key
+                counts[key] = counts.get(key, 0) + 1
+            top = sorted(counts.items(), key=lambda item: -item[1])[:5]
+            stats[column] = {'distinct': len(counts), 'top': [[k, n] for k, n in top]}
+    summary['column_stats'] = stats
+    return summary
+
+class TextToSQLSignature(dspy.Signature):
+    """Write one ClickHouse SELECT query answering the question over the given schema.
+    Use the listed query parameters as {name:Type} placeholders instead of their literal values.
+    Aggregate in SQL where possible and always LIMIT row-level results."""
+    table_schema = dspy.InputField(desc="The tables and columns available.")
+    question = dspy.InputField(desc="The question, with literal values replaced by {parameter} names.")
+    parameters = dspy.InputField(desc="The query parameters: name, ClickHouse type and example value.")
+    previous_error = dspy.InputField(desc="(Optional) The previous attempt at this query and why it was rejected.")
+
+    sql = dspy.OutputField(desc="A single ClickHouse SELECT statement using {name:Type} placeholders, no trailing semicolon.")
+
+class PlanCache:
+    """LRU cache of question shape -> SQL template."""
+
+    def __init__(self, max_entries: int = STEWARD_PLAN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._plans: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, shape: str) -> Optional[str]:
+        sql = self._plans.get(shape)
+        if sql is None:
+            self.misses += 1
+            return None
+        self._plans.move_to_end(shape)
+        self.hits += 1
+        return sql
+
+    def put(self, shape: str, sql: str):
+        self._plans[shape] = sql
+        self._plans.move_to_end(shape)
+        while len(self._plans) > self.max_entries:
+            self._plans.popitem(last=False)
+
+    def discard(self, shape: str):
+        self._plans.pop(shape, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'entries': len(self._plans), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+class DataSteward:
+    """
+    Answers data questions with generated SQL, see the module docstring. The
+    LLM call runs in a worker thread and the queries on the ClickHouse pool,
+    so a pool connection is only held while ClickHouse works.
+    """
+
+    def __init__(self, max_attempts: int = 2):
+        self.generate = dspy.Predict(TextToSQLSignature)
+        self.plans = PlanCache()
+        self.max_attempts = max_attempts
+
+    def _generate_sql(self, shape: str, values: dict, types: dict, previous_error: str) -> str:
+        parameters = "\n".join(f"{name}: {types[name]} (e.g. {values[name]})" for name in values) or "(none)"
+        prediction = self.generate(table_schema=SCHEMA, question=shape, parameters=parameters, previous_error=previous_error)
+        return prediction.sql
+
+    async def answer(self, question: str, pool) -> dict:
+        """
+        Answers a question with one query.
+
+        Args:
+            question: The data question in plain language.
+            pool: The ClickHousePool to run the queries on.
+
+        Returns:
+            dict: {'question', 'sql', 'cached', 'estimated_rows', 'result'} with the
+            summarized result, or {'question', 'sql', 'error'} if no acceptable
+            query was produced.
+        """
+        shape, values, types = normalize_question(question)
+        sql = self.plans.get(shape)
+        cached = sql is not None
+        error = None
+        rejected_sql = None
+        previous_error = ""
+        for attempt in range(self.max_attempts):
+            if sql is None:
+                sql = await asyncio.to_thread(self._generate_sql, shape, values, types, previous_error)
+            try:
+                sql = validate_sql(sql, types)
+                await pool.run(check_tables, sql, values)
+                estimated_rows = await pool.run(explain_estimate, sql, values)
+                if estimated_rows > STEWARD_MAX_ROWS_TO_READ:
+                    raise ValueError(f"Query would read about {estimated_rows:,} rows, more than the "
+                                     f"{STEWARD_MAX_ROWS_TO_READ:,} allowed. Filter on time, area or MMSI.")
+                columns, rows, truncated = await pool.run(run_query, sql, values)
+            except (QueryCancelledError, PoolTimeoutError):
+                raise
+            except Exception as e:
+                logger.warning(f"Steward query rejected (attempt {attempt + 1}): {e}")
+                if cached:
+                    # A cached plan that stopped working is regenerated
+                    self.plans.discard(shape)
+                    cached = False
+                rejected_sql, error = sql, str(e)
+                previous_error = f"SQL: {sql}\nError: {error}"
+                sql = None
+                continue
+            # Only fully parameterized SQL is valid for other values of the same shape
+            if not cached and all(re.search(r"\{" + name + r":", sql) for name in values):
+                self.plans.put(shape, sql)
+            logger.info(f"Steward answered '{shape}' with {len(rows)} rows (cached plan: {cached}).")
+            return {
+                'question': question,
+                'sql': sql,
+                'cached': cached,
+                'estimated_rows': estimated_rows,
+                'result': summarize_rows(columns, rows, truncated),
+            }
+        return {'question': question, 'sql': rejected_sql, 'error': error}
@@ -0,0 +1,145 @@
+import logging
+import os
+from datetime import datetime
+from typing import Optional, Tuple
+
+from data import build_geo_query, get_clickhouse_client
+
+logger = logging.getLogger(__name__)
+
+# Vessels listed per ranking (biggest, fastest) in a map summary
+SUMMARY_TOP_K = int(os.getenv('SUMMARY_TOP_K', 3))
+# Vessels slower than this (knots) are counted as stationary
+SUMMARY_MOVING_SOG = 0.5
+
+# AIS navigational status codes
+NAV_STATUS = {
+    0: 'under way using engine',
+    1: 'at anchor',
+    2: 'not under command',
+    3: 'restricted manoeuvrability',
+    4: 'constrained by draught',
+    5: 'moored',
+    6: 'aground',
+    7: 'engaged in fishing',
+    8: 'under way sailing',
+    14: 'AIS-SART',
+    15: 'not defined',
+}
+
+def vessel_type_category(code: int) -> str:
+    """Maps an AIS ship type code to its category name."""
+    if code == 30:
+        return 'fishing'
+    if code in (31, 32, 52):
+        return 'towing/tug'
+    if code == 35:
+        return 'military'
+    if code == 36:
+        return 'sailing'
+    if code == 37:
+        return 'pleasure craft'
+    if code in (50, 51, 53, 54, 55, 58):
+        return 'service (pilot, SAR, port, law enforcement, medical)'
+    if 40 <= code <= 49:
+        return 'high speed craft'
+    if 60 <= code <= 69:
+        return 'passenger'
+    if 70 <= code <= 79:
+        return 'cargo'
+    if 80 <= code <= 89:
+        return 'tanker'
+    return 'other/unknown'
+
+def build_map_summary_query(min_lat: float, max_lat: float, min_lon: float, max_lon: float, table: str = 'ais_data',
+                            start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                            top_k: int = SUMMARY_TOP_K) -> Tuple[str, dict]:
+    """
+    Builds a single aggregate over the latest position of every vessel in a
+    bbox: vessel count, moving count and mean SOG, the top_k biggest
+    (Length x Width) and fastest vessels, the smallest vessel with known
+    dimensions, and histograms of VesselType and Status.
+
+    Returns:
+        Tuple[str, dict]: The query string and its parameters.
+    """
+    latest, params = build_geo_query(
+        min_lat, max_lat, min_lon, max_lon, table=table, limit=0,
+        start_time=start_time, end_time=end_time, mode='latest',
+        columns=['MMSI', 'VesselName', 'VesselType', 'Status', 'SOG', 'Length', 'Width', 'LAT', 'LON']
+    )
+    # Tuples sort on their first element, the ranking key
+    vessel = "MMSI, VesselName, VesselType, Length, Width, SOG, LAT, LON"
+    query = f"""
+    SELECT
+        count() AS vessels,
+        countIf(SOG >= %(moving_sog)s) AS moving,
+        avgIf(SOG, isFinite(SOG)) AS mean_sog,
+        arraySlice(arrayReverseSort(groupArray(tuple(Length * Width, {vessel}))), 1, %(top_k)s) AS biggest,
+        arraySlice(arrayReverseSort(groupArrayIf(tuple(SOG, {vessel}), isFinite(SOG) AND SOG < 102.3)), 1, %(top_k)s) AS fastest,
+        arraySlice(arraySort(groupArrayIf(tuple(Length * Width, {vessel}), Length > 0 AND Width > 0)), 1, 1) AS smallest,
+        sumMap([VesselType], [toUInt64(1)]) AS vessel_types,
+        sumMap([Status], [toUInt64(1)]) AS statuses
+    FROM ({latest})
+    """
+    params.update({'top_k': int(top_k), 'moving_sog': SUMMARY_MOVING_SOG})
+    return query, params
+
+def _vessel(row: tuple) -> dict:
+    mmsi, name, vessel_type, length, width, sog, lat, lon = row[1:]
+    return {
+        'MMSI': mmsi,
+        'VesselName': name or None,
+        'VesselType': vessel_type_category(vessel_type),
+        'Length': round(length, 1),
+        'Width': round(width, 1),
+        'SOG': round(sog, 1),
+        'LAT': round(lat, 5),
+        'LON': round(lon, 5),
+    }
+
+def load_map_summary(min_lat: float, max_lat: float, min_lon: float, max_lon: float, table: str = 'ais_data', client = None,
+                     start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                     top_k: int = SUMMARY_TOP_K, settings: Optional[dict] = None) -> dict:
+    """
+    Summarizes the vessels in a map viewport with one ClickHouse query, see
+    build_map_summary_query. The result is compact enough to hand to the LLM
+    as a tool result.
+
+    Returns:
+        dict: The summary.
+
+    Raises:
+        Exception: If the ClickHouse query fails, so an outage doesn't read as an empty map.
+    """
+    query, params = build_map_summary_query(
+        min_lat, max_lat, min_lon, max_lon, table=table,
+        start_time=start_time, end_time=end_time, top_k=top_k
+    )
+
+    if client is None:
+        client = get_clickhouse_client()
+
+    logger.debug(f"Querying map summary from {table} within bounding box: LAT({min_lat}, {max_lat}), LON({min_lon}, {max_lon})")
+    result = client.query(query, parameters=params, settings=settings)
+    row = dict(zip(result.column_names, result.result_rows[0]))
+
+    vessel_types = {}
+    for code, count in zip(*row['vessel_types']):
+        category = vessel_type_category(code)
+        vessel_types[category] = vessel_types.get(category, 0) + count
+    statuses = {NAV_STATUS.get(code, f"reserved ({code})"): count for code, count in zip(*row['statuses'])}
+    mean_sog = row['mean_sog']
+    summary = {
+        'count': row['vessels'],
+        'bounds': {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon},
+        'moving': row['moving'],
+        'mean_sog': round(mean_sog, 1) if mean_sog == mean_sog else None,
+        'biggestShips': [_vessel(v) for v in row['biggest']],
+        'fastestShips': [_vessel(v) for v in row['fastest']],
+        'smallestShip': _vessel(row['smallest'][0]) if row['smallest'] else None,
+        'vesselTypes': dict(sorted(vessel_types.items(), key=lambda item: -item[1])),
+        'navigationalStatus': dict(sorted(statuses.items(), key=lambda item: -item[1])),
+    }
+    logger.debug(f"Summarized {summary['count']} vessels.")
+    return summary
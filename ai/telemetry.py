@@ -0,0 +1,259 @@
+"""
+Metrics, tracing and logging shared by the API modules.
+
+Stages of a request (connection acquire, query, cleaning, serialization, LLM
+calls) are timed with span(), which feeds the Prometheus histograms served
+on /metrics and, when OpenTelemetry is configured, opens a trace span.
+Log records carry the id of the request they were written for.
+
+Settings are read from the environment:
+    LOG_LEVEL: Root log level (default INFO).
+    LOG_FORMAT: 'text' (default) or 'json', one object per line.
+    OTEL_EXPORTER_OTLP_ENDPOINT: Export spans over OTLP to this endpoint. Needs
+        opentelemetry-sdk and opentelemetry-exporter-otlp; without it spans
+        only go to whatever tracer provider is already installed.
+    OTEL_SERVICE_NAME: Service name on exported spans (default adam-api).
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from prometheus_client import Counter, Histogram
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+# Id of the HTTP request being handled, set by RequestContextMiddleware
+request_id_var: ContextVar[str] = ContextVar('request_id', default='-')
+
+# Latencies range from sub-millisecond cache hits to LLM answers of a minute
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(10 ** i for i in range(1, 10))
+
+HTTP_SECONDS = Histogram(
+    'adam_http_request_duration_seconds', "HTTP request latency until the last body byte is sent",
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    'adam_stage_duration_seconds', "Latency of one stage of a request",
+    ['stage', 'operation'], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    'adam_stage_errors_total', "Stages that raised", ['stage', 'operation']
+)
+CLICKHOUSE_READ_ROWS = Counter(
+    'adam_clickhouse_read_rows_total', "Rows ClickHouse read to answer queries, from the query summary", ['operation']
+)
+CLICKHOUSE_READ_BYTES = Counter(
+    'adam_clickhouse_read_bytes_total', "Bytes ClickHouse read to answer queries, from the query summary", ['operation']
+)
+RESULT_ROWS = Histogram(
+    'adam_query_result_rows', "Rows returned by a query", ['operation'], buckets=SIZE_BUCKETS
+)
+RESULT_BYTES = Histogram(
+    'adam_query_result_bytes', "In-memory size of a query result", ['operation'], buckets=SIZE_BUCKETS
+)
+RESPONSE_BYTES = Histogram(
+    'adam_response_bytes', "Size of an encoded response body", ['format'], buckets=SIZE_BUCKETS
+)
+LLM_SECONDS = Histogram(
+    'adam_llm_request_duration_seconds', "LLM call latency", ['model', 'status'], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    'adam_llm_tokens_total', "Tokens sent to and generated by the LLM", ['model', 'type']
+)
+
+_tracer = trace.get_tracer(__name__) if trace is not None else None
+
+@contextmanager
+def span(stage: str, operation: str = '', **attributes):
+    """
+    Times the enclosed block as one stage of the current request.
+
+    The duration goes to adam_stage_duration_seconds{stage, operation}, a
+    failure also to adam_stage_errors_total. attributes are attached to the
+    trace span and the debug log line, keep them out of metric labels.
+    """
+    start = time.perf_counter()
+    otel_span = _tracer.start_as_current_span(stage, attributes={'operation': operation, **attributes}) if _tracer else None
+    try:
+        if otel_span is not None:
+            with otel_span:
+                yield
+        else:
+            yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage, operation).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage, operation).observe(elapsed)
+        logger.debug(f"{stage} {operation} took {elapsed * 1000:.1f}ms",
+                     extra={'stage': stage, 'operation': operation, 'duration_ms': round(elapsed * 1000, 3), **attributes})
+
+def record_query_result(operation: str, result: Any):
+    """
+    Records what a query read and returned. The read rows/bytes come from
+    ClickHouse's query summary, which clickhouse_connect only exposes on
+    QueryResult (client.query); for Arrow and DataFrame results the size of
+    the result itself is recorded.
+    """
+    summary = getattr(result, 'summary', None)
+    if summary:
+        CLICKHOUSE_READ_ROWS.labels(operation).inc(int(summary.get('read_rows', 0)))
+        CLICKHOUSE_READ_BYTES.labels(operation).inc(int(summary.get('read_bytes', 0)))
+    rows = getattr(result, 'num_rows', None)
+    if rows is None and hasattr(result, 'result_rows'):
+        rows = len(result.result_rows)
+    elif rows is None and hasattr(result, 'memory_usage'):
+        rows = len(result)
+    if rows is not None:
+        RESULT_ROWS.labels(operation).observe(rows)
+    nbytes = getattr(result, 'nbytes', None)
+    if nbytes is None and hasattr(result, 'memory_usage'):
+        nbytes = int(result.memory_usage(deep=False).sum())
+    if nbytes is not None:
+        RESULT_BYTES.labels(operation).observe(nbytes)
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware giving every HTTP request an id (the client's X-Request-ID
+    or a new one), echoed in the response and attached to its log records,
+    and recording its latency by route template so paths like tile
+    coordinates don't become separate series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        request_id = ''
+        for name, value in scope.get('headers', ()):
+            if name == b'x-request-id':
+                # Bounded so clients can't flood the logs
+                request_id = value.decode('latin-1')[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = list(message.get('headers', ())) + [(b'x-request-id', request_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = scope.get('route')
+            HTTP_SECONDS.labels(scope['method'], getattr(route, 'path', 'unmatched'), str(status)).observe(
+                time.perf_counter() - start)
+            request_id_var.reset(token)
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request id to every record as record.request_id."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+# LogRecord attributes that aren't extra= fields
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including any extra= fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """Configures the root logger from LOG_LEVEL and LOG_FORMAT."""
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    fmt = fmt or os.getenv('LOG_FORMAT', 'text')
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+def setup_tracing():
+    """Exports spans over OTLP if OTEL_EXPORTER_OTLP_ENDPOINT is set and the SDK is installed."""
+    if not os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT'):
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk or opentelemetry-exporter-otlp "
+                       "is not installed, spans are not exported.")
+        return
+    provider = TracerProvider(resource=Resource.create({'service.name': os.getenv('OTEL_SERVICE_NAME', 'adam-api')}))
+    # The exporter reads the endpoint and headers from the OTEL_ environment
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    logger.info(f"Exporting traces to {os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT')}")
+
+def instrument_llm():
+    """
+    Records latency and token usage of every DSPy LM call. Latency comes
+    from DSPy's LM callbacks, tokens from a usage tracker that feeds the
+    counters instead of keeping entries. DSPy cache hits report no tokens.
+    """
+    import dspy
+    from dspy.utils.callback import BaseCallback
+    from dspy.utils.usage_tracker import UsageTracker
+
+    class LMMetrics(BaseCallback):
+        def __init__(self):
+            self._calls = {}
+
+        def on_lm_start(self, call_id, instance, inputs):
+            self._calls[call_id] = (getattr(instance, 'model', 'unknown'), time.perf_counter())
+
+        def on_lm_end(self, call_id, outputs, exception=None):
+            model, start = self._calls.pop(call_id, ('unknown', None))
+            if start is None:
+                return
+            elapsed = time.perf_counter() - start
+            LLM_SECONDS.labels(model, 'error' if exception else 'ok').observe(elapsed)
+            logger.debug(f"LM call to {model} took {elapsed:.2f}s", extra={'model': model, 'duration_ms': round(elapsed * 1000, 3)})
+
+    class TokenCounter(UsageTracker):
+        def add_usage(self, lm: str, usage_entry: dict):
+            for kind in ('prompt', 'completion'):
+                tokens = usage_entry.get(f"{kind}_tokens")
+                if isinstance(tokens, (int, float)):
+                    LLM_TOKENS.labels(lm, kind).inc(tokens)
+
+    callbacks = [cb for cb in dspy.settings.callbacks if type(cb).__name__ != 'LMMetrics']
+    dspy.settings.configure(callbacks=callbacks + [LMMetrics()], usage_tracker=TokenCounter())
@@ -0,0 +1,136 @@
+import math
+import logging
+import os
+from datetime import datetime
+from typing import Optional, Tuple
+
+import pyarrow as pa
+
+from data import build_geo_query, get_clickhouse_client
+
+logger = logging.getLogger(__name__)
+
+# Zoom level from which tiles carry raw latest positions instead of aggregates
+TILE_RAW_MIN_ZOOM = int(os.getenv('TILE_RAW_MIN_ZOOM', 10))
+# Aggregate tiles are binned into TILE_GRID x TILE_GRID cells (8px cells on a 512px tile)
+TILE_GRID = int(os.getenv('TILE_GRID', 64))
+# Upper bound on raw positions returned for one tile
+TILE_MAX_FEATURES = int(os.getenv('TILE_MAX_FEATURES', 20000))
+# Columns sent for raw positions, enough to draw and label a vessel marker
+TILE_RAW_COLUMNS = ['MMSI', 'BaseDateTime', 'LAT', 'LON', 'SOG', 'COG', 'Heading', 'VesselName', 'VesselType', 'Length', 'Width']
+
+MAX_MERCATOR_LAT = 85.0511287798
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    Returns the (min_lat, max_lat, min_lon, max_lon) of a Web Mercator (XYZ) tile.
+
+    Raises:
+        ValueError: If the tile does not exist at zoom z.
+    """
+    n = 2 ** z
+    if z < 0 or not (0 <= x < n and 0 <= y < n):
+        raise ValueError(f"Tile {z}/{x}/{y} is out of range")
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    min_lon = x / n * 360.0 - 180.0
+    max_lon = (x + 1) / n * 360.0 - 180.0
+    return lat(y + 1), lat(y), min_lon, max_lon
+
+def lonlat_to_tile(lat: float, lon: float, z: int) -> Tuple[int, int]:
+    """Returns the (x, y) of the zoom z tile containing a point, clamped to the map."""
+    n = 2 ** z
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def snap_bbox(min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> Tuple[Tuple[int, int, int, int, int], Tuple[float, float, float, float]]:
+    """
+    Expands a bbox outwards to the tiles covering it, at a zoom where the bbox
+    spans a handful of tiles. Nearby pans and zooms then share the same snapped
+    box, which makes it usable as a cache key.
+
+    Returns:
+        Tuple: ((z, x0, y0, x1, y1), (min_lat, max_lat, min_lon, max_lon)) of the snapped box.
+    """
+    span = max(max_lon - min_lon, 1e-6)
+    z = min(max(int(math.floor(math.log2(360.0 / span))) + 2, 0), 20)
+    x0, y0 = lonlat_to_tile(max_lat, min_lon, z)
+    x1, y1 = lonlat_to_tile(min_lat, max_lon, z)
+    snapped_min_lat = tile_bounds(z, x0, y1)[0]
+    snapped_max_lat = tile_bounds(z, x0, y0)[1]
+    snapped_min_lon = tile_bounds(z, x0, y0)[2]
+    snapped_max_lon = tile_bounds(z, x1, y0)[3]
+    # Tiles stop at the Mercator limit, keep any polar part of the original box
+    snapped_min_lat = min(snapped_min_lat, min_lat)
+    snapped_max_lat = max(snapped_max_lat, max_lat)
+    return (z, x0, y0, x1, y1), (snapped_min_lat, snapped_max_lat, snapped_min_lon, snapped_max_lon)
+
+def build_tile_query(z: int, x: int, y: int, table: str = 'ais_data',
+                     start_time: Optional[datetime] = None, end_time: Optional[datetime] = None) -> Tuple[str, dict]:
+    """
+    Builds the query for one map tile.
+
+    Below TILE_RAW_MIN_ZOOM the latest position of every vessel in the tile is
+    binned into a TILE_GRID x TILE_GRID Mercator grid and each non-empty cell
+    returns its vessel count, dominant VesselType, mean SOG and centroid.
+    From TILE_RAW_MIN_ZOOM on the latest positions are returned as is.
+
+    Returns:
+        Tuple[str, dict]: The query string and its parameters.
+    """
+    min_lat, max_lat, min_lon, max_lon = tile_bounds(z, x, y)
+    if z >= TILE_RAW_MIN_ZOOM:
+        return build_geo_query(
+            min_lat, max_lat, min_lon, max_lon, table=table, limit=TILE_MAX_FEATURES,
+            start_time=start_time, end_time=end_time, mode='latest', columns=TILE_RAW_COLUMNS
+        )
+
+    latest, params = build_geo_query(
+        min_lat, max_lat, min_lon, max_lon, table=table, limit=0,
+        start_time=start_time, end_time=end_time, mode='latest',
+        columns=['MMSI', 'LAT', 'LON', 'SOG', 'VesselType']
+    )
+    # Position inside the tile in grid cells, using the same Mercator
+    # projection as the map so cells line up with pixels. Points a hair
+    # outside the tile are clamped to its edge cells, a negative cell would
+    # wrap around to 65535 in the cast.
+    cell_x = "(LON + 180) / 360 * %(tile_n)s - %(tile_x)s"
+    cell_y = "(1 - log(tan(radians(LAT)) + 1 / cos(radians(LAT))) / pi()) / 2 * %(tile_n)s - %(tile_y)s"
+    query = f"""
+    SELECT
+        least(toUInt16(greatest(floor(({cell_x}) * %(grid)s), 0)), %(grid)s - 1) AS cell_x,
+        least(toUInt16(greatest(floor(({cell_y}) * %(grid)s), 0)), %(grid)s - 1) AS cell_y,
+        count() AS vessels,
+        topK(1)(VesselType)[1] AS dominant_vessel_type,
+        avg(SOG) AS mean_sog,
+        avg(LAT) AS center_lat,
+        avg(LON) AS center_lon
+    FROM ({latest})
+    GROUP BY cell_x, cell_y
+    """
+    params.update({'tile_n': 2 ** z, 'tile_x': x, 'tile_y': y, 'grid': TILE_GRID})
+    return query, params
+
+def load_tile(z: int, x: int, y: int, table: str = 'ais_data', client = None,
+              start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+              settings: Optional[dict] = None) -> pa.Table:
+    """
+    Loads one map tile as an Arrow table, see build_tile_query for its contents.
+
+    Errors are raised like the geo loaders' rather than returned as an empty
+    tile, which the tile cache would keep for its whole TTL.
+
+    Returns:
+        pa.Table: Aggregated cells or raw latest positions for the tile.
+    """
+    query, params = build_tile_query(z, x, y, table=table, start_time=start_time, end_time=end_time)
+
+    if client is None:
+        client = get_clickhouse_client()
+
+    logger.debug(f"Querying tile {z}/{x}/{y} from {table} ({'raw' if z >= TILE_RAW_MIN_ZOOM else 'aggregated'})")
+    arrow_table = client.query_arrow(query, parameters=params, settings=settings, use_strings=True)
+    logger.debug(f"Successfully loaded {arrow_table.num_rows} tile features.")
+    return arrow_table
@@ -0,0 +1,194 @@
+import json
+import math
+import logging
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+from data import AIS_COLUMNS, get_clickhouse_client
+from formats import _json_ready
+from tiles import MAX_MERCATOR_LAT
+
+logger = logging.getLogger(__name__)
+
+# Most vessels one track request may ask for
+TRACK_MAX_MMSIS = int(os.getenv('TRACK_MAX_MMSIS', 500))
+# Viewport width in pixels assumed when picking a zoom for requests without one
+TRACK_VIEWPORT_PX = int(os.getenv('TRACK_VIEWPORT_PX', 1024))
+# Columns returned per track point by default
+TRACK_COLUMNS = ['MMSI', 'BaseDateTime', 'LAT', 'LON', 'SOG', 'COG']
+
+TILE_SIZE = 256
+
+def build_track_query(mmsis: List[int], table: str = 'ais_data', start_time: Optional[datetime] = None,
+                      end_time: Optional[datetime] = None, columns: Optional[List[str]] = None) -> Tuple[str, dict]:
+    """
+    Builds one query returning the pings of all requested vessels, ordered by
+    MMSI and time. Filtering and sorting on (MMSI, BaseDateTime) lets
+    ClickHouse answer it from the by_mmsi projection.
+
+    Returns:
+        Tuple[str, dict]: The query string and its parameters.
+
+    Raises:
+        ValueError: If no or too many MMSIs are given, or a column is unknown.
+    """
+    if not mmsis:
+        raise ValueError("At least one MMSI is required")
+    if len(mmsis) > TRACK_MAX_MMSIS:
+        raise ValueError(f"At most {TRACK_MAX_MMSIS} MMSIs per request, got {len(mmsis)}")
+    columns = list(columns or TRACK_COLUMNS)
+    unknown = [c for c in columns if c not in AIS_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {unknown}")
+    # Simplification needs the vessel, time and position of every point
+    for required in reversed(['MMSI', 'BaseDateTime', 'LAT', 'LON']):
+        if required not in columns:
+            columns.insert(0, required)
+
+    where = "MMSI IN %(mmsis)s"
+    params = {'mmsis': sorted(set(int(m) for m in mmsis))}
+    if start_time is not None:
+        where += " AND BaseDateTime >= %(start_time)s"
+        params['start_time'] = start_time
+    if end_time is not None:
+        where += " AND BaseDateTime <= %(end_time)s"
+        params['end_time'] = end_time
+    query = f"""
+    SELECT {", ".join(columns)}
+    FROM {table}
+    WHERE {where}
+    ORDER BY MMSI, BaseDateTime
+    """
+    return query, params
+
+def load_tracks(mmsis: List[int], table: str = 'ais_data', client = None, start_time: Optional[datetime] = None,
+                end_time: Optional[datetime] = None, columns: Optional[List[str]] = None,
+                settings: Optional[dict] = None) -> pa.Table:
+    """
+    Loads the raw pings of one or more vessels as an Arrow table, sorted by MMSI and time.
+
+    Returns:
+        pa.Table: One row per ping.
+    """
+    query, params = build_track_query(mmsis, table=table, start_time=start_time, end_time=end_time, columns=columns)
+
+    if client is None:
+        client = get_clickhouse_client()
+
+    logger.debug(f"Querying tracks of {len(params['mmsis'])} vessels from {table}, Window: ({start_time}, {end_time})")
+    arrow_table = client.query_arrow(query, parameters=params, settings=settings, use_strings=True)
+    logger.debug(f"Successfully loaded {arrow_table.num_rows} track points.")
+    return arrow_table
+
+def project(lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Web Mercator projection to the unit square, the map's world coordinates."""
+    lat = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    x = (lon + 180.0) / 360.0
+    y = (1 - np.arcsinh(np.tan(lat)) / np.pi) / 2
+    return x, y
+
+def pixel_tolerance(zoom: float, tolerance_px: float = 1.0) -> float:
+    """Returns tolerance_px screen pixels at a zoom level in world (unit square) units."""
+    return tolerance_px / (TILE_SIZE * 2 ** zoom)
+
+def fit_zoom(x: np.ndarray, y: np.ndarray, viewport_px: int = TRACK_VIEWPORT_PX) -> float:
+    """The zoom at which the extent of the points fills a viewport_px wide view."""
+    span = max(float(np.ptp(x)) if len(x) else 0.0, float(np.ptp(y)) if len(y) else 0.0, 1e-9)
+    return min(max(math.floor(math.log2(viewport_px / TILE_SIZE / span)), 0), 22)
+
+def douglas_peucker(x: np.ndarray, y: np.ndarray, starts: np.ndarray, ends: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of many polylines at once.
+
+    The polylines are the inclusive index ranges [starts[i], ends[i]] of x/y.
+    Instead of recursing per segment, every open segment of every polyline is
+    refined in the same vectorized pass, so the number of Python iterations is
+    the recursion depth, not the number of segments.
+
+    Returns:
+        np.ndarray: Boolean mask of the points to keep.
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    while True:
+        interior = ends - starts - 1
+        open_ = interior > 0
+        starts, ends, interior = starts[open_], ends[open_], interior[open_]
+        if not len(starts):
+            return keep
+
+        # Indices of the interior points of every segment, segment after segment
+        offsets = np.concatenate(([0], np.cumsum(interior)[:-1]))
+        segment = np.repeat(np.arange(len(starts)), interior)
+        index = np.arange(interior.sum()) - offsets[segment] + starts[segment] + 1
+
+        # Distance to the chord, clamped to its end points so closed loops
+        # (start == end position) still measure how far the track wandered
+        ax, ay = x[starts][segment], y[starts][segment]
+        dx, dy = x[ends][segment] - ax, y[ends][segment] - ay
+        px, py = x[index] - ax, y[index] - ay
+        length2 = dx * dx + dy * dy
+        t = np.clip(np.divide(px * dx + py * dy, length2, out=np.zeros_like(length2), where=length2 > 0), 0, 1)
+        distance = np.hypot(px - t * dx, py - t * dy)
+
+        farthest = np.maximum.reduceat(distance, offsets)
+        is_farthest = distance == farthest[segment]
+        split = np.minimum.reduceat(np.where(is_farthest, index, len(x)), offsets)
+        refine = farthest > tolerance
+        split, starts, ends = split[refine], starts[refine], ends[refine]
+        keep[split] = True
+        starts, ends = np.concatenate((starts, split)), np.concatenate((split, ends))
+
+def simplify_tracks(table: pa.Table, zoom: Optional[float] = None, tolerance_px: float = 1.0) -> Tuple[pa.Table, dict]:
+    """
+    Simplifies the tracks in a table from load_tracks to what is visible at a
+    zoom level: points closer than tolerance_px pixels to the simplified line
+    are dropped. Without a zoom, the zoom that fits all tracks on screen is used.
+
+    Returns:
+        Tuple[pa.Table, dict]: The kept points, and per MMSI raw point counts plus the zoom used.
+    """
+    if table.num_rows == 0:
+        return table, {'zoom': zoom, 'raw_points': {}}
+    mmsi = table.column('MMSI').to_numpy()
+    x, y = project(table.column('LAT').to_numpy(), table.column('LON').to_numpy())
+    if zoom is None:
+        zoom = fit_zoom(x, y)
+
+    # Each vessel is its own polyline
+    boundaries = np.flatnonzero(mmsi[1:] != mmsi[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(mmsi)])) - 1
+    keep = douglas_peucker(x, y, starts, ends, pixel_tolerance(zoom, tolerance_px))
+
+    raw_points = dict(zip(mmsi[starts].tolist(), (ends - starts + 1).tolist()))
+    return table.filter(pa.array(keep)), {'zoom': zoom, 'raw_points': raw_points}
+
+def to_tracks_json(table: pa.Table, info: dict) -> bytes:
+    """
+    Encodes simplified tracks as one polyline per vessel:
+    {"zoom": z, "tracks": [{"MMSI": m, "raw_points": n, "points": k, "BaseDateTime": [...], "LAT": [...], ...}]}
+    """
+    tracks = []
+    if table.num_rows:
+        table = _json_ready(table)
+        mmsi = table.column('MMSI').to_numpy()
+        boundaries = np.concatenate(([0], np.flatnonzero(mmsi[1:] != mmsi[:-1]) + 1, [len(mmsi)]))
+        columns = [name for name in table.column_names if name != 'MMSI']
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            track = table.slice(start, end - start)
+            vessel = int(mmsi[start])
+            tracks.append({
+                'MMSI': vessel,
+                'raw_points': info['raw_points'].get(vessel, end - start),
+                'points': int(end - start),
+                **{name: track.column(name).to_pylist() for name in columns},
+            })
+    return json.dumps({'zoom': info['zoom'], 'tracks': tracks}, separators=(',', ':')).encode()
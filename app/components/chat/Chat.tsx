@@ -164,7 +164,9 @@ export default function Chat({ onZoomRequest, mapRef }: ChatProps) {
           message: messageToSend, 
           history: currentHistory, 
           image_description: imageDesc, 
-          tool_result: toolResult
+          tool_result: toolResult,
+          // Lets the backend answer get_map_summary itself, without a tool_call round trip
+          viewport: mapRef?.current?.getViewport?.() ?? null
         }),
       })
 
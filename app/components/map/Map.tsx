@@ -4,7 +4,7 @@ import { useRef, useEffect, useState, forwardRef, useImperativeHandle } from 're
 import mapboxgl from 'mapbox-gl'
 import 'mapbox-gl/dist/mapbox-gl.css'
 import { MAPBOX_CONFIG, validateMapboxToken } from '@/lib/map/mapbox'
-import { fetchVessels } from '@/lib/api/vessels'
+import { subscribeLiveVessels } from '@/lib/api/liveVessels'
 import { AISData } from '@/lib/adapters/types'
 import VesselMarker from './VesselMarker'
 import MapStyleIndicator from './MapStyleIndicator'
@@ -21,9 +21,18 @@ export interface MapSummaryData {
   error?: string;
 }
 
+// Visible map bounds, sent with chat messages so the backend can summarize the view itself
+export interface MapViewport {
+  min_lat: number;
+  max_lat: number;
+  min_lon: number;
+  max_lon: number;
+}
+
 export interface MapHandle {
   triggerZoomAndGetDescription: (location: string, level: number) => Promise<string | null>;
   getMapSummaryData: () => Promise<MapSummaryData>;
+  getViewport: () => MapViewport | null;
 }
 
 const Map = forwardRef<MapHandle>((props, ref) => {
@@ -195,54 +204,47 @@ const Map = forwardRef<MapHandle>((props, ref) => {
         console.error("Map Handle: Error generating map summary:", error);
         return { count: 0, error: `Failed to generate summary: ${(error as Error).message}` };
       }
+    },
+
+    getViewport: (): MapViewport | null => {
+      const bounds = map.current && mapLoaded ? map.current.getBounds() : null;
+      if (!bounds) {
+        return null;
+      }
+      return {
+        min_lat: bounds.getSouth(),
+        max_lat: bounds.getNorth(),
+        min_lon: bounds.getWest(),
+        max_lon: bounds.getEast(),
+      };
     }
   }));
 
   useEffect(() => {
-    async function loadVessels() {
-      try {
-        setLoading(true);
-        // Fetch raw data (assuming it matches backend structure)
-        const rawVesselData: any[] = await fetchVessels(); // Use any[] temporarily
-        
-        // Map raw data to the clean AISData structure
-        const mappedVessels: AISData[] = rawVesselData.map(raw => ({
-          MMSI: raw.MMSI,
-          uniqueKey: `${raw.MMSI}-${raw.BaseDateTime}`, // Generate key
-          timestamp: raw.BaseDateTime,
-          position: {
-            lat: raw.LAT,
-            lon: raw.LON
-          },
-          heading: raw.Heading,
-          speed: raw.SOG, // Map SOG to speed
-          vesselInfo: {
-            name: raw.VesselName,
-            callSign: raw.CallSign,
-            // TODO: Map VesselType number to a meaningful string if needed
-            type: raw.VesselType !== undefined ? String(raw.VesselType) : undefined, 
-            imo: raw.IMO
-          },
-          // Include other fields directly if needed
-          Status: raw.Status,
-          Length: raw.Length,
-          Width: raw.Width,
-          Draft: raw.Draft,
-          COG: raw.COG,
-          TransceiverClass: raw.TransceiverClass
-        }));
-
-        setVessels(mappedVessels); // Set state with the processed data
-      } catch (error) {
-        console.error('Failed to load vessel data:', error);
-      } finally {
-        setLoading(false);
-      }
-    }
-    
-    if (mapLoaded) {
-      loadVessels();
-    }
+    if (!mapLoaded || !map.current) return;
+    const currentMap = map.current;
+    // Snapshot of the visible vessels, then only what changed as they move
+    // or the map is panned, over one WebSocket
+    const subscription = subscribeLiveVessels((liveVessels) => {
+      setVessels(liveVessels);
+      setLoading(false);
+    });
+    const sendViewport = () => {
+      const bounds = currentMap.getBounds();
+      if (!bounds) return;
+      subscription.setViewport({
+        min_lat: bounds.getSouth(),
+        max_lat: bounds.getNorth(),
+        min_lon: bounds.getWest(),
+        max_lon: bounds.getEast(),
+      });
+    };
+    sendViewport();
+    currentMap.on('moveend', sendViewport);
+    return () => {
+      currentMap.off('moveend', sendViewport);
+      subscription.close();
+    };
   }, [mapLoaded]);
 
   useEffect(() => {
@@ -1,7 +1,76 @@
-// Placeholder for satellite imagery data adapter
-// In a real implementation, this would connect to Maxar's satellite imagery API
+// Satellite imagery adapter for local Maxar scenes (GeoTIFF/COG files)
+// served by the Python backend's imagery service, see ai/imagery.py
 
-export async function fetchSatelliteImagery(lat: number, lon: number, date?: string) {
-  // Fetch satellite imagery for the given coordinates
-  return null
-}
\ No newline at end of file
+const IMAGERY_API_URL = 'http://localhost:8000/api/imagery';
+
+// XYZ raster tile template for a Mapbox raster source; tiles where no scene has data are empty (204)
+export const SATELLITE_TILE_URL = `${IMAGERY_API_URL}/tiles/{z}/{x}/{y}.png`;
+
+export interface SatelliteScene {
+  id: string;
+  min_lat: number;
+  max_lat: number;
+  min_lon: number;
+  max_lon: number;
+  acquired: string | null;
+  width: number;
+  height: number;
+  bands: number;
+  dtype: string;
+  resolution_m: number;
+  overviews: number[];
+  size_bytes: number;
+}
+
+export interface VesselChip {
+  MMSI: number;
+  LAT: number;
+  LON: number;
+  ReportOffsetSeconds: number;
+  VesselName: string | null;
+  VesselType: number | null;
+  Length: number | null;
+  Width: number | null;
+  SOG: number | null;
+  COG: number | null;
+  scene: string;
+  acquired: string | null;
+  image: string; // PNG data URL
+}
+
+export interface ImageryBounds {
+  min_lat: number;
+  max_lat: number;
+  min_lon: number;
+  max_lon: number;
+}
+
+// Scenes covering a point, newest first, optionally only those acquired on a date (YYYY-MM-DD)
+export async function fetchSatelliteImagery(lat: number, lon: number, date?: string): Promise<SatelliteScene[]> {
+  const params = new URLSearchParams({
+    min_lat: String(lat), max_lat: String(lat), min_lon: String(lon), max_lon: String(lon),
+  });
+  const response = await fetch(`${IMAGERY_API_URL}/scenes?${params}`);
+  if (!response.ok) {
+    console.error(`Imagery API error: ${response.status}`, await response.text());
+    return [];
+  }
+  const scenes: SatelliteScene[] = await response.json();
+  return date ? scenes.filter(scene => scene.acquired?.startsWith(date)) : scenes;
+}
+
+// Image chips of the vessels in a bbox, cropped from the scenes covering it
+// where AIS placed each vessel at the scene's acquisition time
+export async function fetchVesselChips(bounds: ImageryBounds, time?: string): Promise<VesselChip[]> {
+  const response = await fetch(`${IMAGERY_API_URL}/chips`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ...bounds, time }),
+  });
+  if (!response.ok) {
+    console.error(`Imagery API error: ${response.status}`, await response.text());
+    return [];
+  }
+  const result: { chips: VesselChip[] } = await response.json();
+  return result.chips;
+}
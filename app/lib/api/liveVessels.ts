@@ -0,0 +1,124 @@
+// Client for the backend's /api/live WebSocket: latest vessel positions for
+// the map's viewport, sent as one snapshot and then only the vessels that
+// appeared, moved or expired. See ai/live.py for the message format.
+
+import { AISData } from '../adapters/types';
+
+const LIVE_URL = 'ws://localhost:8000/api/live';
+// Wait before reconnecting after the socket closes
+const RECONNECT_MS = 3000;
+
+export interface LiveViewport {
+  min_lat: number;
+  max_lat: number;
+  min_lon: number;
+  max_lon: number;
+}
+
+// Parallel arrays, one entry per vessel
+type LiveColumns = Record<string, (number | string | null)[]>;
+
+interface LiveMessage {
+  type: 'snapshot' | 'delta' | 'error';
+  time?: string;
+  new?: LiveColumns;
+  moved?: LiveColumns;
+  expired?: number[];
+  detail?: string;
+}
+
+export interface LiveSubscription {
+  setViewport: (viewport: LiveViewport) => void;
+  close: () => void;
+}
+
+function rows(columns: LiveColumns | undefined): Record<string, any>[] {
+  if (!columns || !columns.MMSI) return [];
+  return columns.MMSI.map((_, i) =>
+    Object.fromEntries(Object.entries(columns).map(([name, values]) => [name, values[i]]))
+  );
+}
+
+function toAISData(raw: Record<string, any>, time: string): AISData {
+  return {
+    MMSI: raw.MMSI,
+    uniqueKey: String(raw.MMSI),
+    timestamp: time,
+    position: { lat: raw.LAT, lon: raw.LON },
+    heading: raw.Heading ?? undefined,
+    speed: raw.SOG ?? undefined,
+    vesselInfo: {
+      name: raw.VesselName,
+      type: raw.VesselType !== undefined && raw.VesselType !== null ? String(raw.VesselType) : undefined,
+    },
+    Length: raw.Length ?? undefined,
+    Width: raw.Width ?? undefined,
+    COG: raw.COG ?? undefined,
+  };
+}
+
+// Keeps the vessels of the current viewport up to date and calls onChange
+// with all of them after every message. Reconnects (with a fresh snapshot)
+// if the socket drops.
+export function subscribeLiveVessels(onChange: (vessels: AISData[]) => void): LiveSubscription {
+  const vessels = new Map<number, AISData>();
+  let socket: WebSocket | null = null;
+  let viewport: LiveViewport | null = null;
+  let closed = false;
+  let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+
+  const sendViewport = () => {
+    if (socket && socket.readyState === WebSocket.OPEN && viewport) {
+      socket.send(JSON.stringify({ type: 'viewport', ...viewport }));
+    }
+  };
+
+  const handle = (message: LiveMessage) => {
+    if (message.type === 'error') {
+      console.error('Live feed error:', message.detail);
+      return;
+    }
+    const time = message.time ?? '';
+    if (message.type === 'snapshot') vessels.clear();
+    for (const raw of rows(message.new)) {
+      vessels.set(raw.MMSI, toAISData(raw, time));
+    }
+    for (const raw of rows(message.moved)) {
+      const vessel = vessels.get(raw.MMSI);
+      if (!vessel) continue;
+      vessels.set(raw.MMSI, {
+        ...vessel,
+        timestamp: time,
+        position: { lat: raw.LAT, lon: raw.LON },
+        speed: raw.SOG ?? undefined,
+        COG: raw.COG ?? undefined,
+      });
+    }
+    for (const mmsi of message.expired ?? []) {
+      vessels.delete(mmsi);
+    }
+    onChange(Array.from(vessels.values()));
+  };
+
+  const connect = () => {
+    socket = new WebSocket(LIVE_URL);
+    socket.onopen = sendViewport;
+    socket.onmessage = (event) => handle(JSON.parse(event.data));
+    socket.onclose = () => {
+      if (!closed) reconnectTimer = setTimeout(connect, RECONNECT_MS);
+    };
+  };
+  connect();
+
+  return {
+    setViewport: (next: LiveViewport) => {
+      viewport = next;
+      sendViewport();
+    },
+    close: () => {
+      closed = true;
+      if (reconnectTimer) clearTimeout(reconnectTimer);
+      socket?.close();
+    },
+  };
+}